@@ -2,7 +2,8 @@ import octoprint.plugin
 import octoprint.access.permissions as permissions
 from octoprint.events import Events
 import flask
-from .flasher import PlatformIOFlasher, ArduinoFlasher
+import os
+from .flasher import PlatformIOFlasher, ArduinoFlasher, ObjectCache, ArtifactStore, ProcessRunner
 from .flasher.retrieving_method import RetrievingMethod
 from .validation import ArduinoValidator, PlatformIOValidator
 from .settings import SettingsWrapper
@@ -18,8 +19,11 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 
 	def initialize(self):
 		self.__settings_wrapper = SettingsWrapper(self._settings)
-		self.__arduino = ArduinoFlasher(self.__settings_wrapper, self._printer, self, self._plugin_manager, self._identifier, self._logger)
-		self.__platformio = PlatformIOFlasher(self.__settings_wrapper, self._printer, self, self._plugin_manager, self._identifier, self._logger)
+		self.__process_runner = ProcessRunner(self._logger)
+		self.__object_cache = ObjectCache(os.path.join(self.get_plugin_data_folder(), "object_cache"), self._logger, self.__process_runner)
+		self.__artifact_store = ArtifactStore(os.path.join(self.get_plugin_data_folder(), "artifacts"), self._logger)
+		self.__arduino = ArduinoFlasher(self.__settings_wrapper, self._printer, self, self._plugin_manager, self._identifier, self._logger, self.__object_cache, self.__artifact_store, self.__process_runner)
+		self.__platformio = PlatformIOFlasher(self.__settings_wrapper, self._printer, self, self._plugin_manager, self._identifier, self._logger, self.__object_cache, self.__artifact_store, self.__process_runner)
 		self.__arduino_validator = ArduinoValidator(self.__settings_wrapper)
 		self.__platformio_validator = PlatformIOValidator(self.__settings_wrapper)
 
@@ -29,6 +33,9 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 				sketch_ino="Marlin.ino",
 				cli_path=None,
 				additional_urls=None,
+				build_cache_size=100,
+				native_upload=False,
+				differential_upload=False,
 				last_flash_options={}
 			),
 			platformio=dict(
@@ -41,9 +48,45 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 			pre_flash_delay=0,
 			post_flash_script=None,
 			post_flash_delay=0,
+			speculative_build=False,
+			object_cache_size=500,
+			artifact_store_size=200,
+			fleet_max_workers=4,
+			port_release_timeout=10,
+			flash_budgets=dict(
+				compile=3600,
+				upload=600,
+				reconnect=120
+			),
+			download=dict(
+				connect_timeout=10,
+				read_timeout=30
+			),
+			build_scheduler=dict(
+				enabled=True,
+				busy=dict(
+					jobs=0,
+					nice=10,
+					ionice="idle",
+					cpus=self.__get_last_cpu()
+				),
+				idle=dict(
+					jobs=0,
+					nice=0,
+					ionice="best-effort",
+					cpus=""
+				)
+			),
 			retrieving_method=RetrievingMethod.UPLOAD
 		)
 
+	@staticmethod
+	def __get_last_cpu():
+		# CPU 0 serves most interrupts, the USB serial link of the printer among them, the last one is left to builds
+		if not hasattr(os, "sched_getaffinity"):
+			return ""
+		return str(max(os.sched_getaffinity(0)))
+
 	def get_settings_version(self):
 		return 1
 
@@ -92,12 +135,14 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 	def is_wizard_required(self):
 		return True
 
-	def on_event(self, event, payload):
+	def __get_flasher(self):
 		platform = self.__settings_wrapper.get_platform_type()
 		if platform == PlatformType.ARDUINO:
-			flasher = self.__arduino
-		else:
-			flasher = self.__platformio
+			return self.__arduino
+		return self.__platformio
+
+	def on_event(self, event, payload):
+		flasher = self.__get_flasher()
 		if event == Events.CONNECTED:
 			self._logger.debug("Intercepted CONNECTED event")
 			flasher.handle_connected_event()
@@ -120,6 +165,22 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 			return flask.make_response(flask.jsonify(errors), 400)
 		return self.__handle_unvalidated_request(handler)
 
+	@octoprint.plugin.BlueprintPlugin.route("/object_cache/stats", methods=["GET"])
+	@permissions.Permissions.ADMIN.require(403)
+	def object_cache_stats(self):
+		return self.__handle_unvalidated_request(self.__get_object_cache_stats)
+
+	def __get_object_cache_stats(self):
+		return self.__object_cache.get_stats(), None
+
+	@octoprint.plugin.BlueprintPlugin.route("/artifacts", methods=["GET"])
+	@permissions.Permissions.ADMIN.require(403)
+	def list_artifacts(self):
+		return self.__handle_unvalidated_request(self.__list_artifacts)
+
+	def __list_artifacts(self):
+		return self.__artifact_store.list(), None
+
 	####################################################################
 	# Arduino
 	####################################################################
@@ -169,6 +230,11 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 	def uninstall_arduino_lib(self):
 		return self.__handle_validated_request(self.__arduino_validator.validate_lib_uninstall, self.__arduino.lib_uninstall, self.__arduino.check_setup_errors)
 
+	@octoprint.plugin.BlueprintPlugin.route("/arduino/boards", methods=["GET"])
+	@permissions.Permissions.ADMIN.require(403)
+	def search_arduino_boards(self):
+		return self.__handle_unvalidated_request(self.__arduino.board_search)
+
 	@octoprint.plugin.BlueprintPlugin.route("/arduino/board/details", methods=["GET"])
 	@permissions.Permissions.ADMIN.require(403)
 	def board_detail(self):
@@ -179,6 +245,26 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 	def arduino_flash(self):
 		return self.__handle_validated_request(self.__arduino_validator.validate_flash, self.__arduino.flash, self.__arduino.check_setup_errors)
 
+	@octoprint.plugin.BlueprintPlugin.route("/arduino/flash/cancel", methods=["POST"])
+	@permissions.Permissions.ADMIN.require(403)
+	def arduino_cancel_flash(self):
+		return self.__handle_unvalidated_request(self.__arduino.cancel_flash)
+
+	@octoprint.plugin.BlueprintPlugin.route("/arduino/fleet/flash", methods=["POST"])
+	@permissions.Permissions.ADMIN.require(403)
+	def arduino_fleet_flash(self):
+		return self.__handle_validated_request(self.__arduino_validator.validate_fleet_flash, self.__arduino.fleet_flash, self.__arduino.check_setup_errors)
+
+	@octoprint.plugin.BlueprintPlugin.route("/arduino/firmware/configuration", methods=["GET"])
+	@permissions.Permissions.ADMIN.require(403)
+	def arduino_firmware_configuration(self):
+		return self.__handle_unvalidated_request(self.__arduino.firmware_configuration)
+
+	@octoprint.plugin.BlueprintPlugin.route("/arduino/artifacts/flash", methods=["POST"])
+	@permissions.Permissions.ADMIN.require(403)
+	def arduino_artifact_flash(self):
+		return self.__handle_validated_request(self.__arduino_validator.validate_artifact_flash, self.__arduino.artifact_flash, self.__arduino.check_setup_errors)
+
 	####################################################################
 	# PlatformIO
 	####################################################################
@@ -203,6 +289,31 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 	def platformio_flash(self):
 		return self.__handle_validated_request(self.__platformio_validator.validate_flash, self.__platformio.flash, self.__platformio.check_setup_errors)
 
+	@octoprint.plugin.BlueprintPlugin.route("/platformio/flash/cancel", methods=["POST"])
+	@permissions.Permissions.ADMIN.require(403)
+	def platformio_cancel_flash(self):
+		return self.__handle_unvalidated_request(self.__platformio.cancel_flash)
+
+	@octoprint.plugin.BlueprintPlugin.route("/platformio/fleet/flash", methods=["POST"])
+	@permissions.Permissions.ADMIN.require(403)
+	def platformio_fleet_flash(self):
+		return self.__handle_validated_request(self.__platformio_validator.validate_fleet_flash, self.__platformio.fleet_flash, self.__platformio.check_setup_errors)
+
+	@octoprint.plugin.BlueprintPlugin.route("/platformio/firmware/configuration", methods=["GET"])
+	@permissions.Permissions.ADMIN.require(403)
+	def platformio_firmware_configuration(self):
+		return self.__handle_unvalidated_request(self.__platformio.firmware_configuration)
+
+	@octoprint.plugin.BlueprintPlugin.route("/platformio/firmware/boards", methods=["GET"])
+	@permissions.Permissions.ADMIN.require(403)
+	def platformio_firmware_boards(self):
+		return self.__handle_unvalidated_request(self.__platformio.firmware_boards)
+
+	@octoprint.plugin.BlueprintPlugin.route("/platformio/artifacts/flash", methods=["POST"])
+	@permissions.Permissions.ADMIN.require(403)
+	def platformio_artifact_flash(self):
+		return self.__handle_validated_request(self.__platformio_validator.validate_artifact_flash, self.__platformio.artifact_flash, self.__platformio.check_setup_errors)
+
 	@octoprint.plugin.BlueprintPlugin.route("/platformio/account/login", methods=["POST"])
 	@permissions.Permissions.ADMIN.require(403)
 	def platformio_login(self):
@@ -262,12 +373,16 @@ class MarlinFlasherPlugin(octoprint.plugin.SettingsPlugin,
 			("POST", r"/platformio/upload_firmware", self.__settings_wrapper.get_max_upload_size() * 1024 * 1024)
 		]
 
+	def gcode_received_hook(self, comm_instance, line, *args, **kwargs):
+		self.__get_flasher().handle_gcode_received(line)
+		return line
+
 	def additional_excludes_hook(self, excludes, *args, **kwargs):
-		return ["arduino-cli", "platformio", "firmware_arduino", "firmware_platformio"]
+		return ["arduino-cli", "platformio", "firmware_arduino", "firmware_platformio", "build_cache_arduino", "object_cache", "downloads", "packages", "arduino-cli.staging", "arduino-cli.previous", "artifacts", "config_index", "pins_index", "flash_records"]
 
 
 __plugin_name__ = "Marlin Flasher"
-__plugin_pythoncompat__ = ">=3.7,<4"
+__plugin_pythoncompat__ = ">=3.8,<4"
 
 
 def __plugin_load__():
@@ -278,5 +393,6 @@ def __plugin_load__():
 	__plugin_hooks__ = {
 		"octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information,
 		"octoprint.server.http.bodysize": __plugin_implementation__.body_size_hook,
-		"octoprint.plugin.backup.additional_excludes": __plugin_implementation__.additional_excludes_hook
+		"octoprint.plugin.backup.additional_excludes": __plugin_implementation__.additional_excludes_hook,
+		"octoprint.comm.protocol.gcode.received": __plugin_implementation__.gcode_received_hook
 	}
@@ -1,2 +1,5 @@
 from .platformio_flasher import PlatformIOFlasher
 from .arduino_flasher import ArduinoFlasher
+from .object_cache import ObjectCache
+from .artifact_store import ArtifactStore
+from .process_runner import ProcessRunner
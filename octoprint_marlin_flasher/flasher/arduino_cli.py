@@ -0,0 +1,49 @@
+import json
+import pyduinocli
+from pyduinocli.commands.base import CommandBase
+
+
+class ArduinoCli:
+
+	@staticmethod
+	def create(cli_path, additional_urls, start):
+		arduino = pyduinocli.Arduino(cli_path, additional_urls=additional_urls)
+		ArduinoCli.__bind(arduino, start)
+		return arduino
+
+	@staticmethod
+	def __bind(command, start):
+		# pyduinocli spawns arduino-cli itself, nothing could stop it, every command goes through start instead
+		command._exec = lambda args: ArduinoCli.__exec(command, args, start)
+		for value in vars(command).values():
+			if isinstance(value, CommandBase) and value is not command:
+				ArduinoCli.__bind(value, start)
+
+	@staticmethod
+	def __exec(command, args, start):
+		stdout = []
+		stderr = []
+		result = start(list(command._base_args) + list(args), stdout.append, stderr.append)
+		stdout = "".join(stdout).strip()
+		stderr = "".join(stderr).strip()
+		if result.returncode is None and not result.cancelled and not result.timed_out:
+			raise OSError("Unable to run %s : %s" % (command._base_args[0], stdout or stderr))
+		output = dict(
+			__stdout=stdout,
+			__stderr=stderr,
+			result=ArduinoCli.__parse_output(stdout)
+		)
+		if result.cancelled:
+			output["result"] = "arduino-cli was stopped"
+		elif result.timed_out:
+			output["result"] = "arduino-cli did not complete in time"
+		if not result.success:
+			raise pyduinocli.ArduinoError(output)
+		return output
+
+	@staticmethod
+	def __parse_output(data):
+		try:
+			return json.loads(data)
+		except ValueError:
+			return data
@@ -1,27 +1,52 @@
 import platform
 
 from .base_flasher import BaseFlasher
+from .build_cache import BuildCache
+from .firmware_ingest import FirmwareIngest
+from .package_cache import PackageCache
+from .artifact_store import ArtifactStore
+from .flasher_error import FlasherError
+from .intel_hex import IntelHexReader
+from .stk500 import Stk500Programmer
+from .flash_record import FlashRecordStore
+from .flash_job import FlashPhase
+from .board_catalog import BoardCatalog
+from .arduino_cli import ArduinoCli
 import zipfile
 import re
 import os
 import shutil
-from threading import Thread
 from datetime import datetime
 import serial
 import flask
 from flask_babel import gettext
 import pyduinocli
-import intelhex
 import requests
 import tarfile
-import io
 
 
 class ArduinoFlasher(BaseFlasher):
 
-	def __init__(self, settings, printer, plugin, plugin_manager, identifier, logger):
-		BaseFlasher.__init__(self, settings, printer, plugin, plugin_manager, identifier, logger)
+	# arduino-cli only compiles the files at the root of the sketch and the ones in its src folder
+	EXTRACTION_RULES = [
+		("include", "src/*"),
+		("exclude", "*/*")
+	]
+
+	def __init__(self, settings, printer, plugin, plugin_manager, identifier, logger, object_cache, artifact_store, process_runner):
+		BaseFlasher.__init__(self, settings, printer, plugin, plugin_manager, identifier, logger, object_cache, artifact_store, process_runner)
 		self.__is_ino = False
+		self.__board_properties = dict()
+		self.__build_cache = BuildCache(os.path.join(plugin.get_plugin_data_folder(), "build_cache_arduino"), logger)
+		self.__firmware_ingest = FirmwareIngest(logger)
+		self.__package_cache = PackageCache(os.path.join(plugin.get_plugin_data_folder(), "packages"), logger)
+		self.__content_hash = None
+		self.__prebuilt_build = None
+		self.__hex_reader = IntelHexReader()
+		self.__hex_image = None
+		self.__validated_hex_image = None
+		self.__flash_records = FlashRecordStore(os.path.join(plugin.get_plugin_data_folder(), "flash_records"), logger)
+		self.__board_catalog = BoardCatalog(logger)
 
 	def start_install(self):
 		self._logger.info("Starting the installation of arduino-cli")
@@ -61,94 +86,95 @@ class ArduinoFlasher(BaseFlasher):
 		), None
 
 	def __install(self, operating_system, arch, ext):
-		installation_path = os.path.join(self._plugin.get_plugin_data_folder(), "arduino-cli")
+		data_folder = self._plugin.get_plugin_data_folder()
+		installation_path = os.path.join(data_folder, "arduino-cli")
+		staging_path = os.path.join(data_folder, "arduino-cli.staging")
+		previous_path = os.path.join(data_folder, "arduino-cli.previous")
 		installed_version = "0.35.3"
-		url = "https://github.com/arduino/arduino-cli/releases/download/v{version}/arduino-cli_{version}_{os}_{arch}.{ext}"
-		download_url = url.format(version=installed_version, os=operating_system, arch=arch, ext=ext)
-		self._logger.info("Downloading %s" % download_url)
-		self._plugin_manager.send_plugin_message(self._identifier, dict(
-			type="arduino_install",
-			finished=False,
-			status=gettext("Downloading %s") % download_url
-		))
+		url = "https://github.com/arduino/arduino-cli/releases/download/v{version}/{file}"
+		archive_name = "arduino-cli_{version}_{os}_{arch}.{ext}".format(version=installed_version, os=operating_system, arch=arch, ext=ext)
+		download_url = url.format(version=installed_version, file=archive_name)
+		checksums_url = url.format(version=installed_version, file="%s-checksums.txt" % installed_version)
+		connect_timeout = self._settings.get_download_connect_timeout()
+		read_timeout = self._settings.get_download_read_timeout()
+		self._logger.info("Retrieving %s" % download_url)
+		self.__push_install_status(gettext("Retrieving %s") % download_url)
 		try:
-			r = requests.get(download_url)
-		except requests.exceptions.RequestException:
-			self._logger.warning("Failed to download %s" % download_url)
-			self._plugin_manager.send_plugin_message(self._identifier, dict(
-				type="arduino_install",
-				finished=True,
-				success=False,
-				status=gettext("Failed to download %s") % download_url
-			))
+			checksums = self.__package_cache.get_checksums(checksums_url, connect_timeout, read_timeout)
+			if archive_name not in checksums:
+				raise FlasherError("No checksum found for %s" % archive_name)
+			archive_path = self.__package_cache.get(download_url, checksums[archive_name], connect_timeout, read_timeout)
+		except (requests.exceptions.RequestException, OSError, FlasherError) as e:
+			self._logger.warning("Failed to download %s : %s" % (download_url, getattr(e, "message", e)))
+			self.__push_install_status(gettext("Failed to download %s") % download_url, finished=True, success=False)
 			return
-		if os.path.exists(installation_path):
-			self._logger.info("Previous installation found in %s, removing it" % installation_path)
-			self._plugin_manager.send_plugin_message(self._identifier, dict(
-				type="arduino_install",
-				finished=False,
-				status=gettext("Previous installation found in %s, removing it") % installation_path
-			))
-			shutil.rmtree(installation_path)
 		try:
+			if os.path.exists(staging_path):
+				shutil.rmtree(staging_path)
 			if ext == "zip":
-				file = zipfile.ZipFile(io.BytesIO(r.content), "r")
+				file = zipfile.ZipFile(archive_path, "r")
 			else:
-				file = tarfile.open(fileobj=io.BytesIO(r.content), mode="r:gz")
+				file = tarfile.open(archive_path, mode="r:gz")
 			with file as archive:
-				self._logger.info("Extracting in %s" % installation_path)
-				self._plugin_manager.send_plugin_message(self._identifier, dict(
-					type="arduino_install",
-					finished=False,
-					status=gettext("Extracting in %s") % installation_path
-				))
-				archive.extractall(installation_path)
-				if operating_system == "Windows":
-					executable_name = "arduino-cli.exe"
-				else:
-					executable_name = "arduino-cli"
-				executable_path = os.path.join(installation_path, executable_name)
-				self._logger.info("Installing arduino:avr core")
-				self._plugin_manager.send_plugin_message(self._identifier, dict(
-					type="arduino_install",
-					finished=False,
-					status=gettext("Installing arduino:avr core")
-				))
-				try:
-					temp_arduino = pyduinocli.Arduino(executable_path)
-					temp_arduino.core.update_index()
-					temp_arduino.core.install(["arduino:avr"])
-					self._logger.info("arduino:avr core installed successfully")
-					self._plugin_manager.send_plugin_message(self._identifier, dict(
-						type="arduino_install",
-						finished=False,
-						status=gettext("arduino:avr core installed successfully")
-					))
-					self._logger.info("Successfully installed arduino-cli in %s" % installation_path)
-					self._plugin_manager.send_plugin_message(self._identifier, dict(
-						type="arduino_install",
-						finished=True,
-						success=True,
-						path=executable_path,
-						status=gettext("Successfully installed arduino-cli in %s") % installation_path
-					))
-				except pyduinocli.ArduinoError:
-					self._logger.warning("Failed to install arduino:avr core")
-					self._plugin_manager.send_plugin_message(self._identifier, dict(
-						type="arduino_install",
-						finished=True,
-						success=False,
-						status=gettext("Failed to install arduino:avr core")
-					))
-					return
+				self._logger.info("Extracting in %s" % staging_path)
+				self.__push_install_status(gettext("Extracting in %s") % staging_path)
+				archive.extractall(staging_path)
 		except:
 			self._logger.warning("Failed to extract downloaded archive")
-			self._plugin_manager.send_plugin_message(self._identifier, dict(
-				type="arduino_install",
-				finished=True,
-				success=False,
-				status=gettext("Failed to extract downloaded archive")
-			))
+			self.__push_install_status(gettext("Failed to extract downloaded archive"), finished=True, success=False)
+			return
+		if operating_system == "Windows":
+			executable_name = "arduino-cli.exe"
+		else:
+			executable_name = "arduino-cli"
+		try:
+			pyduinocli.Arduino(os.path.join(staging_path, executable_name)).version()
+		except (pyduinocli.ArduinoError, OSError):
+			self._logger.warning("The extracted arduino-cli does not run, keeping the previous installation")
+			shutil.rmtree(staging_path)
+			self.__push_install_status(gettext("The extracted arduino-cli does not run"), finished=True, success=False)
+			return
+		# The previous installation is only removed once the new one is known to work
+		if os.path.exists(previous_path):
+			shutil.rmtree(previous_path)
+		if os.path.exists(installation_path):
+			self._logger.info("Previous installation found in %s, replacing it" % installation_path)
+			self.__push_install_status(gettext("Previous installation found in %s, replacing it") % installation_path)
+			os.rename(installation_path, previous_path)
+		os.rename(staging_path, installation_path)
+		if os.path.exists(previous_path):
+			shutil.rmtree(previous_path)
+		# The path may not change, the boards listed by the previous installation are stale all the same
+		self.__board_catalog.invalidate()
+		self.__board_properties.clear()
+		executable_path = os.path.join(installation_path, executable_name)
+		self._logger.info("Installing arduino:avr core")
+		self.__push_install_status(gettext("Installing arduino:avr core"))
+		try:
+			temp_arduino = pyduinocli.Arduino(executable_path)
+			temp_arduino.core.update_index()
+			temp_arduino.core.install(["arduino:avr"])
+			self.__board_catalog.invalidate()
+			self.__board_properties.clear()
+			self._logger.info("arduino:avr core installed successfully")
+			self.__push_install_status(gettext("arduino:avr core installed successfully"))
+			self._logger.info("Successfully installed arduino-cli in %s" % installation_path)
+			self.__push_install_status(gettext("Successfully installed arduino-cli in %s") % installation_path, finished=True, success=True, path=executable_path)
+		except pyduinocli.ArduinoError:
+			self._logger.warning("Failed to install arduino:avr core")
+			self.__push_install_status(gettext("Failed to install arduino:avr core"), finished=True, success=False)
+
+	def __push_install_status(self, status, finished=False, success=None, path=None):
+		message = dict(
+			type="arduino_install",
+			finished=finished,
+			status=status
+		)
+		if finished:
+			message["success"] = success
+		if path is not None:
+			message["path"] = path
+		self._plugin_manager.send_plugin_message(self._identifier, message)
 
 	def _validate_firmware_file(self, file_path):
 		self._logger.debug("Validating firmware file, checking for zip...")
@@ -158,11 +184,10 @@ class ArduinoFlasher(BaseFlasher):
 		except zipfile.BadZipfile:
 			self._logger.debug("The firmware is not a zip file, checking if it's a .hex")
 			try:
-				ih = intelhex.IntelHex()
-				ih.loadhex(file_path)
+				self.__validated_hex_image = self.__hex_reader.read(file_path)
 				return None
-			except:
-				self._logger.debug("The firmware file is not valid")
+			except (FlasherError, OSError) as e:
+				self._logger.debug("The firmware file is not valid : %s" % e)
 				return [gettext("Invalid file type.")]
 
 	def _handle_firmware_file(self, firmware_file_path):
@@ -170,52 +195,96 @@ class ArduinoFlasher(BaseFlasher):
 		self._firmware_version = None
 		self._firmware_author = None
 		self._firmware_upload_time = None
+		self._artifact_id = None
+		self.__content_hash = None
+		self.__set_prebuilt_build(None)
+		self.__hex_image = None
 		firmware_dir = os.path.join(self._plugin.get_plugin_data_folder(), "firmware_arduino")
-		if os.path.exists(firmware_dir):
-			shutil.rmtree(firmware_dir)
 		try:
 			self._logger.debug("Trying to open firmware as zip file...")
 			with zipfile.ZipFile(firmware_file_path, "r") as zip_file:
 				self.__is_ino = True
-				sketch_dir = os.path.join(firmware_dir, *os.path.splitext(self._settings.get_arduino_sketch_ino())[0])
-				os.makedirs(sketch_dir)
+				sketch_ino = self._settings.get_arduino_sketch_ino()
+				self._logger.debug("Browsing archive members...")
+				project_root = self.__firmware_ingest.find_project_root(zip_file, sketch_ino)
+				if project_root is None:
+					return None, [gettext("No valid sketch were found in the given file.")]
+				self._logger.debug("Found .ino file")
+				# arduino-cli requires the sketch folder to be named after its main .ino file
+				sketch_name = os.path.splitext(sketch_ino)[0]
+				self.__clear_firmware_dir(firmware_dir, keep=sketch_name)
 				self._logger.debug("Extracting firmware archive...")
-				zip_file.extractall(sketch_dir)
-				self._logger.debug("Browsing files...")
-				for root, dirs, files in os.walk(sketch_dir):
-					for f in files:
-						if f == self._settings.get_arduino_sketch_ino():
-							self._logger.debug("Found .ino file")
-							self._firmware = root
-							self._firmware_upload_time = datetime.now()
-				if self._firmware:
-					self._find_firmware_info()
-					return dict(
-						path=self._firmware,
-						file=self._settings.get_arduino_sketch_ino()
-					), None
-				return None, [gettext("No valid sketch were found in the given file.")]
+				result = self.__firmware_ingest.ingest(
+					zip_file,
+					project_root,
+					os.path.join(firmware_dir, sketch_name),
+					os.path.join(self._plugin.get_plugin_data_folder(), "firmware_arduino.manifest.json"),
+					rules=self.EXTRACTION_RULES
+				)
+				self._logger.debug("Firmware extracted : %s" % result)
+				self._firmware = result.project_dir
+				self._firmware_version = result.version
+				self._firmware_author = result.author
+				self._firmware_upload_time = datetime.now()
+				self.__content_hash = result.content_hash
+				self._artifact_id = result.content_hash
+				self._store_sources("arduino", "sketch", sketch_ino, result.project_dir, self.__get_source_hashes(result.manifest))
+				return dict(
+					path=self._firmware,
+					file=sketch_ino
+				), None
 		except zipfile.BadZipfile:
 			self._logger.debug("Trying to open firmware as hex file...")
 			self.__is_ino = False
-			os.makedirs(firmware_dir)
+			self.__clear_firmware_dir(firmware_dir)
 			self._firmware = os.path.join(firmware_dir, "firmware.hex")
 			self._firmware_upload_time = datetime.now()
 			self._logger.debug("Copying file in plugin directory.")
 			shutil.copyfile(firmware_file_path, self._firmware)
+			self.__hex_image = self.__validated_hex_image
+			self._artifact_id = ArtifactStore.get_file_hash(self._firmware)
+			self._store_sources("arduino", "hex", "firmware.hex", firmware_dir, {"firmware.hex": self._artifact_id})
 			return dict(
 				path=firmware_dir,
 				file="firmware.hex"
 			), None
 
-	def __get_arduino(self):
+	@staticmethod
+	def __get_source_hashes(manifest):
+		return dict([(relative_path, entry["sha256"]) for relative_path, entry in manifest.items()])
+
+	@staticmethod
+	def __clear_firmware_dir(firmware_dir, keep=None):
+		os.makedirs(firmware_dir, exist_ok=True)
+		for entry in os.listdir(firmware_dir):
+			if entry == keep:
+				continue
+			path = os.path.join(firmware_dir, entry)
+			if os.path.isdir(path):
+				shutil.rmtree(path)
+			else:
+				os.remove(path)
+
+	def __get_arduino(self, job=None, scheduled=False):
 		path = self._settings.get_arduino_cli_path()
 		additional_urls = self._settings.get_arduino_additional_urls()
 		if additional_urls:
 			additional_urls = additional_urls.splitlines()
-		return pyduinocli.Arduino(path, additional_urls=additional_urls)
+		handle_observer = job.attach if job is not None else None
+
+		def start(command, line_handler, error_handler):
+			if scheduled:
+				return self._build_scheduler.run_process(self._process_runner, command, line_handler, handle_observer=handle_observer, error_handler=error_handler)
+			handle = self._process_runner.start(command, line_handler, error_handler=error_handler)
+			if handle_observer is not None:
+				handle_observer(handle)
+			return handle.wait()
+		return ArduinoCli.create(path, additional_urls, start)
 
-	def check_setup_errors(self):
+	def _get_cli_path(self):
+		return self._settings.get_arduino_cli_path()
+
+	def _check_setup_errors(self):
 		self._logger.debug("Checking arduino-cli configuration...")
 		no_arduino_path = self._settings.get_arduino_cli_path() is None
 		if no_arduino_path:
@@ -260,7 +329,8 @@ class ArduinoFlasher(BaseFlasher):
 			self._logger.debug("Installing core...")
 			arduino.core.install([flask.request.values["core"]])
 			self._logger.debug("Done")
-			self.__push_installed_boards()
+			self.__board_properties.clear()
+			self.__refresh_board_catalog()
 			return dict(
 				core=flask.request.values["core"]
 			), None
@@ -274,7 +344,8 @@ class ArduinoFlasher(BaseFlasher):
 			self._logger.debug("Uninstalling core...")
 			arduino.core.uninstall([flask.request.values["core"]])
 			self._logger.debug("Done")
-			self.__push_installed_boards()
+			self.__board_properties.clear()
+			self.__refresh_board_catalog()
 			return dict(
 				core=flask.request.values["core"]
 			), None
@@ -319,6 +390,15 @@ class ArduinoFlasher(BaseFlasher):
 			self._logger.debug("Failed !")
 			return None, [e.result["__stderr"]]
 
+	def board_search(self):
+		if not self.__board_catalog.is_loaded(self._get_cli_path()) and not self.__refresh_board_catalog():
+			return None, [gettext("The list of installed boards could not be retrieved.")]
+		if "fqbn" in flask.request.values:
+			board = self.__board_catalog.get(flask.request.values["fqbn"])
+			return [board] if board is not None else [], None
+		limit = flask.request.values.get("limit", type=int)
+		return self.__board_catalog.search(flask.request.values.get("query", ""), limit), None
+
 	def board_details(self):
 		try:
 			arduino = self.__get_arduino()
@@ -334,69 +414,224 @@ class ArduinoFlasher(BaseFlasher):
 		if self._firmware is None:
 			self._logger.debug("No firmware uploaded")
 			return None, [gettext("You did not upload the firmware or it got reset by the previous flash process.")]
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
 		if not self._printer.is_ready():
 			self._logger.debug("Printer not ready")
 			return None, [gettext("The printer may not be connected or it may be busy.")]
-		options = []
-		for param in flask.request.values:
-			if param != "fqbn":
-				options.append(f"{param}={flask.request.values[param]}")
-		options = ",".join(options)
-		fqbn = flask.request.values["fqbn"]
-		if options:
-			fqbn = f"{fqbn}:{options}"
-		thread = Thread(target=self.__background_flash, args=(fqbn,))
-		thread.start()
+		fqbn = self.__get_fqbn(flask.request.values)
+		job = self._start_flash_job(self.__background_flash, (fqbn,))
 		self._logger.debug("Saving options")
 		self._settings.set_arduino_last_flash_options(flask.request.values.to_dict())
 		self._settings.save()
 		self.__push_last_flash_option()
 		return dict(
-			message=gettext("Flash process started.")
+			message=gettext("Flash process started."),
+			job=job.get_id()
+		), None
+
+	def fleet_flash(self):
+		if self._firmware is None:
+			self._logger.debug("No firmware uploaded")
+			return None, [gettext("You did not upload the firmware or it got reset by the previous flash process.")]
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
+		ports = self._get_requested_ports()
+		errors = self._check_fleet_ports(ports)
+		if errors:
+			return None, errors
+		fqbn = self.__get_fqbn(flask.request.values)
+		job = self._start_flash_job(self.__background_fleet_flash, (fqbn, ports))
+		return dict(
+			message=gettext("Flash process started."),
+			job=job.get_id()
+		), None
+
+	def artifact_flash(self):
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
+		meta, fqbn, errors = self._get_requested_artifact("arduino")
+		if errors:
+			return None, errors
+		ports = self._get_requested_ports()
+		if ports:
+			errors = self._check_fleet_ports(ports)
+			if errors:
+				return None, errors
+		elif not self._printer.is_ready():
+			self._logger.debug("Printer not ready")
+			return None, [gettext("The printer may not be connected or it may be busy.")]
+		job = self._start_flash_job(self.__background_artifact_flash, (meta, fqbn, ports))
+		return dict(
+			message=gettext("Flash process started."),
+			job=job.get_id()
 		), None
 
+	def __background_artifact_flash(self, meta, fqbn, ports):
+		self.__load_artifact(meta, fqbn)
+		if ports:
+			self.__background_fleet_flash(fqbn, ports)
+		else:
+			self.__background_flash(fqbn)
+
+	def __load_artifact(self, meta, fqbn):
+		self._logger.info("Loading stored firmware %s" % meta["id"])
+		firmware_dir = os.path.join(self._plugin.get_plugin_data_folder(), "firmware_arduino")
+		sources = self._artifact_store.get_sources(meta["id"])
+		self.__set_prebuilt_build(None)
+		if meta["kind"] == "hex":
+			self.__is_ino = False
+			self.__clear_firmware_dir(firmware_dir)
+			self._firmware = os.path.join(firmware_dir, "firmware.hex")
+			self._artifact_store.copy_file(sources["firmware.hex"][0], self._firmware, sources["firmware.hex"][1])
+			self.__hex_image = self.__hex_reader.read(self._firmware)
+		else:
+			self.__is_ino = True
+			self.__hex_image = None
+			sketch_name = os.path.splitext(meta["file"])[0]
+			self.__clear_firmware_dir(firmware_dir, keep=sketch_name)
+			result = self.__firmware_ingest.restore(
+				sources,
+				os.path.join(firmware_dir, sketch_name),
+				os.path.join(self._plugin.get_plugin_data_folder(), "firmware_arduino.manifest.json")
+			)
+			self._logger.debug("Firmware restored : %s" % result)
+			self._firmware = result.project_dir
+			if meta["builds"].get(fqbn, dict()).get("files"):
+				self.__set_prebuilt_build((fqbn, self._artifact_store.checkout_build(meta["id"], fqbn)))
+		self.__content_hash = meta["id"]
+		self._artifact_id = meta["id"]
+		self._firmware_version = meta.get("version")
+		self._firmware_author = meta.get("author")
+		self._firmware_upload_time = datetime.now()
+		self._push_firmware_info()
+
+	def __background_fleet_flash(self, fqbn, ports):
+		self._logger.info("Starting fleet flashing process...")
+		job = self._flash_job
+		self._enter_flash_phase(FlashPhase.COMPILE)
+		self._wait_speculative_build("arduino_flash_status")
+		try:
+			arduino = self.__get_arduino(job)
+			build_dir = None
+			if self.__is_ino:
+				success, build_dir = self.__compile(arduino, fqbn, job=job)
+				if not success:
+					return
+			size_error = self.__check_firmware_size(arduino, fqbn)
+			if size_error:
+				self._flash_status = dict(
+					step_name=gettext("Upload failed"),
+					progress=100,
+					finished=True,
+					success=False,
+					message=size_error
+				)
+				self._push_flash_status("arduino_flash_status")
+				return
+		except pyduinocli.ArduinoError as e:
+			self._logger.warning("Error : %s" % e.result["result"])
+			self._flash_status = dict(
+				step_name=gettext("Compilation failed"),
+				progress=100,
+				finished=True,
+				success=False,
+				message=e.result["result"],
+				error_output=e.result["__stderr"]
+			)
+			self._push_flash_status("arduino_flash_status")
+			return
+		self._flash_status = dict(
+			step_name=gettext("Uploading"),
+			progress=50 if self.__is_ino else 0,
+			finished=False
+		)
+		self._push_flash_status("arduino_flash_status")
+		firmware = self._firmware
+		is_ino = self.__is_ino
+
+		def upload(port):
+			if job.is_stopped():
+				return False, gettext("The flash process was stopped before this board was flashed."), None
+			try:
+				if is_ino:
+					arduino.upload(sketch=firmware, fqbn=fqbn, port=port, input_dir=build_dir)
+				else:
+					self.__upload_hex(arduino, fqbn, port, firmware, job=job)
+				return True, gettext("Board successfully flashed."), None
+			except pyduinocli.ArduinoError as e:
+				return False, e.result["result"], e.result["__stderr"]
+			except FlasherError as e:
+				return False, e.message, None
+		self._run_fleet_flash(ports, upload, "arduino_flash_status", "arduino_fleet_status", fqbn)
+
+	def __get_fqbn(self, values):
+		options = []
+		for param in values:
+			if param not in ("fqbn", "ports"):
+				options.append(f"{param}={values[param]}")
+		options = ",".join(options)
+		fqbn = values["fqbn"]
+		if options:
+			fqbn = f"{fqbn}:{options}"
+		return fqbn
+
+	def _speculative_build(self):
+		if not self.__is_ino:
+			self._logger.debug("The firmware does not need to be compiled")
+			return
+		if self._settings.get_arduino_build_cache_size() <= 0:
+			self._logger.debug("The build cache is disabled, no speculative build")
+			return
+		last_flash_options = self._settings.get_arduino_last_flash_options()
+		if not last_flash_options or "fqbn" not in last_flash_options:
+			self._logger.debug("No previous flash options, no speculative build")
+			return
+		fqbn = self.__get_fqbn(last_flash_options)
+		self._logger.info("Speculatively compiling for %s" % fqbn)
+		try:
+			success, _ = self.__compile(self.__get_arduino(), fqbn, push_status=False)
+			if success:
+				self._logger.info("Speculative build success")
+		except pyduinocli.ArduinoError as e:
+			self._logger.warning("Speculative build failed : %s" % e.result["__stderr"])
+
 	def __background_flash(self, fqbn):
 		self._logger.info("Starting flashing process...")
+		job = self._flash_job
+		self._enter_flash_phase(FlashPhase.COMPILE)
+		self._wait_speculative_build("arduino_flash_status")
 		disconnected = False
 		try:
-			arduino = self.__get_arduino()
+			arduino = self.__get_arduino(job)
+			build_dir = None
 			if self.__is_ino:
+				success, build_dir = self.__compile(arduino, fqbn, job=job)
+				if not success:
+					return
+				self._enter_flash_phase(FlashPhase.UPLOAD)
 				self._flash_status = dict(
-					step_name=gettext("Compiling"),
-					progress=0,
+					step_name=gettext("Uploading"),
+					progress=50,
 					finished=False
 				)
 				self._push_flash_status("arduino_flash_status")
-				self._logger.info("Compiling...")
-				result = arduino.compile(self._firmware, fqbn=fqbn)
-				if not result["result"]["success"]:
-					self._logger.warning("Compilation failed")
-					self._logger.warning("Standard output :")
-					for log_line in result["result"]["compiler_out"].splitlines():
-						self._logger.warning(log_line)
-					self._logger.warning("Error output :")
-					# TODO fix the error output when arduino-cli will be fixed...
-					error = result["result"]["compiler_err"] if result["result"]["compiler_err"] else result["__stderr"]
-					for log_line in error.splitlines():
-						self._logger.warning(log_line)
+			else:
+				size_error = self.__check_firmware_size(arduino, fqbn)
+				if size_error:
 					self._flash_status = dict(
-						step_name=gettext("Compilation failed"),
+						step_name=gettext("Upload failed"),
 						progress=100,
 						finished=True,
 						success=False,
-						error_output=error,
-						message=result["result"]["compiler_out"]
+						message=size_error
 					)
 					self._push_flash_status("arduino_flash_status")
 					return
-				self._logger.info("Compilation success")
-				self._flash_status = dict(
-					step_name=gettext("Uploading"),
-					progress=50,
-					finished=False
-				)
-				self._push_flash_status("arduino_flash_status")
-			else:
+				self._enter_flash_phase(FlashPhase.UPLOAD)
 				self._flash_status = dict(
 					step_name=gettext("Uploading"),
 					progress=0,
@@ -415,26 +650,26 @@ class ArduinoFlasher(BaseFlasher):
 				)
 				self._push_flash_status("arduino_flash_status")
 				return
-			self._run_pre_flash_script()
-			self._wait_pre_flash_delay()
+			self._wait_pre_flash_script()
 			flash_port = transport.port
-			_, port, baudrate, profile = self._printer.get_current_connection()
-			self._logger.info("Disconnecting printer...")
-			self._printer.disconnect()
+			port, baudrate = self._disconnect_printer()
 			disconnected = True
+			self._wait_port_release(flash_port, "arduino_flash_status")
 			self._logger.info("Uploading to the board...")
 			if self.__is_ino:
-				arduino.upload(sketch=self._firmware, fqbn=fqbn, port=flash_port)
+				arduino.upload(sketch=self._firmware, fqbn=fqbn, port=flash_port, input_dir=build_dir)
 			else:
-				arduino.upload(fqbn=fqbn, port=flash_port, input_file=self._firmware)
+				self.__upload_hex(arduino, fqbn, flash_port, self._firmware, self.__push_upload_progress, job)
 			self._logger.info("Uploading success")
-			self._wait_post_flash_delay()
-			self._should_run_post_script = True
-			self._printer.connect(port, baudrate, profile)
+			self._record_flash(fqbn, flash_port, True)
+			self._reconnect_after_flash(port, baudrate)
 			self._firmware = None
 			self._firmware_version = None
 			self._firmware_author = None
 			self._firmware_upload_time = None
+			self._artifact_id = None
+			self.__set_prebuilt_build(None)
+			self.__hex_image = None
 			self._push_firmware_info()
 			self._flash_status = dict(
 				step_name=gettext("Done"),
@@ -450,7 +685,8 @@ class ArduinoFlasher(BaseFlasher):
 			for log_line in e.result["__stderr"].splitlines():
 				self._logger.warning(log_line)
 			if disconnected:
-				self._printer.connect(port, baudrate, profile)
+				self._record_flash(fqbn, flash_port, False)
+				self._reconnect_printer()
 			self._flash_status = dict(
 				step_name=gettext("Upload failed"),
 				progress=100,
@@ -460,27 +696,249 @@ class ArduinoFlasher(BaseFlasher):
 				error_output=e.result["__stderr"]
 			)
 			self._push_flash_status("arduino_flash_status")
+		except FlasherError as e:
+			self._logger.warning("Error : %s" % e.message)
+			if disconnected:
+				self._record_flash(fqbn, flash_port, False)
+				self._reconnect_printer()
+			self._flash_status = dict(
+				step_name=gettext("Upload failed"),
+				progress=100,
+				finished=True,
+				success=False,
+				message=e.message
+			)
+			self._push_flash_status("arduino_flash_status")
+
+	def __upload_hex(self, arduino, fqbn, port, firmware, progress_observer=None, job=None):
+		programmer = self.__get_native_programmer(arduino, fqbn, port)
+		if programmer is None:
+			self.__flash_records.discard(port)
+			arduino.upload(fqbn=fqbn, port=port, input_file=firmware)
+			return
+		self._logger.info("Uploading with the built-in uploader...")
+		differential = self._settings.get_arduino_differential_upload() and programmer.DIFFERENTIAL
+		if self._settings.get_arduino_differential_upload() and not differential:
+			self._logger.info("The bootloader of %s erases its pages in order, the whole firmware is written" % fqbn)
+		flashed_pages = self.__flash_records.get(port) if differential else None
+
+		def observe_progress(done, total):
+			# The built-in uploader runs in this thread, the job can only stop it between two pages
+			if job is not None:
+				job.check()
+			if progress_observer is not None:
+				progress_observer(done, total)
+		try:
+			record = programmer.program(self.__hex_image, observe_progress, flashed_pages)
+		except FlasherError:
+			self.__flash_records.discard(port)
+			raise
+		if differential:
+			record["artifact"] = self._artifact_id
+			self.__flash_records.set(port, record)
+		else:
+			self.__flash_records.discard(port)
+
+	def __get_native_programmer(self, arduino, fqbn, port):
+		if not self._settings.get_arduino_native_upload() or self.__hex_image is None:
+			return None
+		try:
+			properties = self.__get_board_properties(arduino, fqbn)
+		except pyduinocli.ArduinoError as e:
+			self._logger.warning("Could not get the properties of %s, using arduino-cli : %s" % (fqbn, e.result["__stderr"]))
+			return None
+		tool = properties.get("upload.tool.default", properties.get("upload.tool"))
+		speed = properties.get("upload.speed", "")
+		if tool != "avrdude" or not speed.isdigit():
+			self._logger.debug("%s is not uploaded through a serial bootloader, using arduino-cli" % fqbn)
+			return None
+		programmer = Stk500Programmer.create(properties.get("upload.protocol"), port, int(speed), self._logger)
+		if programmer is None:
+			self._logger.debug("The %s protocol is not supported by the built-in uploader, using arduino-cli" % properties.get("upload.protocol"))
+		return programmer
+
+	def __push_upload_progress(self, done, total):
+		progress = int(done * 100 / total)
+		if progress != self._flash_status.get("progress"):
+			self._flash_status = dict(
+				step_name=gettext("Uploading"),
+				progress=progress,
+				finished=False
+			)
+			self._push_flash_status("arduino_flash_status")
+
+	def __compile(self, arduino, fqbn, push_status=True, job=None):
+		if self.__prebuilt_build is not None and self.__prebuilt_build[0] == fqbn:
+			self._logger.info("The stored build of this firmware is used, skipping compilation")
+			return True, self.__prebuilt_build[1]
+		max_cache_size = self._settings.get_arduino_build_cache_size() * 1024 * 1024
+		build_properties = self.__get_object_cache_build_properties(arduino, fqbn)
+		cache_key = None
+		if max_cache_size > 0:
+			self._logger.debug("Computing build cache key...")
+			# Anything that changes the compiled firmware is part of the key, Marlin depends on installed libraries too
+			toolchain = dict(
+				version=arduino.version()["result"],
+				cores=arduino.core.list()["result"],
+				libraries=arduino.lib.list()["result"],
+				build_properties=build_properties
+			)
+			cache_key = self.__build_cache.compute_key(self.__content_hash, fqbn, toolchain)
+			build_dir = self.__build_cache.get(cache_key)
+			if build_dir is not None:
+				self._logger.info("Identical build found in the cache, skipping compilation")
+				self.__store_build(fqbn, build_dir)
+				return True, build_dir
+		if push_status:
+			self._flash_status = dict(
+				step_name=gettext("Compiling"),
+				progress=0,
+				finished=False
+			)
+			self._push_flash_status("arduino_flash_status")
+		if cache_key is not None:
+			output_dir = self.__build_cache.new_entry_dir(cache_key)
+		else:
+			output_dir = None
+		self._logger.info("Compiling...")
+		try:
+			result = self.__get_arduino(job, scheduled=True).compile(self._firmware, fqbn=fqbn, output_dir=output_dir, build_properties=build_properties)
+		except pyduinocli.ArduinoError:
+			if output_dir is not None:
+				self.__build_cache.discard(output_dir)
+			raise
+		if not result["result"]["success"]:
+			if output_dir is not None:
+				self.__build_cache.discard(output_dir)
+			self._logger.warning("Compilation failed")
+			self._logger.warning("Standard output :")
+			for log_line in result["result"]["compiler_out"].splitlines():
+				self._logger.warning(log_line)
+			self._logger.warning("Error output :")
+			# TODO fix the error output when arduino-cli will be fixed...
+			error = result["result"]["compiler_err"] if result["result"]["compiler_err"] else result["__stderr"]
+			for log_line in error.splitlines():
+				self._logger.warning(log_line)
+			if push_status:
+				self._flash_status = dict(
+					step_name=gettext("Compilation failed"),
+					progress=100,
+					finished=True,
+					success=False,
+					error_output=error,
+					message=result["result"]["compiler_out"]
+				)
+				self._push_flash_status("arduino_flash_status")
+			return False, None
+		self._logger.info("Compilation success")
+		if output_dir is None:
+			self.__store_build(fqbn, (result["result"].get("builder_result") or dict()).get("build_path"))
+			return True, None
+		build_dir = self.__build_cache.commit(cache_key, output_dir, max_cache_size)
+		self.__store_build(fqbn, build_dir)
+		return True, build_dir
+
+	def __set_prebuilt_build(self, prebuilt_build):
+		if self.__prebuilt_build is not None:
+			self._artifact_store.release_checkout(self.__prebuilt_build[1])
+		self.__prebuilt_build = prebuilt_build
+
+	def __store_build(self, fqbn, build_dir):
+		if build_dir is None or not os.path.isdir(build_dir):
+			return
+		binaries = [f for f in os.listdir(build_dir) if os.path.isfile(os.path.join(build_dir, f)) and os.path.splitext(f)[1].lower() in (".hex", ".bin", ".elf", ".eep", ".uf2")]
+		if binaries:
+			self._store_build(fqbn, build_dir, binaries)
+
+	def __get_board_properties(self, arduino, fqbn):
+		if fqbn not in self.__board_properties:
+			self._logger.debug("Getting board properties...")
+			result = arduino.board.details(fqbn, show_properties="unexpanded")["result"]
+			properties = dict()
+			if isinstance(result, dict):
+				for board_property in result.get("build_properties") or []:
+					name, _, value = board_property.partition("=")
+					properties[name] = value
+			self.__board_properties[fqbn] = properties
+		return self.__board_properties[fqbn]
+
+	def __check_firmware_size(self, arduino, fqbn):
+		if self.__is_ino or self.__hex_image is None:
+			return None
+		try:
+			maximum_size = self.__get_board_properties(arduino, fqbn).get("upload.maximum_size", "")
+		except pyduinocli.ArduinoError as e:
+			self._logger.warning("Could not get the properties of %s, skipping the firmware size check : %s" % (fqbn, e.result["__stderr"]))
+			return None
+		if not maximum_size.isdigit():
+			self._logger.debug("No flash size known for %s, skipping the firmware size check" % fqbn)
+			return None
+		# Only the span matters, the flash of ARM boards does not start at 0
+		firmware_size = self.__hex_image.get_end() - self.__hex_image.get_start()
+		self._logger.debug("The firmware spans %d bytes, %s bytes are available" % (firmware_size, maximum_size))
+		if firmware_size > int(maximum_size):
+			self._logger.warning("The firmware is too large for %s" % fqbn)
+			return gettext("The firmware is too large for this board, it needs %d bytes but only %d are available.") % (firmware_size, int(maximum_size))
+		return None
+
+	def __get_object_cache_build_properties(self, arduino, fqbn):
+		launcher = self._object_cache.get_ccache_launcher(self._settings.get_object_cache_size() * 1024 * 1024)
+		if launcher is None:
+			return None
+		properties = self.__get_board_properties(arduino, fqbn)
+		build_properties = []
+		for recipe in ("recipe.c.o.pattern", "recipe.cpp.o.pattern", "recipe.S.o.pattern"):
+			if recipe in properties:
+				build_properties.append("%s=%s %s" % (recipe, launcher, properties[recipe]))
+		if not build_properties:
+			self._logger.debug("No compilation recipe found for %s, compiling without object cache" % fqbn)
+		return build_properties
 
 	def __push_installed_boards(self):
-		if self.check_setup_errors():
+		if self.__board_catalog.is_loaded(self._get_cli_path()):
+			self.__send_installed_boards()
 			return
+		self._background_run(self.__refresh_board_catalog)
+
+	def __refresh_board_catalog(self):
+		generation = self.__board_catalog.invalidate()
+		if self.check_setup_errors():
+			return False
+		cli_path = self._get_cli_path()
 		try:
 			arduino = self.__get_arduino()
 			self._logger.debug("Listing installed boards...")
-			result = arduino.board.listall()["result"]
+			if not self.__board_catalog.load(cli_path, arduino.board.listall()["result"], generation):
+				return False
 			self._logger.debug("Done")
-			self._logger.debug("Pushing installed boards through websocket ")
-			self._plugin_manager.send_plugin_message(self._identifier, dict(
-				type="arduino_boards",
-				result=result
-			))
 		except pyduinocli.ArduinoError as e:
-			self._logger.debug("Failed to push the list of installed boards")
+			self._logger.debug("Failed to list the installed boards")
 			self._logger.debug(e.result["__stderr"])
+			return False
+		self.__send_installed_boards()
+		return True
+
+	def __send_installed_boards(self):
+		self._logger.debug("Pushing installed boards through websocket ")
+		self._plugin_manager.send_plugin_message(self._identifier, dict(
+			type="arduino_boards",
+			result=self.__board_catalog.get_result()
+		))
+
+	def _get_configuration_dir(self):
+		if self._firmware is None or not self.__is_ino:
+			return None
+		return self._firmware
 
 	def _firmware_info_event_name(self):
 		return "arduino_firmware_info"
 
+	def _download_status_event_name(self):
+		return "arduino_download_status"
+
+	def _flash_status_event_name(self):
+		return "arduino_flash_status"
+
 	def __push_last_flash_option(self):
 		self._logger.debug("Pushing last flash options through websocket...")
 		self._plugin_manager.send_plugin_message(self._identifier, dict(
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from threading import RLock
+from .flasher_error import FlasherError
+
+
+class ArtifactStore:
+
+	CHUNK_SIZE = 1024 * 1024
+
+	def __init__(self, store_dir, logger):
+		self.__blobs_dir = os.path.join(store_dir, "blobs")
+		self.__meta_dir = os.path.join(store_dir, "meta")
+		self.__checkout_dir = os.path.join(store_dir, "checkout")
+		self.__logger = logger
+		self.__lock = RLock()
+		self.__checkout_users = dict()
+
+	@staticmethod
+	def get_file_hash(path):
+		digest = hashlib.sha256()
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(ArtifactStore.CHUNK_SIZE), b""):
+				digest.update(chunk)
+		return digest.hexdigest()
+
+	@staticmethod
+	def copy_file(source_path, path, sha256):
+		digest = hashlib.sha256()
+		temp_path = path + ".partial"
+		with open(source_path, "rb") as source, open(temp_path, "wb") as output:
+			for chunk in iter(lambda: source.read(ArtifactStore.CHUNK_SIZE), b""):
+				output.write(chunk)
+				digest.update(chunk)
+		if digest.hexdigest() != sha256:
+			os.remove(temp_path)
+			raise FlasherError("The stored file %s is corrupted" % source_path)
+		os.replace(temp_path, path)
+
+	def add_sources(self, artifact_id, backend, kind, file, source_dir, files, version, author):
+		with self.__lock:
+			for relative_path, sha256 in files.items():
+				self.__add_blob(os.path.join(source_dir, *relative_path.split("/")), sha256)
+			meta = self.__load_meta(artifact_id)
+			if meta is None:
+				self.__logger.debug("Storing artifact %s" % artifact_id)
+				os.makedirs(self.__meta_dir, exist_ok=True)
+				meta = dict(
+					id=artifact_id,
+					backend=backend,
+					kind=kind,
+					file=file,
+					created=time.time(),
+					builds=dict()
+				)
+				with open(self.__get_sources_path(artifact_id), "w") as sources_file:
+					json.dump(files, sources_file)
+			meta["version"] = version
+			meta["author"] = author
+			meta["last_used"] = time.time()
+			self.__save_meta(meta)
+
+	def add_build(self, artifact_id, target, build_dir, relative_paths):
+		with self.__lock:
+			meta = self.__load_meta(artifact_id)
+			if meta is None:
+				return
+			files = dict()
+			for relative_path in relative_paths:
+				path = os.path.join(build_dir, *relative_path.split("/"))
+				files[relative_path] = self.get_file_hash(path)
+				self.__add_blob(path, files[relative_path])
+			self.__logger.debug("Storing the %s build of artifact %s" % (target, artifact_id))
+			build = meta["builds"].setdefault(target, dict(flashes=[]))
+			build["files"] = files
+			build["created"] = time.time()
+			meta["last_used"] = time.time()
+			self.__save_meta(meta)
+
+	def record_flash(self, artifact_id, target, port, success):
+		with self.__lock:
+			meta = self.__load_meta(artifact_id)
+			if meta is None:
+				return
+			build = meta["builds"].setdefault(target, dict(flashes=[]))
+			build["flashes"].append(dict(
+				port=port,
+				time=time.time(),
+				success=success
+			))
+			meta["last_used"] = time.time()
+			self.__save_meta(meta)
+
+	def get(self, artifact_id):
+		if not re.match(r"^[0-9a-f]{64}$", artifact_id):
+			return None
+		with self.__lock:
+			return self.__load_meta(artifact_id)
+
+	def list(self):
+		with self.__lock:
+			artifacts = []
+			if os.path.isdir(self.__meta_dir):
+				for f in os.listdir(self.__meta_dir):
+					if f.endswith(".meta.json"):
+						meta = self.__load_meta(f[:-len(".meta.json")])
+						if meta is not None:
+							artifacts.append(meta)
+			return sorted(artifacts, key=lambda meta: meta["last_used"], reverse=True)
+
+	def get_sources(self, artifact_id):
+		with self.__lock:
+			with open(self.__get_sources_path(artifact_id)) as sources_file:
+				files = json.load(sources_file)
+			return self.__get_blob_paths(files)
+
+	def checkout_build(self, artifact_id, target, checkout_dir=None):
+		with self.__lock:
+			meta = self.__load_meta(artifact_id)
+			files = meta["builds"][target]["files"]
+			shared = checkout_dir is None
+			if shared:
+				checkout_dir = os.path.join(self.__checkout_dir, hashlib.sha256(("%s\0%s" % (artifact_id, target)).encode("utf-8")).hexdigest())
+				# A checkout still in use is only refreshed, its files are replaced one by one
+				if os.path.exists(checkout_dir) and not self.__checkout_users.get(checkout_dir):
+					shutil.rmtree(checkout_dir)
+			for relative_path, (blob_path, _) in self.__get_blob_paths(files).items():
+				path = os.path.join(checkout_dir, *relative_path.split("/"))
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+				self.copy_file(blob_path, path, files[relative_path])
+			if shared:
+				self.__checkout_users[checkout_dir] = self.__checkout_users.get(checkout_dir, 0) + 1
+			meta["last_used"] = time.time()
+			self.__save_meta(meta)
+			return checkout_dir
+
+	def release_checkout(self, checkout_dir):
+		with self.__lock:
+			users = self.__checkout_users.get(checkout_dir, 0) - 1
+			if users > 0:
+				self.__checkout_users[checkout_dir] = users
+			else:
+				self.__checkout_users.pop(checkout_dir, None)
+
+	def evict(self, max_size, keep=None):
+		with self.__lock:
+			blob_sizes = self.__get_blob_sizes()
+			total_size = sum(blob_sizes.values())
+			if total_size <= max_size:
+				return
+			artifacts = self.list()
+			references = dict()
+			for meta in artifacts:
+				references[meta["id"]] = self.__get_references(meta)
+			for meta in reversed(artifacts):
+				if total_size <= max_size:
+					break
+				if meta["id"] == keep:
+					continue
+				self.__logger.debug("Evicting artifact %s" % meta["id"])
+				os.remove(self.__get_meta_path(meta["id"]))
+				os.remove(self.__get_sources_path(meta["id"]))
+				removed = references.pop(meta["id"])
+				still_referenced = set().union(*references.values()) if references else set()
+				for sha256 in removed - still_referenced:
+					if sha256 in blob_sizes:
+						os.remove(self.__get_blob_path(sha256))
+						total_size -= blob_sizes.pop(sha256)
+			if os.path.isdir(self.__checkout_dir):
+				for f in os.listdir(self.__checkout_dir):
+					path = os.path.join(self.__checkout_dir, f)
+					# The other flasher may be uploading from its checkout
+					if path not in self.__checkout_users:
+						shutil.rmtree(path)
+			self.__logger.debug("Artifact store trimmed to %d bytes" % total_size)
+
+	def __get_references(self, meta):
+		references = set()
+		try:
+			with open(self.__get_sources_path(meta["id"])) as sources_file:
+				references.update(json.load(sources_file).values())
+		except (OSError, ValueError):
+			pass
+		for build in meta["builds"].values():
+			references.update(build.get("files", dict()).values())
+		return references
+
+	def __add_blob(self, path, sha256):
+		blob_path = self.__get_blob_path(sha256)
+		# A blob with several links shares its inode with a workspace file that a build may modify in place
+		if os.path.exists(blob_path) and os.stat(blob_path).st_nlink == 1:
+			return
+		os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+		# A blob is only ever stored under the digest of its content
+		self.copy_file(path, blob_path, sha256)
+
+	def __get_blob_paths(self, files):
+		return dict([(relative_path, (self.__get_blob_path(sha256), sha256)) for relative_path, sha256 in files.items()])
+
+	def __get_blob_sizes(self):
+		sizes = dict()
+		for root, dirs, files in os.walk(self.__blobs_dir):
+			for f in files:
+				sizes[f] = os.path.getsize(os.path.join(root, f))
+		return sizes
+
+	def __get_blob_path(self, sha256):
+		return os.path.join(self.__blobs_dir, sha256[:2], sha256)
+
+	def __get_meta_path(self, artifact_id):
+		return os.path.join(self.__meta_dir, "%s.meta.json" % artifact_id)
+
+	def __get_sources_path(self, artifact_id):
+		return os.path.join(self.__meta_dir, "%s.sources.json" % artifact_id)
+
+	def __load_meta(self, artifact_id):
+		try:
+			with open(self.__get_meta_path(artifact_id)) as meta_file:
+				return json.load(meta_file)
+		except (OSError, ValueError):
+			return None
+
+	def __save_meta(self, meta):
+		os.makedirs(self.__meta_dir, exist_ok=True)
+		temp_path = self.__get_meta_path(meta["id"]) + ".partial"
+		with open(temp_path, "w") as meta_file:
+			json.dump(meta, meta_file)
+		os.replace(temp_path, self.__get_meta_path(meta["id"]))
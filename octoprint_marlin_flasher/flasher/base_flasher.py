@@ -1,34 +1,120 @@
 from .flasher_error import FlasherError
-import time
 import flask
+from flask_babel import gettext
 import requests
-import tempfile
 import os
 import re
 from threading import Thread
+from .fleet_flash import FleetFlashJob, FleetPortStatus
+from .build_scheduler import BuildScheduler
+from .firmware_download import FirmwareDownloader
+from .marlin_config import MarlinConfigIndex
+from .board_probe import BoardReadinessProbe
+from .pre_flash_sync import PreFlashSync
+from .port_lease import PortLease
+from .flash_job import FlashJob, FlashPhase, FlashStopReason
+from .setup_check_cache import SetupCheckCache
 
 
 class BaseFlasher:
 
-	def __init__(self, settings, printer, plugin, plugin_manager, identifier, logger):
+	def __init__(self, settings, printer, plugin, plugin_manager, identifier, logger, object_cache, artifact_store, process_runner):
 		self._settings = settings
 		self._printer = printer
 		self._plugin = plugin
 		self._plugin_manager = plugin_manager
 		self._identifier = identifier
 		self._logger = logger
+		self._object_cache = object_cache
+		self._artifact_store = artifact_store
+		self._process_runner = process_runner
+		self._artifact_id = None
 		self._firmware = None
 		self._firmware_version = None
 		self._firmware_author = None
 		self._firmware_upload_time = None
 		self._should_run_post_script = False
 		self._flash_status = None
+		self._flash_job = None
+		self._speculative_build_thread = None
+		self._build_scheduler = BuildScheduler(settings, printer, logger)
+		self._firmware_downloader = FirmwareDownloader(os.path.join(plugin.get_plugin_data_folder(), "downloads"), logger)
+		self._config_index = MarlinConfigIndex(os.path.join(plugin.get_plugin_data_folder(), "config_index"), logger)
+		self.__readiness_probe = BoardReadinessProbe(logger)
+		self.__pre_flash_sync = PreFlashSync(logger)
+		self.__port_lease = PortLease(logger)
+		self.__setup_check_cache = SetupCheckCache(logger)
 
 	def _background_run(self, target, args=None):
 		thread = Thread(target=target, args=args)
 		thread.start()
 		return thread
 
+	def _is_flash_running(self):
+		return self._flash_job is not None and not self._flash_job.is_finished()
+
+	def _start_flash_job(self, target, args):
+		budgets = dict([(phase, self._settings.get_flash_budget(phase)) for phase in FlashPhase.ALL])
+		job = FlashJob(budgets, self._logger)
+		self._flash_job = job
+		self._background_run(self.__run_flash_job, args=(job, target, args))
+		return job
+
+	def __run_flash_job(self, job, target, args):
+		self._logger.info("Starting flash job %s" % job.get_id())
+		error = None
+		try:
+			target(*args)
+		except FlasherError as e:
+			self._logger.warning("Flash job %s stopped : %s" % (job.get_id(), e.message))
+			error = e.message
+		except Exception:
+			self._logger.exception("Unexpected error in flash job %s" % job.get_id())
+			error = gettext("Unexpected error, check the logs for more details.")
+		if self._reconnect_printer():
+			self._logger.info("The printer was left disconnected, it has been reconnected")
+		job.finish()
+		if error is not None:
+			self._flash_status = dict(
+				step_name=gettext("Flash failed"),
+				progress=100,
+				finished=True,
+				success=False,
+				message=error
+			)
+			self._push_flash_status(self._flash_status_event_name())
+
+	def cancel_flash(self):
+		job = self._flash_job
+		if job is None or job.is_finished():
+			return None, [gettext("No flash process is running.")]
+		if flask.request.values.get("job", job.get_id()) != job.get_id():
+			return None, [gettext("This flash process is already finished.")]
+		job.cancel()
+		return dict(
+			message=gettext("The flash process is being cancelled."),
+			job=job.get_id()
+		), None
+
+	def _enter_flash_phase(self, phase):
+		self._flash_job.check()
+		self._flash_job.start_phase(phase)
+
+	def _disconnect_printer(self):
+		_, port, baudrate, profile = self._printer.get_current_connection()
+		self._flash_job.set_connection(port, baudrate, profile)
+		self._logger.info("Disconnecting printer...")
+		self._printer.disconnect()
+		return port, baudrate
+
+	def _reconnect_printer(self):
+		connection = self._flash_job.pop_connection()
+		if connection is None:
+			return False
+		self._logger.info("Reconnecting printer...")
+		self._printer.connect(*connection)
+		return True
+
 	def _run_pre_flash_script(self):
 		pre_flash_script = self._settings.get_pre_flash_script()
 		if pre_flash_script:
@@ -36,12 +122,42 @@ class BaseFlasher:
 			self._logger.debug(pre_flash_script)
 			commands = [line.strip() for line in pre_flash_script.splitlines()]
 			self._printer.commands(commands)
+			self._printer.commands(self.__pre_flash_sync.start())
+			return True
+		self._logger.debug("No pre-flash GCode script defined")
+		return False
+
+	def _wait_pre_flash_script(self):
+		if not self._run_pre_flash_script():
+			return
+		delay = self._settings.get_pre_flash_delay()
+		self._logger.debug("Waiting for the pre-flash script to complete, at most %ss..." % delay)
+		if self.__pre_flash_sync.wait(delay):
+			self._logger.debug("Pre-flash script completed")
 		else:
-			self._logger.debug("No pre-flash GCode script defined")
+			self._logger.debug("The pre-flash script was not acknowledged, pre-flash delay elapsed")
 
-	def _wait_pre_flash_delay(self):
-		self._logger.debug("Waiting pre-flash delay...")
-		time.sleep(self._settings.get_pre_flash_delay())
+	def _wait_port_release(self, port, event_name):
+		status = dict(self._flash_status or dict(progress=0))
+		self._flash_status = dict(
+			step_name=gettext("Waiting for the serial port"),
+			progress=status["progress"],
+			finished=False
+		)
+		self._push_flash_status(event_name)
+		elapsed = self.__port_lease.wait(port, self._settings.get_port_release_timeout())
+		self._logger.info("%s released in %.2fs" % (port, elapsed))
+		self._flash_status = dict(
+			step_name=gettext("Uploading"),
+			progress=status["progress"],
+			finished=False,
+			port_release_time=elapsed
+		)
+		self._push_flash_status(event_name)
+		return elapsed
+
+	def handle_gcode_received(self, line):
+		self.__pre_flash_sync.handle_received(line)
 
 	def _run_post_flash_script(self):
 		post_flash_script = self._settings.get_post_flash_script()
@@ -53,9 +169,121 @@ class BaseFlasher:
 		else:
 			self._logger.debug("No script defined")
 
-	def _wait_post_flash_delay(self):
-		self._logger.debug("Waiting post-flash delay...")
-		time.sleep(self._settings.get_post_flash_delay())
+	def _wait_post_flash_delay(self, port, baudrate):
+		delay = self._settings.get_post_flash_delay()
+		if self._flash_job is not None:
+			delay = self._flash_job.get_remaining(delay)
+		self._logger.debug("Waiting for the board to boot, at most %ss..." % delay)
+		if not self.__readiness_probe.wait(port, baudrate, delay):
+			self._logger.debug("The board did not report being ready, post-flash delay elapsed")
+
+	def _reconnect_after_flash(self, port, baudrate):
+		self._flash_job.start_phase(FlashPhase.RECONNECT)
+		self._wait_post_flash_delay(port, baudrate)
+		self._should_run_post_script = True
+		self._reconnect_printer()
+
+	def _get_requested_ports(self):
+		ports = []
+		for value in flask.request.values.getlist("ports"):
+			ports.extend([port for port in re.split(r"[,\s]+", value) if port])
+		return list(dict.fromkeys(ports))
+
+	def _check_fleet_ports(self, ports):
+		if not ports:
+			return [gettext("No serial port was given.")]
+		_, printer_port, _, _ = self._printer.get_current_connection()
+		if printer_port in ports and not self._printer.is_ready():
+			self._logger.debug("Printer not ready")
+			return [gettext("The printer may not be connected or it may be busy.")]
+		return None
+
+	def _run_fleet_flash(self, ports, upload, flash_status_event_name, fleet_status_event_name, target):
+		self._enter_flash_phase(FlashPhase.UPLOAD)
+		_, printer_port, _, _ = self._printer.get_current_connection()
+		disconnected = False
+		release_error = None
+		if printer_port in ports:
+			self._wait_pre_flash_script()
+			printer_port, baudrate = self._disconnect_printer()
+			disconnected = True
+			try:
+				self._wait_port_release(printer_port, flash_status_event_name)
+			except FlasherError as e:
+				self._logger.warning(e.message)
+				release_error = e.message
+
+		def upload_port(port):
+			if port == printer_port and release_error is not None:
+				return False, gettext("The serial port was not released by the printer connection."), release_error
+			return upload(port)
+
+		def push_port_status(status):
+			data = dict(
+				type=fleet_status_event_name
+			)
+			data.update(status)
+			self._plugin_manager.send_plugin_message(self._identifier, data)
+		job = FleetFlashJob(ports, upload_port, push_port_status, self._settings.get_fleet_max_workers(), self._logger)
+		summary = job.run()
+		for result in summary["results"]:
+			self._record_flash(target, result["port"], result["status"] == FleetPortStatus.SUCCESS)
+		if disconnected:
+			self._reconnect_after_flash(printer_port, baudrate)
+		error_output = "\n".join(["%s : %s" % (result["port"], result["error_output"] or result["message"]) for result in summary["results"] if result["status"] == FleetPortStatus.FAILED])
+		self._flash_status = dict(
+			step_name=gettext("Done"),
+			progress=100,
+			finished=True,
+			success=summary["failed"] == 0,
+			message=gettext("%(succeeded)d board(s) successfully flashed, %(failed)d failed.") % summary,
+			error_output=error_output,
+			fleet=summary
+		)
+		self._push_flash_status(flash_status_event_name)
+
+	def _store_sources(self, backend, kind, file, source_dir, files):
+		max_size = self._settings.get_artifact_store_size() * 1024 * 1024
+		if max_size <= 0:
+			return
+		try:
+			self._artifact_store.add_sources(self._artifact_id, backend, kind, file, source_dir, files, self._firmware_version, self._firmware_author)
+			self._artifact_store.evict(max_size, keep=self._artifact_id)
+		except (OSError, FlasherError) as e:
+			self._logger.warning("Could not store the firmware sources : %s" % getattr(e, "message", e))
+
+	def _store_build(self, target, build_dir, relative_paths):
+		max_size = self._settings.get_artifact_store_size() * 1024 * 1024
+		if max_size <= 0 or self._artifact_id is None:
+			return
+		try:
+			self._artifact_store.add_build(self._artifact_id, target, build_dir, relative_paths)
+			self._artifact_store.evict(max_size, keep=self._artifact_id)
+		except (OSError, FlasherError) as e:
+			self._logger.warning("Could not store the compiled firmware : %s" % getattr(e, "message", e))
+
+	def _record_flash(self, target, port, success):
+		if self._artifact_id is None:
+			return
+		try:
+			self._artifact_store.record_flash(self._artifact_id, target, port, success)
+		except OSError as e:
+			self._logger.warning("Could not record the flash history : %s" % e)
+
+	def _get_requested_artifact(self, backend):
+		if self._is_speculative_build_running():
+			self._logger.debug("A speculative build is running")
+			return None, None, [gettext("A firmware is being built in the background, please retry once it is done.")]
+		meta = self._artifact_store.get(flask.request.values["artifact"])
+		if meta is None or meta["backend"] != backend:
+			return None, None, [gettext("The requested firmware is not stored anymore.")]
+		if "target" in flask.request.values:
+			target = flask.request.values["target"]
+		elif len(meta["builds"]) == 1:
+			target = list(meta["builds"])[0]
+		else:
+			return None, None, [gettext("The target field is missing")]
+		return meta, target, None
 
 	def _validate_firmware_file(self, file_path):
 		raise FlasherError("Unsupported function call.")
@@ -66,10 +294,47 @@ class BaseFlasher:
 			self._should_run_post_script = False
 
 	def check_setup_errors(self):
+		return self.__setup_check_cache.get(self._get_cli_path(), self._check_setup_errors)
+
+	def _check_setup_errors(self):
+		raise FlasherError("Unsupported function call.")
+
+	def _get_cli_path(self):
+		raise FlasherError("Undefined function call")
+
+	def _start_speculative_build(self):
+		if not self._settings.get_speculative_build():
+			return
+		self._logger.info("Starting speculative build...")
+		self._speculative_build_thread = self._background_run(self._speculative_build, args=())
+
+	def _speculative_build(self):
 		raise FlasherError("Unsupported function call.")
 
+	def _is_speculative_build_running(self):
+		return self._speculative_build_thread is not None and self._speculative_build_thread.is_alive()
+
+	def _wait_speculative_build(self, event_name):
+		if self._is_speculative_build_running():
+			self._logger.info("Waiting for the speculative build to finish...")
+			self._flash_status = dict(
+				step_name=gettext("Waiting for the background build"),
+				progress=0,
+				finished=False
+			)
+			self._push_flash_status(event_name)
+			while self._is_speculative_build_running():
+				self._speculative_build_thread.join(1)
+				self._flash_job.check()
+
 	def upload(self):
 		self._logger.debug("Firmware uploaded by the user")
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
+		if self._is_speculative_build_running():
+			self._logger.debug("A speculative build is running")
+			return None, [gettext("A firmware is being built in the background, please retry once it is done.")]
 		uploaded_file_path = flask.request.values["firmware_file." + self._settings.get_upload_path_suffix()]
 		errors = self._validate_firmware_file(uploaded_file_path)
 		if errors:
@@ -77,71 +342,122 @@ class BaseFlasher:
 			return None, errors
 		result = self._handle_firmware_file(uploaded_file_path)
 		self._push_firmware_info()
+		if result[1] is None:
+			self._start_speculative_build()
 		return result
 
 	def download(self):
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
+		if self._is_speculative_build_running():
+			self._logger.debug("A speculative build is running")
+			return None, [gettext("A firmware is being built in the background, please retry once it is done.")]
+		url = flask.request.values["url"]
 		self._logger.debug("Downloading firmware...")
-		r = requests.get(flask.request.values["url"])
-		self._logger.debug("Saving downloaded firmware...")
-		with tempfile.NamedTemporaryFile(delete=False) as temp:
-			temp.write(r.content)
-			temp_path = temp.name
-		errors = self._validate_firmware_file(temp_path)
+		try:
+			firmware_path = self._firmware_downloader.download(
+				url,
+				self._settings.get_download_connect_timeout(),
+				self._settings.get_download_read_timeout(),
+				self.__push_download_status
+			)
+		except (requests.exceptions.RequestException, OSError) as e:
+			self._logger.warning("Unable to download the firmware : %s" % e)
+			self._push_firmware_info()
+			return None, [gettext("Unable to download the firmware : ") + str(e)]
+		errors = self._validate_firmware_file(firmware_path)
 		if errors:
 			self._push_firmware_info()
-			os.remove(temp_path)
 			return None, errors
-		result = self._handle_firmware_file(temp_path)
+		result = self._handle_firmware_file(firmware_path)
 		self._push_firmware_info()
-		self._logger.debug("Clearing downloaded firmware...")
-		os.remove(temp_path)
+		if result[1] is None:
+			self._start_speculative_build()
 		return result
 
+	def __push_download_status(self, downloaded, total):
+		self._plugin_manager.send_plugin_message(self._identifier, dict(
+			type=self._download_status_event_name(),
+			downloaded=downloaded,
+			total=total,
+			progress=int(downloaded * 100 / total) if total else None
+		))
+
+	def _download_status_event_name(self):
+		raise FlasherError("Undefined function call")
+
 	def _handle_firmware_file(self, firmware_file_path):
 		raise FlasherError("Unsupported function call.")
 
-	def _find_firmware_info(self):
-		for root, dirs, files in os.walk(self._firmware):
-			for f in files:
-				if f == "Version.h":
-					self._logger.debug("Found Version.h, opening it...")
-					with open(os.path.join(root, f)) as version_file:
-						for line in version_file:
-							version = re.findall(r'#define +SHORT_BUILD_VERSION +"([^"]*)"', line)
-							if version:
-								self._firmware_version = version[0]
-								self._logger.debug("Found SHORT_BUILD_VERSION : %s" % self._firmware_version)
-								break
-				elif f == "Configuration.h":
-					self._logger.debug("Found Configuration.h, opening it...")
-					with open(os.path.join(root, f)) as configfile:
-						for line in configfile:
-							author = re.findall(r'#define +STRING_CONFIG_H_AUTHOR +"([^"]*)"', line)
-							if author:
-								self._firmware_author = author[0]
-								self._logger.debug("Found STRING_CONFIG_H_AUTHOR : %s" % self._firmware_author)
-								break
-
 	def _firmware_info_event_name(self):
 		raise FlasherError("Undefined function call")
 
+	def _flash_status_event_name(self):
+		raise FlasherError("Undefined function call")
+
+	def _get_configuration_dir(self):
+		raise FlasherError("Undefined function call")
+
+	def _get_configuration(self):
+		configuration_dir = self._get_configuration_dir()
+		if configuration_dir is None:
+			return None
+		try:
+			return self._config_index.get(configuration_dir)
+		except OSError as e:
+			self._logger.debug("Could not index the configuration : %s" % e)
+			return None
+
+	def firmware_configuration(self):
+		configuration = self._get_configuration()
+		if configuration is None:
+			return None, [gettext("No Marlin configuration was found in the uploaded firmware.")]
+		names = flask.request.values.getlist("name")
+		return dict(
+			summary=configuration.get_summary(),
+			definitions=dict([(name, configuration.get_definitions(name)) for name in names])
+		), None
+
 	def _push_firmware_info(self):
 		self._logger.debug("Sending firmware info through websocket")
+		configuration = self._get_configuration()
 		self._plugin_manager.send_plugin_message(self._identifier, dict(
 			type=self._firmware_info_event_name(),
 			version=self._firmware_version,
 			author=self._firmware_author,
 			upload_time=self._firmware_upload_time.strftime("%d/%m/%Y, %H:%M:%S") if self._firmware_upload_time is not None else None,
-			firmware=self._firmware
+			firmware=self._firmware,
+			configuration=configuration.get_summary() if configuration is not None else None
 		))
 
 	def _push_flash_status(self, event_name):
 		if self._flash_status:
+			job = self._flash_job
+			if job is not None and job.is_stopped() and self._flash_status["finished"] and not self._flash_status.get("success"):
+				# Whatever failed after the job was stopped, the user needs to know why it was stopped
+				self._flash_status.update(
+					step_name=gettext("Cancelled") if job.get_stop_reason() == FlashStopReason.CANCELLED else gettext("Timed out"),
+					message=self.__get_stop_message(job),
+					cancelled=job.get_stop_reason() == FlashStopReason.CANCELLED
+				)
 			data = dict(
-				type=event_name
+				type=event_name,
+				job=job.get_id() if job is not None else None
 			)
 			data.update(self._flash_status)
 			self._plugin_manager.send_plugin_message(self._identifier, data)
 
+	@staticmethod
+	def __get_stop_message(job):
+		if job.get_stop_reason() == FlashStopReason.CANCELLED:
+			return gettext("The flash process was cancelled.")
+		phase_messages = {
+			FlashPhase.COMPILE: gettext("The compilation did not complete within %ss and was stopped."),
+			FlashPhase.UPLOAD: gettext("The upload did not complete within %ss and was stopped."),
+			FlashPhase.RECONNECT: gettext("The board did not reboot within %ss.")
+		}
+		return phase_messages[job.get_stopped_phase()] % job.get_budget(job.get_stopped_phase())
+
 	def send_initial_state(self):
 		self._push_firmware_info()
@@ -0,0 +1,80 @@
+import bisect
+import re
+from threading import Lock
+
+
+class BoardCatalog:
+
+	def __init__(self, logger):
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__source = None
+		self.__result = None
+		self.__generation = 0
+		self.__boards = []
+		self.__fqbn_index = dict()
+		self.__name_keys = []
+		self.__name_boards = []
+
+	def is_loaded(self, source):
+		with self.__lock:
+			return self.__result is not None and self.__source == source
+
+	def invalidate(self):
+		with self.__lock:
+			self.__generation += 1
+			self.__source = None
+			self.__result = None
+			return self.__generation
+
+	def load(self, source, result, generation):
+		boards = (result or dict()).get("boards") or []
+		fqbn_index = dict()
+		names = []
+		for board in boards:
+			if board.get("fqbn"):
+				fqbn_index[board["fqbn"]] = board
+			name = (board.get("name") or "").lower()
+			# Every word of the name is a possible start, "mega" finds "Arduino Mega 2560"
+			for match in re.finditer(r"\S+", name):
+				names.append((name[match.start():], len(names), board))
+		names.sort(key=lambda entry: (entry[0], entry[1]))
+		with self.__lock:
+			# Invalidated while listing, the result may predate the change
+			if generation != self.__generation:
+				self.__logger.debug("Board catalog invalidated while loading, discarding it")
+				return False
+			self.__source = source
+			self.__result = result
+			self.__boards = boards
+			self.__fqbn_index = fqbn_index
+			self.__name_keys = [entry[0] for entry in names]
+			self.__name_boards = [entry[2] for entry in names]
+		self.__logger.debug("Board catalog loaded, %d boards" % len(boards))
+		return True
+
+	def get_result(self):
+		with self.__lock:
+			return self.__result
+
+	def get(self, fqbn):
+		with self.__lock:
+			return self.__fqbn_index.get(fqbn)
+
+	def search(self, prefix, limit=None):
+		prefix = prefix.strip().lower()
+		with self.__lock:
+			if not prefix:
+				return list(self.__boards[:limit])
+			boards = []
+			seen = set()
+			position = bisect.bisect_left(self.__name_keys, prefix)
+			while position < len(self.__name_keys) and self.__name_keys[position].startswith(prefix):
+				board = self.__name_boards[position]
+				if id(board) not in seen:
+					seen.add(id(board))
+					boards.append(board)
+					if limit is not None and len(boards) >= limit:
+						break
+				position += 1
+			return boards
@@ -0,0 +1,75 @@
+import os
+import re
+import time
+import serial
+try:
+	import termios
+except ImportError:
+	termios = None
+
+
+class BoardReadinessProbe:
+
+	POLL_INTERVAL = 0.1
+	READY_PATTERN = re.compile(rb"^(start|(echo:\s*)?Marlin\b.*)$")
+
+	def __init__(self, logger):
+		self.__logger = logger
+
+	def wait(self, port, baudrate, timeout):
+		deadline = time.time() + timeout
+		buffer = b""
+		connection = None
+		try:
+			while time.time() < deadline:
+				if connection is None:
+					connection = self.__open(port, baudrate)
+					if connection is None:
+						time.sleep(self.POLL_INTERVAL)
+						continue
+					if not baudrate:
+						# Nothing can be read without a baudrate, the port being back is the best sign available
+						self.__logger.debug("%s is available again" % port)
+						return True
+				try:
+					buffer += connection.read(max(connection.in_waiting, 1))
+				except (OSError, serial.SerialException):
+					# The board re-enumerated while booting, wait for the port to come back
+					connection.close()
+					connection = None
+					buffer = b""
+					continue
+				lines = buffer.split(b"\n")
+				buffer = lines.pop()
+				for line in lines:
+					if self.READY_PATTERN.match(line.strip()):
+						self.__logger.debug("Board ready on %s : %s" % (port, line.strip().decode("ascii", errors="replace")))
+						return True
+		finally:
+			if connection is not None:
+				connection.close()
+		return False
+
+	def __open(self, port, baudrate):
+		if os.path.isabs(port) and not os.path.exists(port):
+			return None
+		try:
+			if not baudrate:
+				connection = serial.Serial(port)
+			else:
+				connection = serial.Serial(port, baudrate, timeout=self.POLL_INTERVAL)
+		except (OSError, serial.SerialException):
+			return None
+		self.__keep_dtr_on_close(connection)
+		return connection
+
+	def __keep_dtr_on_close(self, connection):
+		# The kernel asserts DTR on every open, without HUPCL it stays up on close and reconnecting the printer does not reset the board again
+		if termios is None:
+			return
+		try:
+			attributes = termios.tcgetattr(connection.fd)
+			attributes[2] &= ~termios.HUPCL
+			termios.tcsetattr(connection.fd, termios.TCSANOW, attributes)
+		except (termios.error, OSError) as e:
+			self.__logger.debug("Could not clear HUPCL on %s : %s" % (connection.port, e))
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from threading import RLock
+
+
+class BuildCache:
+
+	def __init__(self, cache_dir, logger):
+		self.__cache_dir = cache_dir
+		self.__logger = logger
+		self.__lock = RLock()
+
+	def compute_key(self, content_hash, fqbn, toolchain):
+		digest = hashlib.sha256()
+		digest.update(fqbn.encode("utf-8"))
+		digest.update(b"\n")
+		digest.update(json.dumps(toolchain, sort_keys=True).encode("utf-8"))
+		digest.update(b"\n")
+		digest.update(content_hash.encode("utf-8"))
+		return digest.hexdigest()
+
+	def get(self, key):
+		with self.__lock:
+			entry_dir = os.path.join(self.__cache_dir, key)
+			if not os.path.isdir(entry_dir):
+				self.__logger.debug("Build cache miss for %s" % key)
+				return None
+			self.__logger.debug("Build cache hit for %s" % key)
+			now = time.time()
+			os.utime(entry_dir, (now, now))
+			return entry_dir
+
+	def new_entry_dir(self, key):
+		staging_dir = os.path.join(self.__cache_dir, "%s.partial" % key)
+		if os.path.exists(staging_dir):
+			shutil.rmtree(staging_dir)
+		os.makedirs(staging_dir)
+		return staging_dir
+
+	def discard(self, staging_dir):
+		if os.path.exists(staging_dir):
+			shutil.rmtree(staging_dir)
+
+	def commit(self, key, staging_dir, max_size):
+		with self.__lock:
+			entry_dir = os.path.join(self.__cache_dir, key)
+			if os.path.exists(entry_dir):
+				shutil.rmtree(entry_dir)
+			os.rename(staging_dir, entry_dir)
+			self.__logger.debug("Stored build %s in the cache" % key)
+			self.evict(max_size, keep=key)
+			return entry_dir
+
+	def evict(self, max_size, keep=None):
+		with self.__lock:
+			if not os.path.isdir(self.__cache_dir):
+				return
+			entries = []
+			total_size = 0
+			for name in os.listdir(self.__cache_dir):
+				entry_dir = os.path.join(self.__cache_dir, name)
+				if name.endswith(".partial") or not os.path.isdir(entry_dir):
+					continue
+				size = self.__get_size(entry_dir)
+				total_size += size
+				entries.append((os.stat(entry_dir).st_mtime, name, size))
+			entries.sort()
+			for _, name, size in entries:
+				if total_size <= max_size:
+					break
+				if name == keep:
+					continue
+				self.__logger.debug("Evicting build %s from the cache" % name)
+				shutil.rmtree(os.path.join(self.__cache_dir, name), ignore_errors=True)
+				total_size -= size
+
+	@staticmethod
+	def __get_size(path):
+		size = 0
+		for root, dirs, files in os.walk(path):
+			for f in files:
+				size += os.path.getsize(os.path.join(root, f))
+		return size
@@ -0,0 +1,119 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+from .process_tree import ProcessTree
+
+
+class BuildProfile:
+
+	BUSY = "busy"
+	IDLE = "idle"
+
+	def __init__(self):
+		raise Exception("This class is an enum like, the constructor should not be called")
+
+
+class BuildScheduler:
+
+	POLL_INTERVAL = 2
+
+	IOPRIO_CLASSES = {
+		"best-effort": 2,
+		"idle": 3
+	}
+
+	IOPRIO_SET_SYSCALLS = {
+		"x86_64": 251,
+		"i386": 289,
+		"i686": 289,
+		"armv6l": 314,
+		"armv7l": 314,
+		"aarch64": 30
+	}
+
+	def __init__(self, settings, printer, logger):
+		self.__settings = settings
+		self.__printer = printer
+		self.__logger = logger
+		self.__libc = None
+		if platform.system() == "Linux":
+			try:
+				self.__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+			except OSError:
+				self.__logger.debug("Could not load libc, I/O priorities will not be set")
+
+	def get_profile_name(self):
+		if self.__printer.is_printing() or self.__printer.is_paused():
+			return BuildProfile.BUSY
+		return BuildProfile.IDLE
+
+	def get_jobs(self):
+		if not self.__settings.get_build_scheduler_enabled():
+			return 0
+		return self.__settings.get_build_profile(self.get_profile_name()).get("jobs", 0)
+
+	def run_process(self, process_runner, command, line_handler, handle_observer=None, **kwargs):
+		enabled = self.__settings.get_build_scheduler_enabled()
+		profile_name = self.get_profile_name()
+		on_start = (lambda pid: self.__apply(pid, profile_name, [])) if enabled else None
+		handle = process_runner.start(command, line_handler, on_start=on_start, **kwargs)
+		if handle_observer is not None:
+			handle_observer(handle)
+		if not enabled:
+			return handle.wait()
+		while True:
+			result = handle.wait(self.POLL_INTERVAL)
+			if result is not None:
+				return result
+			new_profile_name = self.get_profile_name()
+			if new_profile_name != profile_name and handle.pid is not None:
+				profile_name = new_profile_name
+				self.__logger.info("Printer is now %s, switching running builds to the %s profile" % ("busy" if profile_name == BuildProfile.BUSY else "idle", profile_name))
+				self.__apply(handle.pid, profile_name, ProcessTree.get_process_descendants(handle.pid))
+
+	def __apply(self, tid, profile_name, pids):
+		profile = self.__settings.get_build_profile(profile_name)
+		self.__logger.debug("Applying %s build profile : %s" % (profile_name, profile))
+		denied = False
+		for pid in [tid] + pids:
+			denied = not self.__set_nice(pid, profile.get("nice")) or denied
+			self.__set_ionice(pid, profile.get("ionice"))
+			self.__set_cpus(pid, profile.get("cpus"))
+		if denied:
+			# Without CAP_SYS_NICE or a RLIMIT_NICE allowance, a nice value can be raised but never lowered back
+			self.__logger.warning("Could not lower the nice value of the build to %s, it keeps its current priority until it ends" % profile.get("nice"))
+
+	def __set_nice(self, pid, nice):
+		if nice is None or not hasattr(os, "setpriority"):
+			return True
+		try:
+			os.setpriority(os.PRIO_PROCESS, pid, int(nice))
+		except OSError as e:
+			self.__logger.debug("Could not set the nice value of %d : %s" % (pid, e))
+			return e.errno not in (errno.EPERM, errno.EACCES)
+		return True
+
+	def __set_ionice(self, pid, ionice):
+		syscall = self.IOPRIO_SET_SYSCALLS.get(platform.machine())
+		if self.__libc is None or syscall is None or ionice not in self.IOPRIO_CLASSES:
+			return
+		# IOPRIO_WHO_PROCESS, the level is only meaningful for best-effort and ignored for idle
+		value = (self.IOPRIO_CLASSES[ionice] << 13) | 4
+		if self.__libc.syscall(syscall, 1, pid, value) != 0:
+			self.__logger.debug("Could not set the I/O priority of %d : %s" % (pid, os.strerror(ctypes.get_errno())))
+
+	def __set_cpus(self, pid, cpus):
+		if not hasattr(os, "sched_setaffinity"):
+			return
+		available = sorted(os.sched_getaffinity(0))
+		selected = set()
+		for cpu in str(cpus or "").split(","):
+			cpu = cpu.strip()
+			if cpu.isdigit() and int(cpu) in available:
+				selected.add(int(cpu))
+		try:
+			os.sched_setaffinity(pid, selected if selected else available)
+		except OSError as e:
+			self.__logger.debug("Could not set the CPU affinity of %d : %s" % (pid, e))
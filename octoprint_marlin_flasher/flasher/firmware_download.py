@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import time
+import requests
+
+
+class FirmwareDownloader:
+
+	CHUNK_SIZE = 64 * 1024
+	PROGRESS_INTERVAL = 0.5
+	MAX_ENTRIES = 4
+
+	def __init__(self, download_dir, logger):
+		self.__download_dir = download_dir
+		self.__logger = logger
+
+	def download(self, url, connect_timeout, read_timeout, progress_observer=None):
+		os.makedirs(self.__download_dir, exist_ok=True)
+		key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+		timeout = (connect_timeout, read_timeout)
+		file_path = self.__download(url, key, timeout, progress_observer, True)
+		if file_path is None:
+			self.__logger.info("The server refused to resume the download, starting over")
+			self.__remove(key)
+			file_path = self.__download(url, key, timeout, progress_observer, False)
+		self.__prune(key)
+		return file_path
+
+	def __download(self, url, key, timeout, progress_observer, resume):
+		file_path = os.path.join(self.__download_dir, key)
+		partial_path = file_path + ".partial"
+		metadata_path = file_path + ".json"
+		metadata = self.__load_metadata(metadata_path)
+		# Byte ranges are only meaningful on the raw content
+		headers = {"Accept-Encoding": "identity"}
+		validator = metadata.get("etag") or metadata.get("last_modified")
+		offset = 0
+		if os.path.isfile(file_path) and metadata.get("complete"):
+			if metadata.get("etag"):
+				headers["If-None-Match"] = metadata["etag"]
+			if metadata.get("last_modified"):
+				headers["If-Modified-Since"] = metadata["last_modified"]
+		elif resume and os.path.isfile(partial_path) and validator:
+			offset = os.path.getsize(partial_path)
+			headers["Range"] = "bytes=%d-" % offset
+			# The server sends the whole file again if it changed since the partial download
+			headers["If-Range"] = validator
+		with requests.get(url, headers=headers, stream=True, timeout=timeout) as r:
+			if r.status_code == 304:
+				self.__logger.debug("The firmware did not change since the last download")
+				self.__touch(file_path)
+				return file_path
+			if "Range" in headers and not self.__is_resumed(r, offset):
+				self.__logger.debug("Could not resume the download at %d bytes, status %d" % (offset, r.status_code))
+				return None
+			r.raise_for_status()
+			if r.status_code == 206:
+				self.__logger.debug("Resuming the download at %d bytes" % offset)
+				mode = "ab"
+			else:
+				offset = 0
+				mode = "wb"
+			metadata = dict(
+				url=url,
+				etag=r.headers.get("ETag"),
+				last_modified=r.headers.get("Last-Modified"),
+				complete=False
+			)
+			self.__save_metadata(metadata_path, metadata)
+			total = self.__get_total_size(r, offset)
+			downloaded = offset
+			last_progress = 0
+			with open(partial_path, mode) as partial_file:
+				for chunk in r.iter_content(self.CHUNK_SIZE):
+					partial_file.write(chunk)
+					downloaded += len(chunk)
+					now = time.monotonic()
+					if progress_observer is not None and now - last_progress >= self.PROGRESS_INTERVAL:
+						last_progress = now
+						progress_observer(downloaded, total)
+		if total is not None and downloaded < total:
+			raise requests.exceptions.ConnectionError("Connection closed after %d of %d bytes" % (downloaded, total))
+		if progress_observer is not None:
+			progress_observer(downloaded, total)
+		os.replace(partial_path, file_path)
+		metadata["complete"] = True
+		self.__save_metadata(metadata_path, metadata)
+		return file_path
+
+	def __remove(self, key):
+		for suffix in ("", ".partial", ".json"):
+			path = os.path.join(self.__download_dir, key + suffix)
+			if os.path.exists(path):
+				os.remove(path)
+
+	def __prune(self, current_key):
+		entries = []
+		for f in os.listdir(self.__download_dir):
+			key = f.split(".")[0]
+			if key != current_key:
+				path = os.path.join(self.__download_dir, f)
+				entries.append((os.path.getmtime(path), key))
+		keys = []
+		for _, key in sorted(entries, reverse=True):
+			if key not in keys:
+				keys.append(key)
+		for key in keys[self.MAX_ENTRIES - 1:]:
+			self.__logger.debug("Removing cached download %s" % key)
+			self.__remove(key)
+
+	@staticmethod
+	def __is_resumed(r, offset):
+		# A full answer to the If-Range is fine, a 416 or a range starting elsewhere is not
+		if r.status_code in (412, 416):
+			return False
+		if r.status_code == 206:
+			return r.headers.get("Content-Range", "").startswith("bytes %d-" % offset)
+		return True
+
+	@staticmethod
+	def __get_total_size(r, offset):
+		if r.status_code == 206:
+			content_range = r.headers.get("Content-Range", "")
+			total = content_range.rpartition("/")[2]
+			if total.isdigit():
+				return int(total)
+		length = r.headers.get("Content-Length")
+		if length is not None and length.isdigit():
+			return offset + int(length)
+		return None
+
+	@staticmethod
+	def __touch(path):
+		now = time.time()
+		os.utime(path, (now, now))
+
+	@staticmethod
+	def __load_metadata(metadata_path):
+		try:
+			with open(metadata_path) as metadata_file:
+				return json.load(metadata_file)
+		except (OSError, ValueError):
+			return dict()
+
+	@staticmethod
+	def __save_metadata(metadata_path, metadata):
+		with open(metadata_path, "w") as metadata_file:
+			json.dump(metadata, metadata_file)
@@ -0,0 +1,248 @@
+import fnmatch
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from .flasher_error import FlasherError
+
+
+class FirmwareIngestResult:
+
+	def __init__(self, project_dir, manifest):
+		self.project_dir = project_dir
+		self.manifest = manifest
+		self.content_hash = None
+		self.version = None
+		self.author = None
+		self.written = 0
+		self.unchanged = 0
+		self.removed = 0
+		self.skipped = 0
+
+	def __str__(self):
+		return "%d written, %d unchanged, %d removed, %d skipped" % (self.written, self.unchanged, self.removed, self.skipped)
+
+
+class FirmwareIngest:
+
+	CHUNK_SIZE = 1024 * 1024
+	MAX_WORKERS = 4
+
+	METADATA_PATTERNS = {
+		"Version.h": ("version", re.compile(r'#define +SHORT_BUILD_VERSION +"([^"]*)"')),
+		"Configuration.h": ("author", re.compile(r'#define +STRING_CONFIG_H_AUTHOR +"([^"]*)"'))
+	}
+
+	def __init__(self, logger):
+		self.__logger = logger
+
+	def find_project_root(self, zip_file, marker):
+		roots = [posixpath.dirname(info.filename) for info in zip_file.infolist() if not info.is_dir() and posixpath.basename(info.filename) == marker]
+		if not roots:
+			return None
+		return min(roots, key=lambda root: (root.count("/") if root else -1, root))
+
+	def ingest(self, zip_file, project_root, destination, manifest_path, preserved=(), rules=()):
+		prefix = project_root + "/" if project_root else ""
+		previous_manifest = self.__load_manifest(manifest_path)
+		os.makedirs(destination, exist_ok=True)
+		files = dict()
+		result = FirmwareIngestResult(destination, files)
+		members = []
+		for info in sorted(zip_file.infolist(), key=lambda info: info.filename):
+			if info.is_dir() or not info.filename.startswith(prefix):
+				continue
+			relative_path = self.__get_safe_path(info.filename[len(prefix):])
+			if relative_path is None:
+				self.__logger.debug("Skipping unsafe archive member %s" % info.filename)
+			elif not self.__is_selected(relative_path, rules):
+				result.skipped += 1
+			else:
+				members.append((relative_path, info))
+
+		def process(member):
+			relative_path, info = member
+			path = os.path.join(destination, *relative_path.split("/"))
+			metadata_pattern = self.METADATA_PATTERNS.get(posixpath.basename(relative_path))
+			previous_entry = self.__get_unchanged_entry(info, path, previous_manifest.get(relative_path))
+			if previous_entry is not None:
+				# The content hash keys the build cache, the member is always hashed, only rewriting the file is skipped
+				entry, found = self.__extract(zip_file, info, path, metadata_pattern, write=False)
+				if entry["sha256"] == previous_entry["sha256"]:
+					return relative_path, entry, False, found
+			entry, found = self.__extract(zip_file, info, path, metadata_pattern)
+			return relative_path, entry, True, found
+		metadata = dict()
+		digest = hashlib.sha256()
+		# zlib releases the GIL, members are decompressed in parallel and processed back in archive order
+		with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+			for relative_path, entry, written, found in executor.map(process, members):
+				if written:
+					result.written += 1
+				else:
+					result.unchanged += 1
+				if found is not None:
+					metadata[found[0]] = found[1]
+				files[relative_path] = entry
+				digest.update(("%s\0%s\n" % (relative_path, entry["sha256"])).encode("utf-8"))
+		result.removed = self.__remove_stale_files(destination, files, preserved)
+		result.content_hash = digest.hexdigest()
+		result.version = metadata.get("version")
+		result.author = metadata.get("author")
+		with open(manifest_path, "w") as manifest_file:
+			json.dump(dict(root=project_root, content_hash=result.content_hash, files=files), manifest_file)
+		return result
+
+	def restore(self, files, destination, manifest_path, preserved=()):
+		previous_manifest = self.__load_manifest(manifest_path)
+		os.makedirs(destination, exist_ok=True)
+		manifest = dict()
+		result = FirmwareIngestResult(destination, manifest)
+		digest = hashlib.sha256()
+		for relative_path in sorted(files):
+			source_path, sha256 = files[relative_path]
+			path = os.path.join(destination, *relative_path.split("/"))
+			entry = previous_manifest.get(relative_path)
+			if entry is not None and entry["sha256"] == sha256 and self.__is_unchanged(path, entry):
+				result.unchanged += 1
+			else:
+				entry = self.__copy(source_path, path, sha256)
+				result.written += 1
+			manifest[relative_path] = entry
+			digest.update(("%s\0%s\n" % (relative_path, sha256)).encode("utf-8"))
+		result.removed = self.__remove_stale_files(destination, manifest, preserved)
+		result.content_hash = digest.hexdigest()
+		with open(manifest_path, "w") as manifest_file:
+			json.dump(dict(root=None, content_hash=result.content_hash, files=manifest), manifest_file)
+		return result
+
+	def __copy(self, source_path, path, sha256):
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		if os.path.isdir(path):
+			shutil.rmtree(path)
+		temp_path = path + ".partial"
+		crc = 0
+		size = 0
+		digest = hashlib.sha256()
+		with open(source_path, "rb") as source, open(temp_path, "wb") as output:
+			for chunk in iter(lambda: source.read(self.CHUNK_SIZE), b""):
+				output.write(chunk)
+				crc = zlib.crc32(chunk, crc)
+				size += len(chunk)
+				digest.update(chunk)
+		if digest.hexdigest() != sha256:
+			os.remove(temp_path)
+			raise FlasherError("The stored file %s is corrupted" % source_path)
+		os.replace(temp_path, path)
+		return dict(
+			crc=crc,
+			size=size,
+			sha256=sha256,
+			mtime_ns=os.stat(path).st_mtime_ns
+		)
+
+	def __extract(self, zip_file, info, path, metadata_pattern, write=True):
+		file_digest = hashlib.sha256()
+		temp_path = path + ".partial"
+		if write:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			if os.path.isdir(path):
+				shutil.rmtree(path)
+		output = open(temp_path, "wb") if write else None
+		pending = b""
+		metadata = None
+		try:
+			with zip_file.open(info, "r") as member:
+				for chunk in iter(lambda: member.read(self.CHUNK_SIZE), b""):
+					file_digest.update(chunk)
+					if output is not None:
+						output.write(chunk)
+					if metadata_pattern is not None and metadata is None:
+						lines = (pending + chunk).split(b"\n")
+						pending = lines.pop()
+						metadata = self.__scan_lines(lines, metadata_pattern)
+				if metadata_pattern is not None and metadata is None:
+					metadata = self.__scan_lines([pending], metadata_pattern)
+		finally:
+			if output is not None:
+				output.close()
+		if write:
+			os.replace(temp_path, path)
+		stat = os.stat(path)
+		return dict(
+			crc=info.CRC,
+			size=info.file_size,
+			sha256=file_digest.hexdigest(),
+			mtime_ns=stat.st_mtime_ns
+		), metadata
+
+	def __scan_lines(self, lines, metadata_pattern):
+		key, pattern = metadata_pattern
+		for line in lines:
+			match = pattern.search(line.decode("utf-8", errors="replace"))
+			if match:
+				self.__logger.debug("Found %s : %s" % (key, match.group(1)))
+				return key, match.group(1)
+		return None
+
+	@staticmethod
+	def __is_selected(relative_path, rules):
+		for action, pattern in rules:
+			if fnmatch.fnmatchcase(relative_path, pattern):
+				return action == "include"
+		return True
+
+	@staticmethod
+	def __get_unchanged_entry(info, path, previous_entry):
+		if previous_entry is None or previous_entry["crc"] != info.CRC or previous_entry["size"] != info.file_size:
+			return None
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		if stat.st_size != info.file_size or stat.st_mtime_ns != previous_entry["mtime_ns"]:
+			return None
+		return previous_entry
+
+	@staticmethod
+	def __is_unchanged(path, entry):
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return False
+		return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+	@staticmethod
+	def __get_safe_path(path):
+		path = posixpath.normpath(path.replace("\\", "/"))
+		if path.startswith("/") or path == ".." or path.startswith("../") or ":" in path.split("/")[0]:
+			return None
+		return path
+
+	@staticmethod
+	def __remove_stale_files(destination, files, preserved):
+		removed = 0
+		for root, dirs, filenames in os.walk(destination, topdown=False):
+			relative_root = os.path.relpath(root, destination).replace(os.sep, "/")
+			if relative_root.split("/")[0] in preserved:
+				continue
+			for f in filenames:
+				relative_path = posixpath.normpath(posixpath.join(relative_root, f))
+				if relative_path not in files and relative_path not in preserved:
+					os.remove(os.path.join(root, f))
+					removed += 1
+			if relative_root != "." and not os.listdir(root):
+				os.rmdir(root)
+		return removed
+
+	@staticmethod
+	def __load_manifest(manifest_path):
+		try:
+			with open(manifest_path) as manifest_file:
+				return json.load(manifest_file)["files"]
+		except (OSError, ValueError, KeyError):
+			return dict()
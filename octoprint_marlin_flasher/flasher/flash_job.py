@@ -0,0 +1,135 @@
+import time
+import uuid
+from threading import Lock, Timer
+from .flasher_error import FlasherError
+
+
+class FlashPhase:
+
+	COMPILE = "compile"
+	UPLOAD = "upload"
+	RECONNECT = "reconnect"
+
+	ALL = [COMPILE, UPLOAD, RECONNECT]
+
+	def __init__(self):
+		raise Exception("This class is an enum like, the constructor should not be called")
+
+
+class FlashStopReason:
+
+	CANCELLED = "cancelled"
+	TIMED_OUT = "timed_out"
+
+	def __init__(self):
+		raise Exception("This class is an enum like, the constructor should not be called")
+
+
+class FlashJob:
+
+	def __init__(self, budgets, logger):
+		self.__id = uuid.uuid4().hex
+		self.__budgets = budgets
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__phase = None
+		self.__deadline = None
+		self.__timer = None
+		self.__stop_reason = None
+		self.__stopped_phase = None
+		self.__finished = False
+		self.__handles = []
+		self.__connection = None
+
+	def get_id(self):
+		return self.__id
+
+	def get_phase(self):
+		return self.__phase
+
+	def get_budget(self, phase):
+		return self.__budgets.get(phase)
+
+	def get_stop_reason(self):
+		return self.__stop_reason
+
+	def get_stopped_phase(self):
+		return self.__stopped_phase
+
+	def is_stopped(self):
+		return self.__stop_reason is not None
+
+	def is_finished(self):
+		return self.__finished
+
+	def start_phase(self, phase):
+		with self.__lock:
+			if self.__timer is not None:
+				self.__timer.cancel()
+				self.__timer = None
+			self.__phase = phase
+			budget = self.__budgets.get(phase)
+			if not budget or self.__finished:
+				self.__deadline = None
+				return
+			self.__deadline = time.monotonic() + budget
+			self.__timer = Timer(budget, self.__expire, args=(phase,))
+			self.__timer.daemon = True
+			self.__timer.start()
+		self.__logger.debug("Flash job %s entered the %s phase, %ss allowed" % (self.__id, phase, budget))
+
+	def get_remaining(self, default):
+		deadline = self.__deadline
+		if deadline is None:
+			return default
+		return max(0, min(default, deadline - time.monotonic()))
+
+	def check(self):
+		if self.__stop_reason == FlashStopReason.CANCELLED:
+			raise FlasherError("The flash process was cancelled")
+		if self.__stop_reason == FlashStopReason.TIMED_OUT:
+			raise FlasherError("The %s phase did not complete within %ss" % (self.__stopped_phase, self.__budgets.get(self.__stopped_phase)))
+
+	def cancel(self):
+		return self.__stop(FlashStopReason.CANCELLED, self.__phase)
+
+	def finish(self):
+		with self.__lock:
+			self.__finished = True
+			if self.__timer is not None:
+				self.__timer.cancel()
+				self.__timer = None
+
+	def set_connection(self, port, baudrate, profile):
+		self.__connection = (port, baudrate, profile)
+
+	def pop_connection(self):
+		connection = self.__connection
+		self.__connection = None
+		return connection
+
+	def attach(self, handle):
+		with self.__lock:
+			self.__handles.append(handle)
+			stopped = self.__stop_reason is not None
+		if stopped:
+			handle.cancel()
+
+	def __expire(self, phase):
+		if self.__phase == phase:
+			self.__logger.warning("The %s phase of flash job %s exceeded its %ss budget" % (phase, self.__id, self.__budgets.get(phase)))
+			self.__stop(FlashStopReason.TIMED_OUT, phase)
+
+	def __stop(self, reason, phase):
+		with self.__lock:
+			if self.__stop_reason is not None or self.__finished:
+				return False
+			self.__stop_reason = reason
+			self.__stopped_phase = phase
+			handles = [handle for handle in self.__handles if not handle.done()]
+		self.__logger.info("Stopping flash job %s (%s)" % (self.__id, reason))
+		for handle in handles:
+			handle.cancel()
+		if not handles:
+			self.__logger.warning("No process of flash job %s could be stopped, it ends when the running step returns" % self.__id)
+		return True
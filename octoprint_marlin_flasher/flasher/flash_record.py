@@ -0,0 +1,41 @@
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+
+
+class FlashRecordStore:
+
+	def __init__(self, record_dir, logger):
+		self.__record_dir = record_dir
+		self.__logger = logger
+		self.__lock = Lock()
+
+	def get(self, port):
+		with self.__lock:
+			try:
+				with open(self.__get_record_path(port)) as record_file:
+					return json.load(record_file)
+			except (OSError, ValueError):
+				return None
+
+	def set(self, port, record):
+		with self.__lock:
+			os.makedirs(self.__record_dir, exist_ok=True)
+			record = dict(record, port=port, time=time.time())
+			temp_path = self.__get_record_path(port) + ".partial"
+			with open(temp_path, "w") as record_file:
+				json.dump(record, record_file)
+			os.replace(temp_path, self.__get_record_path(port))
+
+	def discard(self, port):
+		with self.__lock:
+			try:
+				os.remove(self.__get_record_path(port))
+				self.__logger.debug("Forgot the flashed pages of %s" % port)
+			except OSError:
+				pass
+
+	def __get_record_path(self, port):
+		return os.path.join(self.__record_dir, "%s.json" % hashlib.sha256(port.encode("utf-8")).hexdigest())
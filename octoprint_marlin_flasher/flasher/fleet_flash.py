@@ -0,0 +1,81 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+
+class FleetPortStatus:
+
+	PENDING = "pending"
+	FLASHING = "flashing"
+	SUCCESS = "success"
+	FAILED = "failed"
+
+	def __init__(self):
+		raise Exception("This class is an enum like, the constructor should not be called")
+
+
+class FleetFlashJob:
+
+	def __init__(self, ports, upload, status_observer, max_workers, logger):
+		self.__ports = ports
+		self.__upload = upload
+		self.__status_observer = status_observer
+		self.__max_workers = max(1, min(max_workers, len(ports)))
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__results = dict()
+		for port in ports:
+			self.__results[port] = dict(
+				port=port,
+				status=FleetPortStatus.PENDING
+			)
+
+	def run(self):
+		self.__logger.info("Flashing %d boards using %d workers" % (len(self.__ports), self.__max_workers))
+		for port in self.__ports:
+			self.__notify(port)
+		with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+			for _ in executor.map(self.__flash_port, self.__ports):
+				pass
+		return self.get_summary()
+
+	def get_summary(self):
+		with self.__lock:
+			results = [dict(self.__results[port]) for port in self.__ports]
+		return dict(
+			results=results,
+			succeeded=len([r for r in results if r["status"] == FleetPortStatus.SUCCESS]),
+			failed=len([r for r in results if r["status"] == FleetPortStatus.FAILED])
+		)
+
+	def __flash_port(self, port):
+		self.__update(port, status=FleetPortStatus.FLASHING)
+		self.__logger.info("Uploading to %s..." % port)
+		start = time.monotonic()
+		try:
+			success, message, error_output = self.__upload(port)
+		except Exception as e:
+			self.__logger.exception("Unexpected error while uploading to %s" % port)
+			success, message, error_output = False, str(e), None
+		duration = round(time.monotonic() - start, 1)
+		if success:
+			self.__logger.info("Upload to %s succeeded in %.1fs" % (port, duration))
+		else:
+			self.__logger.warning("Upload to %s failed after %.1fs" % (port, duration))
+		self.__update(
+			port,
+			status=FleetPortStatus.SUCCESS if success else FleetPortStatus.FAILED,
+			message=message,
+			error_output=error_output,
+			duration=duration
+		)
+
+	def __update(self, port, **kwargs):
+		with self.__lock:
+			self.__results[port].update(kwargs)
+		self.__notify(port)
+
+	def __notify(self, port):
+		with self.__lock:
+			status = dict(self.__results[port])
+		self.__status_observer(status)
@@ -0,0 +1,116 @@
+from .flasher_error import FlasherError
+
+
+class IntelHexImage:
+
+	def __init__(self, segments, start_address=None):
+		self.__segments = segments
+		self.start_address = start_address
+
+	def get_segments(self):
+		return [(address, bytes(data)) for address, data in self.__segments]
+
+	def get_start(self):
+		if not self.__segments:
+			return 0
+		return self.__segments[0][0]
+
+	def get_end(self):
+		if not self.__segments:
+			return 0
+		address, data = self.__segments[-1]
+		return address + len(data)
+
+	def get_size(self):
+		return sum([len(data) for _, data in self.__segments])
+
+	def get_bytes(self, start=None, end=None, fill=0xFF):
+		start = self.get_start() if start is None else start
+		end = self.get_end() if end is None else end
+		image = bytearray([fill]) * max(end - start, 0)
+		for address, data in self.__segments:
+			low = max(address, start)
+			high = min(address + len(data), end)
+			if low < high:
+				image[low - start:high - start] = data[low - address:high - address]
+		return bytes(image)
+
+
+class IntelHexReader:
+
+	DATA = 0x00
+	END_OF_FILE = 0x01
+	EXTENDED_SEGMENT_ADDRESS = 0x02
+	START_SEGMENT_ADDRESS = 0x03
+	EXTENDED_LINEAR_ADDRESS = 0x04
+	START_LINEAR_ADDRESS = 0x05
+
+	def read(self, path):
+		segments = []
+		base_address = 0
+		start_address = None
+		ended = False
+		with open(path, "rb") as hex_file:
+			for line_number, line in enumerate(hex_file, 1):
+				line = line.strip()
+				if not line:
+					continue
+				if ended:
+					raise self.__error(line_number, "data found after the end of file record")
+				record_type, address, data = self.__parse_record(line, line_number)
+				if record_type == self.DATA:
+					self.__add_data(segments, base_address + address, data, line_number)
+				elif record_type == self.END_OF_FILE:
+					ended = True
+				elif record_type == self.EXTENDED_SEGMENT_ADDRESS:
+					base_address = self.__get_word(data, 2, line_number) << 4
+				elif record_type == self.EXTENDED_LINEAR_ADDRESS:
+					base_address = self.__get_word(data, 2, line_number) << 16
+				elif record_type in (self.START_SEGMENT_ADDRESS, self.START_LINEAR_ADDRESS):
+					start_address = self.__get_word(data, 4, line_number)
+				else:
+					raise self.__error(line_number, "unknown record type")
+		if not ended:
+			raise FlasherError("no end of file record")
+		return IntelHexImage(segments, start_address)
+
+	def __parse_record(self, line, line_number):
+		if line[:1] != b":" or len(line) < 11 or len(line) % 2 == 0:
+			raise self.__error(line_number, "malformed record")
+		try:
+			record = bytes.fromhex(line[1:].decode("ascii"))
+		except ValueError:
+			raise self.__error(line_number, "malformed record")
+		if record[0] != len(record) - 5:
+			raise self.__error(line_number, "wrong record length")
+		if sum(record) & 0xFF != 0:
+			raise self.__error(line_number, "wrong checksum")
+		return record[3], (record[1] << 8) | record[2], record[4:-1]
+
+	def __add_data(self, segments, address, data, line_number):
+		if not data:
+			return
+		# Compilers emit records in ascending order, extending the last segment is the common case
+		if segments:
+			last_address, last_data = segments[-1]
+			if address == last_address + len(last_data):
+				last_data.extend(data)
+				return
+		end = address + len(data)
+		index = len(segments)
+		while index > 0 and segments[index - 1][0] > address:
+			index -= 1
+		if index > 0 and segments[index - 1][0] + len(segments[index - 1][1]) > address:
+			raise self.__error(line_number, "overlapping data")
+		if index < len(segments) and segments[index][0] < end:
+			raise self.__error(line_number, "overlapping data")
+		segments.insert(index, (address, bytearray(data)))
+
+	def __get_word(self, data, size, line_number):
+		if len(data) != size:
+			raise self.__error(line_number, "wrong record length")
+		return int.from_bytes(data, "big")
+
+	@staticmethod
+	def __error(line_number, reason):
+		return FlasherError("line %d : %s" % (line_number, reason))
@@ -0,0 +1,212 @@
+import os
+import re
+from .parsed_file_cache import ParsedFileCache
+
+
+class MarlinConfig:
+
+	AXES = ["X", "X2", "Y", "Y2", "Z", "Z2", "Z3", "Z4", "I", "J", "K", "U", "V", "W"] + ["E%d" % e for e in range(8)]
+
+	def __init__(self, definitions):
+		self.__index = dict()
+		for definition in definitions:
+			self.__index.setdefault(definition["name"], []).append(definition)
+
+	def get_names(self):
+		return sorted(self.__index)
+
+	def get_definitions(self, name):
+		return [dict(definition) for definition in self.__index.get(name, [])]
+
+	def is_enabled(self, name):
+		return self.__get_active_definition(name) is not None
+
+	def get_value(self, name):
+		definition = self.__get_active_definition(name)
+		if definition is None:
+			return None
+		return definition["value"]
+
+	def get_motherboard(self):
+		return self.get_value("MOTHERBOARD")
+
+	def get_extruder_count(self):
+		extruders = self.get_value("EXTRUDERS")
+		if extruders is None or not extruders.isdigit():
+			return None
+		return int(extruders)
+
+	def get_driver_types(self):
+		drivers = dict()
+		for axis in self.AXES:
+			driver_type = self.get_value("%s_DRIVER_TYPE" % axis)
+			if driver_type is not None:
+				drivers[axis] = driver_type
+		return drivers
+
+	def get_summary(self):
+		return dict(
+			version=self.get_value("CONFIGURATION_H_VERSION"),
+			motherboard=self.get_motherboard(),
+			extruders=self.get_extruder_count(),
+			drivers=self.get_driver_types(),
+			serial_port=self.get_value("SERIAL_PORT"),
+			baudrate=self.get_value("BAUDRATE")
+		)
+
+	def __get_active_definition(self, name):
+		definitions = [d for d in self.__index.get(name, []) if d["enabled"]]
+		# The last unconditional definition wins, conditional ones are only a fallback
+		unconditional = [d for d in definitions if d["condition"] is None]
+		if unconditional:
+			definition = unconditional[-1]
+		elif definitions:
+			definition = definitions[0]
+		else:
+			return None
+		if definition["undef"]:
+			return None
+		return definition
+
+
+class MarlinConfigParser:
+
+	DIRECTIVE_PATTERN = re.compile(r"^#\s*(\w+)\s*(.*?)\s*$")
+	DISABLED_DEFINE_PATTERN = re.compile(r"^//\s*#\s*define\s+(\w+)(.*)$")
+	DEFINE_PATTERN = re.compile(r"^(\w+)(\([^)]*\))?\s*(.*?)\s*$")
+
+	def parse(self, content, file_name):
+		definitions = []
+		conditions = []
+		in_comment = False
+		for line_number, line in self.__get_logical_lines(content):
+			stripped = line.strip()
+			if not in_comment:
+				disabled = self.DISABLED_DEFINE_PATTERN.match(stripped)
+				if disabled:
+					definitions.append(self.__get_definition(disabled.group(1) + disabled.group(2), False, False, conditions, file_name, line_number))
+					continue
+			code, in_comment = self.__strip_comments(line, in_comment)
+			directive = self.DIRECTIVE_PATTERN.match(code.strip())
+			if not directive:
+				continue
+			keyword, argument = directive.groups()
+			if keyword == "define":
+				definitions.append(self.__get_definition(argument, True, False, conditions, file_name, line_number))
+			elif keyword == "undef":
+				definitions.append(self.__get_definition(argument, True, True, conditions, file_name, line_number))
+			elif keyword == "if":
+				conditions.append(dict(previous=[], current=argument))
+			elif keyword == "ifdef":
+				conditions.append(dict(previous=[], current="defined(%s)" % argument))
+			elif keyword == "ifndef":
+				conditions.append(dict(previous=[], current="!defined(%s)" % argument))
+			elif keyword == "elif" and conditions:
+				conditions[-1]["previous"].append(conditions[-1]["current"])
+				conditions[-1]["current"] = argument
+			elif keyword == "else" and conditions:
+				conditions[-1]["previous"].append(conditions[-1]["current"])
+				conditions[-1]["current"] = None
+			elif keyword == "endif" and conditions:
+				conditions.pop()
+		return definitions
+
+	def __get_definition(self, argument, enabled, undef, conditions, file_name, line_number):
+		match = self.DEFINE_PATTERN.match(argument.strip())
+		name, parameters, value = match.groups() if match else (argument.strip(), None, "")
+		if not enabled:
+			value, _ = self.__strip_comments(value, False)
+			value = value.strip()
+		return dict(
+			name=name,
+			value=None if undef else value,
+			parameters=parameters,
+			enabled=enabled,
+			undef=undef,
+			condition=self.__flatten(conditions),
+			file=file_name,
+			line=line_number
+		)
+
+	@staticmethod
+	def __flatten(conditions):
+		parts = []
+		for condition in conditions:
+			for previous in condition["previous"]:
+				parts.append("!(%s)" % previous)
+			if condition["current"] is not None:
+				parts.append("(%s)" % condition["current"])
+		if not parts:
+			return None
+		return " && ".join(parts)
+
+	@staticmethod
+	def __get_logical_lines(content):
+		pending = ""
+		start = None
+		for line_number, line in enumerate(content.splitlines(), 1):
+			if start is None:
+				start = line_number
+			if line.endswith("\\"):
+				pending += line[:-1] + " "
+				continue
+			yield start, pending + line
+			pending = ""
+			start = None
+		if pending:
+			yield start, pending
+
+	@staticmethod
+	def __strip_comments(line, in_comment):
+		code = []
+		i = 0
+		quote = None
+		while i < len(line):
+			if in_comment:
+				end = line.find("*/", i)
+				if end < 0:
+					return "".join(code), True
+				in_comment = False
+				i = end + 2
+				code.append(" ")
+				continue
+			c = line[i]
+			if quote is not None:
+				code.append(c)
+				if c == "\\" and i + 1 < len(line):
+					code.append(line[i + 1])
+					i += 1
+				elif c == quote:
+					quote = None
+			elif c in "\"'":
+				quote = c
+				code.append(c)
+			elif line.startswith("//", i):
+				break
+			elif line.startswith("/*", i):
+				in_comment = True
+				i += 1
+			else:
+				code.append(c)
+			i += 1
+		return "".join(code), in_comment
+
+
+class MarlinConfigIndex:
+
+	CONFIGURATION_FILES = ["Configuration.h", "Configuration_adv.h"]
+
+	def __init__(self, cache_dir, logger):
+		self.__cache = ParsedFileCache(cache_dir, MarlinConfigParser().parse, logger)
+
+	def get(self, configuration_dir):
+		definitions = []
+		found = False
+		for file_name in self.CONFIGURATION_FILES:
+			path = os.path.join(configuration_dir, file_name)
+			if os.path.isfile(path):
+				found = True
+				definitions.extend(self.__cache.get(path))
+		if not found:
+			return None
+		return MarlinConfig(definitions)
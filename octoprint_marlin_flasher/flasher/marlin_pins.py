@@ -0,0 +1,52 @@
+import re
+from .parsed_file_cache import ParsedFileCache
+
+
+class MarlinPins:
+
+	def __init__(self, boards):
+		self.__boards = boards
+
+	def get_boards(self):
+		return sorted(self.__boards)
+
+	def get_environments(self, motherboard):
+		if motherboard.startswith("BOARD_"):
+			motherboard = motherboard[6:]
+		return list(self.__boards.get(motherboard, []))
+
+
+class MarlinPinsParser:
+
+	BOARD_CONDITION_PATTERN = re.compile(r"^\s*#\s*(?:el)?if\s+MB\(([^)]*)\)")
+	ENVIRONMENT_PATTERN = re.compile(r"\benv:(\S+)")
+
+	def parse(self, content, file_name):
+		boards = dict()
+		pending = None
+		for line in content.splitlines():
+			match = self.BOARD_CONDITION_PATTERN.match(line)
+			if match:
+				pending = [board.strip() for board in match.group(1).split(",") if board.strip()]
+				for board in pending:
+					boards.setdefault(board, [])
+				continue
+			if pending is None:
+				continue
+			# The environments are listed in a comment on the include following the board condition
+			environments = self.ENVIRONMENT_PATTERN.findall(line)
+			if environments:
+				for board in pending:
+					if not boards[board]:
+						boards[board] = environments
+			pending = None
+		return boards
+
+
+class MarlinPinsIndex:
+
+	def __init__(self, cache_dir, logger):
+		self.__cache = ParsedFileCache(cache_dir, MarlinPinsParser().parse, logger)
+
+	def get(self, pins_path):
+		return MarlinPins(self.__cache.get(pins_path))
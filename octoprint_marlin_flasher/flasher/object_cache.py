@@ -0,0 +1,126 @@
+import os
+import shutil
+from threading import Lock
+
+
+class ObjectCache:
+
+	STATS_TIMEOUT = 10
+	# ccache -s labels of the counters before --print-stats exists, in ccache 3.x
+	SUMMARY_COUNTERS = dict([
+		("cache hit (direct)", "direct_cache_hit"),
+		("cache hit (preprocessed)", "preprocessed_cache_hit"),
+		("cache miss", "cache_miss")
+	])
+
+	def __init__(self, cache_dir, logger, process_runner):
+		self.__cache_dir = cache_dir
+		self.__ccache_dir = os.path.join(cache_dir, "ccache")
+		self.__platformio_dir = os.path.join(cache_dir, "platformio")
+		self.__logger = logger
+		self.__process_runner = process_runner
+		self.__lock = Lock()
+
+	def get_ccache_launcher(self, max_size):
+		if max_size <= 0:
+			return None
+		ccache = shutil.which("ccache")
+		env = shutil.which("env")
+		if ccache is None or env is None:
+			self.__logger.debug("ccache is not available, compiling without object cache")
+			return None
+		os.makedirs(self.__ccache_dir, exist_ok=True)
+		return "\"%s\" \"CCACHE_DIR=%s\" \"CCACHE_MAXSIZE=%dM\" \"%s\"" % (env, self.__ccache_dir, max_size // (1024 * 1024), ccache)
+
+	def get_platformio_env(self, max_size):
+		if max_size <= 0:
+			return None
+		os.makedirs(self.__platformio_dir, exist_ok=True)
+		env = dict(os.environ)
+		env["PLATFORMIO_BUILD_CACHE_DIR"] = self.__platformio_dir
+		return env
+
+	def trim(self, max_size):
+		with self.__lock:
+			# ccache keeps itself under its own limit, the PlatformIO cache gets whatever is left
+			available = max_size - self.__get_size(self.__ccache_dir)
+			entries = []
+			total_size = 0
+			for root, dirs, files in os.walk(self.__platformio_dir):
+				for f in files:
+					path = os.path.join(root, f)
+					stat = os.stat(path)
+					total_size += stat.st_size
+					entries.append((max(stat.st_atime, stat.st_mtime), path, stat.st_size))
+			if total_size <= available:
+				return
+			entries.sort()
+			for _, path, size in entries:
+				if total_size <= available:
+					break
+				os.remove(path)
+				total_size -= size
+			self.__logger.debug("PlatformIO object cache trimmed to %d bytes" % total_size)
+
+	def get_stats(self):
+		return dict(
+			size=self.__get_size(self.__cache_dir),
+			arduino=self.__get_ccache_stats(),
+			platformio=dict(
+				size=self.__get_size(self.__platformio_dir)
+			)
+		)
+
+	def __get_ccache_stats(self):
+		ccache = shutil.which("ccache")
+		if ccache is None or not os.path.isdir(self.__ccache_dir):
+			return None
+		env = dict(os.environ)
+		env["CCACHE_DIR"] = self.__ccache_dir
+		counters = self.__read_ccache_counters([ccache, "--print-stats"], env, self.__parse_print_stats)
+		if counters is None:
+			counters = self.__read_ccache_counters([ccache, "-s"], env, self.__parse_summary)
+		if counters is None:
+			self.__logger.debug("Could not read ccache statistics")
+			return None
+		return dict(
+			size=self.__get_size(self.__ccache_dir),
+			hits=counters.get("direct_cache_hit", 0) + counters.get("preprocessed_cache_hit", 0),
+			misses=counters.get("cache_miss", 0)
+		)
+
+	def __read_ccache_counters(self, command, env, parse):
+		output = []
+		# The stats are requested from the UI, they must not queue behind running builds
+		result = self.__process_runner.start(command, output.append, env=env, timeout=self.STATS_TIMEOUT, limited=False, error_handler=lambda line: None).wait()
+		if not result.success:
+			return None
+		counters = parse(output)
+		return counters if counters else None
+
+	@staticmethod
+	def __parse_print_stats(lines):
+		counters = dict()
+		for line in lines:
+			parts = line.rstrip("\n").split("\t")
+			if len(parts) == 2 and parts[1].isdigit():
+				counters[parts[0]] = int(parts[1])
+		return counters
+
+	@staticmethod
+	def __parse_summary(lines):
+		counters = dict()
+		for line in lines:
+			label, _, value = line.strip().rpartition(" ")
+			label = label.strip()
+			if label in ObjectCache.SUMMARY_COUNTERS and value.isdigit():
+				counters[ObjectCache.SUMMARY_COUNTERS[label]] = int(value)
+		return counters
+
+	@staticmethod
+	def __get_size(path):
+		size = 0
+		for root, dirs, files in os.walk(path):
+			for f in files:
+				size += os.path.getsize(os.path.join(root, f))
+		return size
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import requests
+from .flasher_error import FlasherError
+
+
+class PackageCache:
+
+	CHUNK_SIZE = 64 * 1024
+
+	def __init__(self, cache_dir, logger):
+		self.__cache_dir = cache_dir
+		self.__logger = logger
+
+	def get_checksums(self, url, connect_timeout, read_timeout):
+		path = os.path.join(self.__cache_dir, url.rpartition("/")[2])
+		if not os.path.isfile(path):
+			self.__logger.debug("Downloading checksums from %s" % url)
+			self.__download(url, path, connect_timeout, read_timeout)
+		checksums = dict()
+		with open(path) as checksums_file:
+			for line in checksums_file:
+				parts = line.split()
+				if len(parts) == 2:
+					checksums[parts[1].lstrip("*")] = parts[0].lower()
+		return checksums
+
+	def get(self, url, sha256, connect_timeout, read_timeout):
+		path = os.path.join(self.__cache_dir, url.rpartition("/")[2])
+		if os.path.isfile(path):
+			if self.__get_sha256(path) == sha256:
+				self.__logger.info("Using cached package %s" % path)
+				return path
+			self.__logger.warning("Cached package %s is corrupted, downloading it again" % path)
+			os.remove(path)
+		digest = self.__download(url, path, connect_timeout, read_timeout)
+		if digest != sha256:
+			os.remove(path)
+			raise FlasherError("Checksum mismatch for %s, expected %s but got %s" % (url, sha256, digest))
+		return path
+
+	def __download(self, url, path, connect_timeout, read_timeout):
+		os.makedirs(self.__cache_dir, exist_ok=True)
+		partial_path = path + ".partial"
+		digest = hashlib.sha256()
+		with requests.get(url, stream=True, timeout=(connect_timeout, read_timeout)) as r:
+			r.raise_for_status()
+			with open(partial_path, "wb") as partial_file:
+				for chunk in r.iter_content(self.CHUNK_SIZE):
+					partial_file.write(chunk)
+					digest.update(chunk)
+		os.replace(partial_path, path)
+		return digest.hexdigest()
+
+	def __get_sha256(self, path):
+		digest = hashlib.sha256()
+		with open(path, "rb") as package_file:
+			for chunk in iter(lambda: package_file.read(self.CHUNK_SIZE), b""):
+				digest.update(chunk)
+		return digest.hexdigest()
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import os
+from threading import Lock
+
+
+class ParsedFileCache:
+
+	MAX_MEMORY_ENTRIES = 8
+	MAX_DISK_ENTRIES = 32
+
+	def __init__(self, cache_dir, parse, logger):
+		self.__cache_dir = cache_dir
+		self.__parse = parse
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__file_hashes = dict()
+		self.__parsed = dict()
+
+	def get(self, path):
+		stat = os.stat(path)
+		key = (path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+		with self.__lock:
+			file_hash = self.__file_hashes.get(key)
+		content = None
+		if file_hash is None:
+			content = self.__read(path)
+			file_hash = hashlib.sha256(content).hexdigest()
+			with self.__lock:
+				if len(self.__file_hashes) >= self.MAX_MEMORY_ENTRIES * 4:
+					self.__file_hashes.clear()
+				self.__file_hashes[key] = file_hash
+		with self.__lock:
+			if file_hash in self.__parsed:
+				return self.__parsed[file_hash]
+		cache_path = os.path.join(self.__cache_dir, "%s.json" % file_hash)
+		try:
+			with open(cache_path) as cache_file:
+				parsed = json.load(cache_file)
+			os.utime(cache_path)
+		except (OSError, ValueError):
+			if content is None:
+				content = self.__read(path)
+			self.__logger.debug("Indexing %s" % path)
+			parsed = self.__parse(content.decode("utf-8", errors="replace"), os.path.basename(path))
+			os.makedirs(self.__cache_dir, exist_ok=True)
+			with open(cache_path, "w") as cache_file:
+				json.dump(parsed, cache_file)
+			self.__prune()
+		with self.__lock:
+			if len(self.__parsed) >= self.MAX_MEMORY_ENTRIES:
+				self.__parsed.pop(next(iter(self.__parsed)))
+			self.__parsed[file_hash] = parsed
+		return parsed
+
+	def __prune(self):
+		entries = sorted([os.path.join(self.__cache_dir, f) for f in os.listdir(self.__cache_dir)], key=os.path.getmtime)
+		for path in entries[:-self.MAX_DISK_ENTRIES]:
+			os.remove(path)
+
+	@staticmethod
+	def __read(path):
+		with open(path, "rb") as f:
+			return f.read()
@@ -1,28 +1,53 @@
+import configparser
 import json
 import sys
 from .base_flasher import BaseFlasher
+from .flasher_error import FlasherError
 from collections import deque
-from subprocess import Popen, PIPE
 import zipfile
 import os
 import shutil
 import re
-from threading import Thread
 from datetime import datetime
 import serial
 import flask
 import platform
 from flask_babel import gettext
 from .platformio_remote import PlatformIoRemoteAgent
+from .firmware_ingest import FirmwareIngest
+from .marlin_pins import MarlinPinsIndex
+from .flash_job import FlashPhase
+from .ttl_cache import TtlCache
 
 
 class PlatformIOFlasher(BaseFlasher):
 
-	def __init__(self, settings, printer, plugin, plugin_manager, identifier, logger):
-		BaseFlasher.__init__(self, settings, printer, plugin, plugin_manager, identifier, logger)
-		self.__remote_agent = PlatformIoRemoteAgent(settings, logger, printer)
+	# Documentation, CI configurations and test scripts of the project are never part of a build
+	EXTRACTION_RULES = [
+		("exclude", ".github/*"),
+		("exclude", ".devcontainer/*"),
+		("exclude", ".vscode/*"),
+		("exclude", "docs/*"),
+		("exclude", "buildroot/tests/*"),
+		("exclude", "buildroot/share/pixmaps/*"),
+		("exclude", "*.md")
+	]
+
+	COMMAND_TIMEOUT = 120
+	INSTALL_TIMEOUT = 1800
+	BUILD_TIMEOUT = 3 * 3600
+	UPLOAD_TIMEOUT = 600
+	ACCOUNT_STATUS_TTL = 600
+
+	def __init__(self, settings, printer, plugin, plugin_manager, identifier, logger, object_cache, artifact_store, process_runner):
+		BaseFlasher.__init__(self, settings, printer, plugin, plugin_manager, identifier, logger, object_cache, artifact_store, process_runner)
+		self.__remote_agent = PlatformIoRemoteAgent(settings, logger, printer, process_runner)
 		self.__remote_agent.add_status_observer(self.__push_remote_agent_status)
 		self.__remote_agent.add_log_observer(self.__push_remote_agent_log)
+		self.__firmware_ingest = FirmwareIngest(logger)
+		self.__pins_index = MarlinPinsIndex(os.path.join(plugin.get_plugin_data_folder(), "pins_index"), logger)
+		self.__prebuilt_firmware = None
+		self.__account_status = TtlCache(self.ACCOUNT_STATUS_TTL, self.__fetch_account, self.__send_login_status, logger)
 
 	def start_install(self):
 		system = platform.system()
@@ -47,22 +72,21 @@ class PlatformIOFlasher(BaseFlasher):
 			))
 			shutil.rmtree(venv_path)
 
-		def handle_log(stream):
-			for line in stream:
-				line = line.rstrip()
-				self._logger.info(line)
-				self._plugin_manager.send_plugin_message(self._identifier, dict(
-					type="platformio_install",
-					finished=False,
-					status=line
-				))
+		def handle_log(line):
+			line = line.rstrip()
+			self._logger.info(line)
+			self._plugin_manager.send_plugin_message(self._identifier, dict(
+				type="platformio_install",
+				finished=False,
+				status=line
+			))
 		if system == "Windows":
 			exec_ext = ".exe"
 		else:
 			exec_ext = ""
 		new_exec_path = os.path.join(venv_path, exec_folder, "python" + exec_ext)
-		success = self.__exec([sys.executable, "-m", "virtualenv", "-p", "python3", venv_path], handle_log, handle_log) \
-			and self.__exec([new_exec_path, "-m", "pip", "install", "platformio", "--no-cache-dir"], handle_log, handle_log)
+		success = self.__exec([sys.executable, "-m", "virtualenv", "-p", "python3", venv_path], handle_log, timeout=self.INSTALL_TIMEOUT) \
+			and self.__exec([new_exec_path, "-m", "pip", "install", "platformio", "--no-cache-dir"], handle_log, timeout=self.INSTALL_TIMEOUT)
 		if success:
 			pio_path = os.path.join(venv_path, exec_folder, "pio" + exec_ext)
 			self._logger.info("Platformio installed successfully in %s" % pio_path)
@@ -82,17 +106,15 @@ class PlatformIOFlasher(BaseFlasher):
 				status=gettext("The installation failed")
 			))
 
-	def __exec(self, command, stdout_handler, stderr_handler, show_in_logs=True):
+	def __exec(self, command, line_handler, show_in_logs=True, env=None, timeout=COMMAND_TIMEOUT, job=None):
 		if show_in_logs:
 			self._logger.debug("Executing command : %s" % " ".join(command))
-		with Popen(command, stdout=PIPE, stderr=PIPE, universal_newlines=True) as p:
-			stdout_thread = Thread(target=stdout_handler, args=(p.stdout,))
-			stderr_thread = Thread(target=stderr_handler, args=(p.stderr,))
-			stdout_thread.start()
-			stderr_thread.start()
-			p.wait()
-			self._logger.debug("The command exited with status %d" % p.returncode)
-			return p.returncode == 0
+		handle = self._process_runner.start(command, line_handler, env=env, timeout=timeout)
+		if job is not None:
+			job.attach(handle)
+		result = handle.wait()
+		self._logger.debug("The command exited with status %s" % result.returncode)
+		return result.success
 
 	def _validate_firmware_file(self, file_path):
 		self._logger.debug("Validating firmware file...")
@@ -108,29 +130,39 @@ class PlatformIOFlasher(BaseFlasher):
 		self._firmware_version = None
 		self._firmware_author = None
 		self._firmware_upload_time = None
+		self._artifact_id = None
 		with zipfile.ZipFile(firmware_file_path, "r") as zip_file:
-			firmware_dir = os.path.join(self._plugin.get_plugin_data_folder(), "firmware_platformio")
-			if os.path.exists(firmware_dir):
-				shutil.rmtree(firmware_dir)
-			os.makedirs(firmware_dir)
-			self._logger.debug("Extracting firmware archive...")
-			zip_file.extractall(firmware_dir)
-			self._logger.debug("Browsing files...")
-			for root, dirs, files in os.walk(firmware_dir):
-				for f in files:
-					if f == "platformio.ini":
-						self._logger.debug("Found platformio.ini")
-						self._firmware = root
-						self._firmware_upload_time = datetime.now()
-			if self._firmware:
-				self._find_firmware_info()
-				return dict(
-					path=self._firmware,
-					file="platformio.ini"
-				), None
-			return None, [gettext("No PlatformIO configuration file were found in the given file.")]
-
-	def check_setup_errors(self):
+			self._logger.debug("Browsing archive members...")
+			project_root = self.__firmware_ingest.find_project_root(zip_file, "platformio.ini")
+			if project_root is None:
+				return None, [gettext("No PlatformIO configuration file were found in the given file.")]
+			self._logger.debug("Found platformio.ini")
+			self._logger.debug("Extracting the project into the workspace...")
+			# Unchanged files keep their mtime so builds stay incremental
+			result = self.__firmware_ingest.ingest(
+				zip_file,
+				project_root,
+				os.path.join(self._plugin.get_plugin_data_folder(), "firmware_platformio"),
+				os.path.join(self._plugin.get_plugin_data_folder(), "firmware_platformio.manifest.json"),
+				preserved=[".pio"],
+				rules=self.EXTRACTION_RULES
+			)
+			self._logger.debug("Workspace synchronized : %s" % result)
+			self._firmware = result.project_dir
+			self._firmware_version = result.version
+			self._firmware_author = result.author
+			self._firmware_upload_time = datetime.now()
+			self._artifact_id = result.content_hash
+			self._store_sources("platformio", "project", "platformio.ini", result.project_dir, dict([(relative_path, entry["sha256"]) for relative_path, entry in result.manifest.items()]))
+			return dict(
+				path=self._firmware,
+				file="platformio.ini"
+			), None
+
+	def _get_cli_path(self):
+		return self._settings.get_platformio_cli_path()
+
+	def _check_setup_errors(self):
 		self._logger.debug("Checking PlatformIO configuration...")
 		no_platformio_path = self._settings.get_platformio_cli_path() is None
 		if no_platformio_path:
@@ -138,12 +170,11 @@ class PlatformIOFlasher(BaseFlasher):
 			return [gettext("No path has been configured, check the plugin settings.")]
 		version_logs = deque()
 
-		def handle_logs(stream):
-			for line in stream:
-				self._logger.debug(line.rstrip())
-				version_logs.append(line)
+		def handle_logs(line):
+			self._logger.debug(line.rstrip())
+			version_logs.append(line)
 
-		success = self.__exec([self._settings.get_platformio_cli_path(), "--version"], handle_logs, handle_logs)
+		success = self.__exec([self._settings.get_platformio_cli_path(), "--version"], handle_logs)
 		version_logs = "".join(version_logs)
 		if not success or "platformio" not in version_logs.lower():
 			self._logger.info("The configured path does not point to PlatformIO-Core")
@@ -154,41 +185,87 @@ class PlatformIOFlasher(BaseFlasher):
 		if self._firmware is None:
 			self._logger.debug("No firmware uploaded")
 			return None, [gettext("You did not upload the firmware or it got reset by the previous flash process.")]
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
 		if not self._printer.is_ready():
 			self._logger.debug("Printer not ready")
 			return None, [gettext("The printer may not be connected or it may be busy.")]
 		env = None
 		if "env" in flask.request.values and flask.request.values["env"]:
 			env = flask.request.values["env"]
-		thread = Thread(target=self.__background_flash, args=(env,))
-		thread.start()
+		job = self._start_flash_job(self.__background_flash, (env,))
 		self._logger.debug("Saving options")
 		self._settings.set_platformio_last_flash_options(flask.request.values.to_dict())
 		self._settings.save()
 		self.__push_last_flash_option()
 		return dict(
-			message=gettext("Flash process started.")
+			message=gettext("Flash process started."),
+			job=job.get_id()
 		), None
 
-	def __background_flash(self, env):
-		self._logger.info("Starting flashing process...")
+	def __get_build_args(self, env):
+		pio_args = [self._settings.get_platformio_cli_path(), "run", "-d", self._firmware]
+		if env:
+			pio_args.extend(["-e", env])
+		return pio_args
+
+	def __exec_build(self, env, handle_logs, job=None):
+		max_cache_size = self._settings.get_object_cache_size() * 1024 * 1024
+		pio_args = self.__get_build_args(env)
+		jobs = self._build_scheduler.get_jobs()
+		if jobs > 0:
+			pio_args.extend(["-j", str(jobs)])
+		self._logger.debug("Executing command : %s" % " ".join(pio_args))
+		result = self._build_scheduler.run_process(
+			self._process_runner,
+			pio_args,
+			handle_logs,
+			handle_observer=job.attach if job is not None else None,
+			env=self._object_cache.get_platformio_env(max_cache_size),
+			timeout=self.BUILD_TIMEOUT
+		)
+		self._logger.debug("The command exited with status %s" % result.returncode)
+		success = result.success
+		if max_cache_size > 0:
+			self._object_cache.trim(max_cache_size)
+		return success
+
+	def _speculative_build(self):
+		last_flash_options = self._settings.get_platformio_last_flash_options()
+		if not last_flash_options:
+			self._logger.debug("No previous flash options, no speculative build")
+			return
+		env = last_flash_options.get("env") or None
+		firmware_upload_time = self._firmware_upload_time
+		self._logger.info("Speculatively compiling environment %s" % (env if env else "default"))
+
+		def handle_logs(line):
+			self._logger.debug(line.rstrip())
+		if self.__exec_build(env, handle_logs):
+			self._logger.info("Speculative build success")
+			self.__prebuilt_firmware = (env, firmware_upload_time)
+			self.__store_build(env)
+		else:
+			self._logger.warning("Speculative build failed")
+
+	def __compile(self, env, job):
+		if self.__prebuilt_firmware == (env, self._firmware_upload_time):
+			self._logger.info("The firmware was already built in the background, skipping compilation")
+			return True
 		self._flash_status = dict(
 			step_name=gettext("Compiling"),
 			progress=0,
 			finished=False
 		)
 		self._push_flash_status("platformio_flash_status")
-		pio_args = [self._settings.get_platformio_cli_path(), "run", "-d", self._firmware]
-		if env:
-			pio_args.extend(["-e", env])
 		self._logger.info("Compiling...")
 		logs = deque()
 
-		def handle_logs(stream):
-			for line in stream:
-				self._logger.info(line.rstrip())
-				logs.append(line)
-		result = self.__exec(pio_args, handle_logs, handle_logs)
+		def handle_logs(line):
+			self._logger.info(line.rstrip())
+			logs.append(line)
+		result = self.__exec_build(env, handle_logs, job)
 		if not result:
 			self._logger.warning("Compilation failed")
 			self._flash_status = dict(
@@ -200,8 +277,138 @@ class PlatformIOFlasher(BaseFlasher):
 				message=gettext("Compilation failed")
 			)
 			self._push_flash_status("platformio_flash_status")
-			return
+			return False
 		self._logger.info("Compilation success")
+		self.__store_build(env)
+		return True
+
+	def __store_build(self, env):
+		artifacts = self.__find_build_artifacts(env)
+		if not artifacts:
+			return
+		build_root = os.path.join(self._firmware, ".pio", "build")
+		# The checksum keeps PlatformIO from cleaning the restored build directory
+		relative_paths = [os.path.relpath(artifact, build_root).replace(os.sep, "/") for artifact in artifacts]
+		if os.path.isfile(os.path.join(build_root, "project.checksum")):
+			relative_paths.append("project.checksum")
+		self._store_build(env or "", build_root, relative_paths)
+
+	def fleet_flash(self):
+		if self._firmware is None:
+			self._logger.debug("No firmware uploaded")
+			return None, [gettext("You did not upload the firmware or it got reset by the previous flash process.")]
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
+		ports = self._get_requested_ports()
+		errors = self._check_fleet_ports(ports)
+		if errors:
+			return None, errors
+		env = None
+		if "env" in flask.request.values and flask.request.values["env"]:
+			env = flask.request.values["env"]
+		job = self._start_flash_job(self.__background_fleet_flash, (env, ports))
+		return dict(
+			message=gettext("Flash process started."),
+			job=job.get_id()
+		), None
+
+	def artifact_flash(self):
+		if self._is_flash_running():
+			self._logger.debug("A flash process is already running")
+			return None, [gettext("A flash process is already running.")]
+		meta, target, errors = self._get_requested_artifact("platformio")
+		if errors:
+			return None, errors
+		ports = self._get_requested_ports()
+		if ports:
+			errors = self._check_fleet_ports(ports)
+			if errors:
+				return None, errors
+		elif not self._printer.is_ready():
+			self._logger.debug("Printer not ready")
+			return None, [gettext("The printer may not be connected or it may be busy.")]
+		job = self._start_flash_job(self.__background_artifact_flash, (meta, target, ports))
+		return dict(
+			message=gettext("Flash process started."),
+			job=job.get_id()
+		), None
+
+	def __background_artifact_flash(self, meta, target, ports):
+		env = target or None
+		self.__load_artifact(meta, target)
+		if ports:
+			self.__background_fleet_flash(env, ports)
+		else:
+			self.__background_flash(env)
+
+	def __load_artifact(self, meta, target):
+		self._logger.info("Loading stored firmware %s" % meta["id"])
+		result = self.__firmware_ingest.restore(
+			self._artifact_store.get_sources(meta["id"]),
+			os.path.join(self._plugin.get_plugin_data_folder(), "firmware_platformio"),
+			os.path.join(self._plugin.get_plugin_data_folder(), "firmware_platformio.manifest.json"),
+			preserved=[".pio"]
+		)
+		self._logger.debug("Workspace restored : %s" % result)
+		self._firmware = result.project_dir
+		self._firmware_version = meta.get("version")
+		self._firmware_author = meta.get("author")
+		self._firmware_upload_time = datetime.now()
+		self._artifact_id = meta["id"]
+		self.__prebuilt_firmware = None
+		if meta["builds"].get(target, dict()).get("files"):
+			self._artifact_store.checkout_build(meta["id"], target, os.path.join(self._firmware, ".pio", "build"))
+			self.__prebuilt_firmware = (target or None, self._firmware_upload_time)
+		self._push_firmware_info()
+
+	def __background_fleet_flash(self, env, ports):
+		self._logger.info("Starting fleet flashing process...")
+		job = self._flash_job
+		self._enter_flash_phase(FlashPhase.COMPILE)
+		self._wait_speculative_build("platformio_flash_status")
+		if self.__prebuilt_firmware == (env, self._firmware_upload_time) and not self.__find_build_artifacts(env):
+			self._logger.info("The firmware built in the background is missing, compiling it again")
+			self.__prebuilt_firmware = None
+		if not self.__compile(env, job):
+			return
+		# The parallel uploads must not build, they would all write to the same build directory
+		upload_args = self.__get_build_args(env) + ["-t", "nobuild", "-t", "upload"]
+		self._flash_status = dict(
+			step_name=gettext("Uploading"),
+			progress=50,
+			finished=False
+		)
+		self._push_flash_status("platformio_flash_status")
+
+		def upload(port):
+			if job.is_stopped():
+				return False, gettext("The flash process was stopped before this board was flashed."), None
+			logs = deque()
+
+			def handle_logs(line):
+				self._logger.info("[%s] %s" % (port, line.rstrip()))
+				logs.append(line)
+			if self.__exec(upload_args + ["--upload-port", port], handle_logs, timeout=self.UPLOAD_TIMEOUT, job=job):
+				return True, gettext("Board successfully flashed."), None
+			return False, gettext("The upload process failed"), "".join(logs)
+		self._run_fleet_flash(ports, upload, "platformio_flash_status", "platformio_fleet_status", env or "")
+
+	def __background_flash(self, env):
+		self._logger.info("Starting flashing process...")
+		job = self._flash_job
+		self._enter_flash_phase(FlashPhase.COMPILE)
+		self._wait_speculative_build("platformio_flash_status")
+		if not self.__compile(env, job):
+			return
+		self._enter_flash_phase(FlashPhase.UPLOAD)
+		pio_args = self.__get_build_args(env)
+		logs = deque()
+
+		def handle_logs(line):
+			self._logger.info(line.rstrip())
+			logs.append(line)
+		artifacts = self.__find_build_artifacts(env)
 		self._flash_status = dict(
 			step_name=gettext("Uploading"),
 			progress=50,
@@ -220,18 +427,34 @@ class PlatformIOFlasher(BaseFlasher):
 			)
 			self._push_flash_status("platformio_flash_status")
 			return
-		self._run_pre_flash_script()
-		self._wait_pre_flash_delay()
-		_, port, baudrate, profile = self._printer.get_current_connection()
-		self._logger.info("Disconnecting printer...")
-		self._printer.disconnect()
+		self._wait_pre_flash_script()
+		flash_port = transport.port
+		port, baudrate = self._disconnect_printer()
+		try:
+			self._wait_port_release(flash_port, "platformio_flash_status")
+		except FlasherError as e:
+			self._logger.warning(e.message)
+			self._reconnect_printer()
+			self._flash_status = dict(
+				step_name=gettext("Upload failed"),
+				progress=100,
+				finished=True,
+				success=False,
+				message=e.message
+			)
+			self._push_flash_status("platformio_flash_status")
+			return
 		self._logger.info("Uploading to the board...")
+		if artifacts:
+			# The firmware was just built, the upload pass does not need to check the build again
+			pio_args.extend(["-t", "nobuild"])
 		pio_args.extend(["-t", "upload"])
 		logs.clear()
-		result = self.__exec(pio_args, handle_logs, handle_logs)
+		result = self.__exec(pio_args, handle_logs, timeout=self.UPLOAD_TIMEOUT, job=job)
+		self._record_flash(env or "", flash_port, result)
 		if not result:
 			self._logger.warning("The flashing process failed!")
-			self._printer.connect(port, baudrate, profile)
+			self._reconnect_printer()
 			self._flash_status = dict(
 				step_name=gettext("Upload failed"),
 				progress=100,
@@ -243,13 +466,12 @@ class PlatformIOFlasher(BaseFlasher):
 			self._push_flash_status("platformio_flash_status")
 			return
 		self._logger.info("Uploading success")
-		self._wait_post_flash_delay()
-		self._should_run_post_script = True
-		self._printer.connect(port, baudrate, profile)
+		self._reconnect_after_flash(port, baudrate)
 		self._firmware = None
 		self._firmware_version = None
 		self._firmware_author = None
 		self._firmware_upload_time = None
+		self._artifact_id = None
 		self._push_firmware_info()
 		self._flash_status = dict(
 			step_name=gettext("Done"),
@@ -260,36 +482,78 @@ class PlatformIOFlasher(BaseFlasher):
 		)
 		self._push_flash_status("platformio_flash_status")
 
+	def __get_default_environments(self):
+		config = configparser.ConfigParser(interpolation=None, strict=False, inline_comment_prefixes=(";",))
+		try:
+			config.read(os.path.join(self._firmware, "platformio.ini"))
+		except configparser.Error:
+			self._logger.debug("Could not parse platformio.ini")
+			return []
+		default_envs = config.get("platformio", "default_envs", fallback="")
+		return [e.strip() for e in re.split(r"[,\s]+", default_envs) if e.strip()]
+
+	def __find_build_artifacts(self, env):
+		envs = [env] if env else self.__get_default_environments()
+		if not envs:
+			self._logger.debug("Could not determine the built environments")
+			return None
+		artifacts = []
+		for e in envs:
+			build_dir = os.path.join(self._firmware, ".pio", "build", e)
+			env_artifacts = []
+			if os.path.isdir(build_dir):
+				for f in os.listdir(build_dir):
+					path = os.path.join(build_dir, f)
+					if os.path.isfile(path) and os.path.splitext(f)[1].lower() in (".hex", ".bin", ".elf"):
+						env_artifacts.append(path)
+			if not env_artifacts:
+				self._logger.debug("No firmware was found for environment %s" % e)
+				return None
+			artifacts.extend(env_artifacts)
+		for artifact in artifacts:
+			self._logger.debug("Found firmware %s (%d bytes)" % (artifact, os.path.getsize(artifact)))
+		return artifacts
+
 	def __get_available_environments(self):
-		if self._firmware is None:
+		configuration = self._get_configuration()
+		if configuration is None or configuration.get_motherboard() is None:
+			return []
+		self._logger.debug("Found motherboard %s" % configuration.get_motherboard())
+		pins = self.__get_pins()
+		if pins is None:
 			return []
+		envs = pins.get_environments(configuration.get_motherboard())
+		self._logger.debug("Found environments %s" % envs)
+		return envs
+
+	def __get_pins(self):
 		try:
-			self._logger.debug("Trying to open Configuration.h")
-			with open(os.path.join(self._firmware, "Marlin", "Configuration.h")) as configuration_h:
-				configuration_h_content = configuration_h.read()
-				match = re.search(r"^\s*?#define\s+?MOTHERBOARD\s+?(\S*?)\s*?$", configuration_h_content, re.MULTILINE)
-				if not match:
-					return []
-				# Removes the BOARD_ part of the name
-				self._logger.debug("Found motherboard %s" % match.group(1))
-				motherboard = match.group(1)[6:]
-				self._logger.debug("Trying to open pins.h")
-				with open(os.path.join(self._firmware, "Marlin", "src", "pins", "pins.h")) as pins_h:
-					pins_h_content = pins_h.read()
-					match = re.search(r"^\s*?#(el)?if\s+?MB\([^)]*?%s[^)]*?\)\s*?\n.*?(env:.*?)\s*?$" % re.escape(motherboard), pins_h_content, re.MULTILINE)
-					if not match:
-						return []
-					self._logger.debug("Found environments %s" % match.group(2))
-					envs = [env[4:] for env in match.group(2).strip().split(" ") if env.startswith("env:")]
-					return envs
-		except OSError as _:
+			return self.__pins_index.get(os.path.join(self._firmware, "Marlin", "src", "pins", "pins.h"))
+		except OSError:
 			# Files are not where they should, maybe it's not Marlin... No env found, the user will select the default one
-			self._logger.debug("Could not open file")
-			return []
+			self._logger.debug("Could not open pins.h")
+			return None
+
+	def firmware_boards(self):
+		pins = self.__get_pins() if self._firmware is not None else None
+		if pins is None:
+			return None, [gettext("No Marlin board list was found in the uploaded firmware.")]
+		return [dict(board=board, environments=pins.get_environments(board)) for board in pins.get_boards()], None
+
+	def _get_configuration_dir(self):
+		if self._firmware is None:
+			return None
+		return os.path.join(self._firmware, "Marlin")
 
 	def _firmware_info_event_name(self):
 		return "platformio_firmware_info"
 
+	def _download_status_event_name(self):
+		return "platformio_download_status"
+
+	def _flash_status_event_name(self):
+		return "platformio_flash_status"
+
 	def __push_available_environments(self):
 		self._plugin_manager.send_plugin_message(self._identifier, dict(
 			type="platformio_environments",
@@ -319,17 +583,16 @@ class PlatformIOFlasher(BaseFlasher):
 		pio_args = [self._settings.get_platformio_cli_path(), "account", "login", "--username", flask.request.values["username"], "--password", flask.request.values["password"]]
 		logs = []
 
-		def handle_logs(stream):
-			for line in stream:
-				l = line.rstrip()
-				self._logger.debug(l)
-				logs.append(l)
-		success = self.__exec(pio_args, handle_logs, handle_logs, show_in_logs=False)
+		def handle_logs(line):
+			l = line.rstrip()
+			self._logger.debug(l)
+			logs.append(l)
+		success = self.__exec(pio_args, handle_logs, show_in_logs=False)
 		if not success:
 			self._logger.debug("Connection failed !")
 			return None, logs
 		self._logger.info("Successfully signed in to the PlatformIO account")
-		self.__push_login_status()
+		self.__account_status.invalidate()
 		return logs, None
 
 	def logout(self):
@@ -337,42 +600,49 @@ class PlatformIOFlasher(BaseFlasher):
 		pio_args = [self._settings.get_platformio_cli_path(), "account", "logout"]
 		logs = []
 
-		def handle_logs(stream):
-			for line in stream:
-				l = line.rstrip()
-				self._logger.debug(l)
-				logs.append(l)
-		success = self.__exec(pio_args, handle_logs, handle_logs)
+		def handle_logs(line):
+			l = line.rstrip()
+			self._logger.debug(l)
+			logs.append(l)
+		success = self.__exec(pio_args, handle_logs)
 		if not success:
 			self._logger.debug("Logout failed !")
 			return None, logs
 		self._logger.info("Successfully logged out")
-		self.__push_login_status()
+		self.__account_status.invalidate()
 		return logs, None
 
 	def __push_login_status(self):
+		loaded, account = self.__account_status.get()
+		if loaded:
+			self.__send_login_status(account)
+
+	def __fetch_account(self):
+		if self.check_setup_errors():
+			return None
 		self._logger.debug("Checking login status...")
 		pio_args = [self._settings.get_platformio_cli_path(), "account", "show", "--json-output"]
 		logs = deque()
 
-		def handle_logs(stream):
-			for line in stream:
-				logs.append(line.rstrip())
-		success = self.__exec(pio_args, handle_logs, handle_logs)
+		def handle_logs(line):
+			logs.append(line.rstrip())
+		success = self.__exec(pio_args, handle_logs)
 		if not success:
-			message = dict(
-				type="platformio_login_status",
-				account=None
-			)
 			self._logger.debug("Could not get account information, we are not logged in")
-		else:
-			self._logger.debug("Got valid answer, we are logged in")
+			return None
+		try:
 			account = json.loads("".join(logs))
-			message =  dict(
-				type="platformio_login_status",
-				account=account
-			)
-		self._plugin_manager.send_plugin_message(self._identifier, message)
+		except ValueError:
+			self._logger.debug("Could not parse the account information")
+			return None
+		self._logger.debug("Got valid answer, we are logged in")
+		return account
+
+	def __send_login_status(self, account):
+		self._plugin_manager.send_plugin_message(self._identifier, dict(
+			type="platformio_login_status",
+			account=account
+		))
 
 	def __push_remote_agent_status(self):
 		self._plugin_manager.send_plugin_message(self._identifier, dict(
@@ -390,12 +660,9 @@ class PlatformIOFlasher(BaseFlasher):
 		if not self._printer.is_ready():
 			self._logger.debug("Printer not ready")
 			return None, [gettext("The printer may not be connected or it may be busy.")]
-		try:
-			if self.__remote_agent.start():
-				return [gettext("The remote agent is now starting")], None
-			return None, [gettext("The remote agent was already running.")]
-		except OSError:
-			return None, [gettext("The PlatformIO executable cannot be found, check your configuration")]
+		if self.__remote_agent.start():
+			return [gettext("The remote agent is now starting")], None
+		return None, [gettext("The remote agent was already running.")]
 
 	def stop_remote_agent(self):
 		if self.__remote_agent.stop():
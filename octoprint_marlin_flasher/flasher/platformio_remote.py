@@ -1,7 +1,3 @@
-from subprocess import Popen, PIPE
-from threading import Thread
-
-
 class RemoteAgentStatus:
 
 	STARTING = "starting"
@@ -16,16 +12,15 @@ class RemoteAgentStatus:
 
 class PlatformIoRemoteAgent:
 
-	def __init__(self, configuration, logger, printer):
+	def __init__(self, configuration, logger, printer, process_runner):
 		self.__status_observers = []
 		self.__log_observers = []
 		self.__status = RemoteAgentStatus.STOPPED
 		self.__process = None
 		self.__config = configuration
 		self.__logger = logger
-		self.__stdout_thread = None
-		self.__stderr_thread = None
 		self.__printer = printer
+		self.__process_runner = process_runner
 
 	def add_status_observer(self, callback):
 		self.__status_observers.append(callback)
@@ -51,13 +46,8 @@ class PlatformIoRemoteAgent:
 			self.__notify_status_change()
 			command = [self.__config.get_platformio_cli_path(), "remote", "agent", "start"]
 			self.__logger.debug("Running %s" % " ".join(command))
-			p = Popen(command, stdout=PIPE, stderr=PIPE, universal_newlines=True)
-			self.__process = p
-			self.__stdout_thread = Thread(target=self.__handle_log, args=(p.stdout,), daemon=True)
-			self.__stderr_thread = Thread(target=self.__handle_log, args=(p.stderr,), daemon=True)
-			self.__stdout_thread.start()
-			self.__stderr_thread.start()
-			Thread(target=self.__process_handler, daemon=True).start()
+			self.__process = self.__process_runner.start(command, self.__handle_log, limited=False)
+			self.__process.add_done_callback(self.__handle_exit)
 			return True
 		else:
 			self.__logger.debug("There's another process already running, not starting a new agent")
@@ -67,35 +57,30 @@ class PlatformIoRemoteAgent:
 		if self.__process is not None:
 			self.__status = RemoteAgentStatus.STOPPING
 			self.__notify_status_change()
-			self.__process.terminate()
+			self.__process.cancel()
 			return True
 		else:
 			self.__logger.debug("There's no process running, not stopping the agent as it's not started")
 			return False
 
-	def __handle_log(self, stream):
-		for line in stream:
-			line = line.rstrip()
-			self.__notify_log(line)
-			self.__logger.debug(line)
-			if self.__status == RemoteAgentStatus.STARTING and "successfully authorized" in line.lower():
-				self.__status = RemoteAgentStatus.RUNNING
-				self.__notify_status_change()
-			elif self.__status == RemoteAgentStatus.RUNNING and "remote command received : run" in line.lower():
-				self.__status = RemoteAgentStatus.FLASHING
-				self.__notify_status_change()
-				# TODO disconnect printer
-			elif self.__status == RemoteAgentStatus.FLASHING and "somestring" in line.lower():
-				self.__status = RemoteAgentStatus.RUNNING
-				self.__notify_status_change()
-				# TODO reconnect printer
+	def __handle_log(self, line):
+		line = line.rstrip()
+		self.__notify_log(line)
+		self.__logger.debug(line)
+		if self.__status == RemoteAgentStatus.STARTING and "successfully authorized" in line.lower():
+			self.__status = RemoteAgentStatus.RUNNING
+			self.__notify_status_change()
+		elif self.__status == RemoteAgentStatus.RUNNING and "remote command received : run" in line.lower():
+			self.__status = RemoteAgentStatus.FLASHING
+			self.__notify_status_change()
+			# TODO disconnect printer
+		elif self.__status == RemoteAgentStatus.FLASHING and "somestring" in line.lower():
+			self.__status = RemoteAgentStatus.RUNNING
+			self.__notify_status_change()
+			# TODO reconnect printer
 
-	def __process_handler(self):
-		self.__logger.debug("Waiting for the agent to stop...")
-		self.__stdout_thread.join()
-		self.__stderr_thread.join()
-		self.__process.wait()
-		self.__logger.debug("Process exited with status : %d" % self.__process.returncode)
+	def __handle_exit(self, result):
+		self.__logger.debug("Process exited with status : %s" % result.returncode)
 		self.__process = None
 		self.__status = RemoteAgentStatus.STOPPED
 		self.__notify_status_change()
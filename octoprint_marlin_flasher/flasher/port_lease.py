@@ -0,0 +1,107 @@
+import os
+import time
+import serial
+from .flasher_error import FlasherError
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+
+class PortLease:
+
+	INITIAL_RETRY_DELAY = 0.05
+	MAX_RETRY_DELAY = 1
+
+	def __init__(self, logger):
+		self.__logger = logger
+
+	def wait(self, port, timeout):
+		start = time.time()
+		deadline = start + timeout
+		delay = self.INITIAL_RETRY_DELAY
+		attempt = 0
+		descriptor = None
+		try:
+			while True:
+				attempt += 1
+				reason = self.__get_holder_reason(port, descriptor)
+				if reason is None and fcntl is not None:
+					# Every open of a tty pulses DTR and resets the board, the port is opened once and only its lock is polled
+					if descriptor is None:
+						descriptor, reason = self.__open(port)
+					if descriptor is not None:
+						reason = self.__get_lock_reason(descriptor)
+				elif reason is None:
+					reason = self.__get_open_reason(port)
+				if reason is None:
+					elapsed = time.time() - start
+					self.__logger.debug("%s is free after %d attempt(s)" % (port, attempt))
+					return elapsed
+				now = time.time()
+				if now >= deadline:
+					raise FlasherError("%s was not released after %ss, %s" % (port, timeout, reason))
+				self.__logger.debug("%s is still busy (%s), retrying in %.2fs" % (port, reason, delay))
+				time.sleep(min(delay, deadline - now))
+				delay = min(delay * 2, self.MAX_RETRY_DELAY)
+		finally:
+			if descriptor is not None:
+				os.close(descriptor)
+
+	def __get_holder_reason(self, port, descriptor):
+		path = os.path.realpath(port) if os.path.isabs(port) else None
+		if path is not None:
+			if not os.path.exists(path):
+				return "the device does not exist"
+			pid = self.__find_holder(path, descriptor)
+			if pid is not None:
+				return "it is open by process %s" % pid
+		return None
+
+	@staticmethod
+	def __find_holder(path, descriptor):
+		if not os.path.isdir("/proc"):
+			return None
+		own_fd = (str(os.getpid()), str(descriptor))
+		for pid in os.listdir("/proc"):
+			if not pid.isdigit():
+				continue
+			fd_dir = os.path.join("/proc", pid, "fd")
+			try:
+				fds = os.listdir(fd_dir)
+			except OSError:
+				continue
+			for fd in fds:
+				if (pid, fd) == own_fd:
+					continue
+				try:
+					if os.readlink(os.path.join(fd_dir, fd)) == path:
+						return pid
+				except OSError:
+					continue
+		return None
+
+	@staticmethod
+	def __open(port):
+		try:
+			return os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK), None
+		except OSError as e:
+			return None, "it cannot be opened : %s" % e
+
+	@staticmethod
+	def __get_lock_reason(descriptor):
+		try:
+			fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			fcntl.flock(descriptor, fcntl.LOCK_UN)
+		except OSError as e:
+			return "it is locked : %s" % e
+		return None
+
+	@staticmethod
+	def __get_open_reason(port):
+		# There is no flock outside of POSIX systems, opening the port fails there while it is in use
+		try:
+			serial.Serial(port).close()
+		except (OSError, serial.SerialException) as e:
+			return "it cannot be opened exclusively : %s" % e
+		return None
@@ -0,0 +1,37 @@
+import uuid
+from threading import Event, Lock
+
+
+class PreFlashSync:
+
+	SYNC_COMMAND = "M400"
+	ECHO_COMMAND = "M118 %s"
+
+	def __init__(self, logger):
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__token = None
+		self.__done = Event()
+
+	def start(self):
+		with self.__lock:
+			self.__token = "MARLIN_FLASHER_SYNC_%s" % uuid.uuid4().hex.upper()
+			self.__done.clear()
+			# The firmware only runs the echo once M400 returns, so seeing the token means everything queued before it completed
+			return [self.SYNC_COMMAND, self.ECHO_COMMAND % self.__token]
+
+	def handle_received(self, line):
+		token = self.__token
+		if token is None or token not in line:
+			return
+		with self.__lock:
+			if self.__token == token:
+				self.__logger.debug("Pre-flash sync point echoed by the firmware")
+				self.__token = None
+				self.__done.set()
+
+	def wait(self, timeout):
+		done = self.__done.wait(timeout)
+		with self.__lock:
+			self.__token = None
+		return done
@@ -0,0 +1,180 @@
+import asyncio
+import concurrent.futures
+import os
+import signal
+import sys
+from collections import deque
+from threading import Lock, Thread
+
+
+class ProcessResult:
+
+	def __init__(self, returncode, output, timed_out=False, cancelled=False):
+		self.returncode = returncode
+		self.output = output
+		self.timed_out = timed_out
+		self.cancelled = cancelled
+
+	@property
+	def success(self):
+		return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+
+class ProcessHandle:
+
+	def __init__(self, loop):
+		self.__loop = loop
+		self.__future = None
+		self.__task = None
+		self.__cancelled = False
+		self.pid = None
+
+	def _attach(self, future):
+		self.__future = future
+
+	def _set_task(self, task):
+		self.__task = task
+
+	def is_cancelled(self):
+		return self.__cancelled
+
+	def cancel(self):
+		if self.__cancelled:
+			return
+		self.__cancelled = True
+		self.__loop.call_soon_threadsafe(self.__cancel_task)
+
+	def __cancel_task(self):
+		if self.__task is not None:
+			self.__task.cancel()
+
+	def done(self):
+		return self.__future.done()
+
+	def wait(self, timeout=None):
+		try:
+			return self.__future.result(timeout)
+		except concurrent.futures.TimeoutError:
+			return None
+
+	def add_done_callback(self, callback):
+		self.__future.add_done_callback(lambda future: callback(future.result()))
+
+
+class ProcessRunner:
+
+	MAX_PROCESSES = 8
+	MAX_OUTPUT_LINES = 1000
+	MAX_LINE_LENGTH = 1024 * 1024
+	KILL_GRACE_PERIOD = 5
+
+	def __init__(self, logger):
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__loop = None
+		self.__semaphore = None
+
+	def run(self, command, line_handler=None, env=None, cwd=None, timeout=None, on_start=None):
+		return self.start(command, line_handler, env, cwd, timeout, on_start).wait()
+
+	def start(self, command, line_handler=None, env=None, cwd=None, timeout=None, on_start=None, limited=True, error_handler=None):
+		loop = self.__get_loop()
+		handle = ProcessHandle(loop)
+		handle._attach(asyncio.run_coroutine_threadsafe(self.__run(handle, command, line_handler, env, cwd, timeout, on_start, limited, error_handler), loop))
+		return handle
+
+	def __get_loop(self):
+		with self.__lock:
+			if self.__loop is None:
+				self.__loop = asyncio.new_event_loop()
+				Thread(target=self.__loop.run_forever, name="MarlinFlasherProcessRunner", daemon=True).start()
+			return self.__loop
+
+	async def __run(self, handle, command, line_handler, env, cwd, timeout, on_start, limited, error_handler):
+		handle._set_task(asyncio.current_task())
+		output = deque(maxlen=self.MAX_OUTPUT_LINES)
+		process = None
+		try:
+			if self.__semaphore is None:
+				self.__semaphore = asyncio.Semaphore(self.MAX_PROCESSES)
+			if limited:
+				await self.__semaphore.acquire()
+			try:
+				if handle.is_cancelled():
+					return ProcessResult(None, list(output), cancelled=True)
+				process = await asyncio.create_subprocess_exec(
+					*command,
+					stdout=asyncio.subprocess.PIPE,
+					stderr=asyncio.subprocess.PIPE,
+					env=env,
+					cwd=cwd,
+					limit=self.MAX_LINE_LENGTH,
+					# A new session lets the whole process tree be killed, toolchains spawn many children
+					start_new_session=sys.platform != "win32"
+				)
+				handle.pid = process.pid
+				if on_start is not None:
+					on_start(process.pid)
+				try:
+					await asyncio.wait_for(asyncio.gather(
+						self.__read(process.stdout, output, line_handler),
+						# Tools writing data on stdout and diagnostics on stderr need them apart
+						self.__read(process.stderr, output, error_handler or line_handler),
+						process.wait()
+					), timeout)
+				except asyncio.TimeoutError:
+					self.__logger.warning("%s did not complete within %ss, killing it" % (command[0], timeout))
+					await self.__kill(process)
+					return ProcessResult(process.returncode, list(output), timed_out=True)
+				return ProcessResult(process.returncode, list(output))
+			finally:
+				if limited:
+					self.__semaphore.release()
+		except asyncio.CancelledError:
+			if process is not None:
+				self.__logger.debug("Cancelling %s" % command[0])
+				await self.__kill(process)
+			return ProcessResult(process.returncode if process is not None else None, list(output), cancelled=True)
+		except OSError as e:
+			self.__logger.warning("Unable to run %s : %s" % (command[0], e))
+			output.append(str(e))
+			if line_handler is not None:
+				line_handler(str(e))
+			return ProcessResult(None, list(output))
+
+	async def __read(self, stream, output, line_handler):
+		while True:
+			try:
+				line = await stream.readline()
+			except ValueError:
+				# The line is longer than the stream limit, what was buffered is dropped
+				continue
+			if not line:
+				return
+			line = line.decode("utf-8", errors="replace")
+			output.append(line)
+			if line_handler is not None:
+				try:
+					line_handler(line)
+				except Exception:
+					self.__logger.exception("Error while handling the output of a process")
+
+	async def __kill(self, process):
+		if process.returncode is not None:
+			return
+		self.__send_signal(process, signal.SIGTERM)
+		try:
+			await asyncio.wait_for(process.wait(), self.KILL_GRACE_PERIOD)
+		except asyncio.TimeoutError:
+			self.__send_signal(process, signal.SIGKILL if hasattr(signal, "SIGKILL") else signal.SIGTERM)
+			await process.wait()
+
+	@staticmethod
+	def __send_signal(process, sig):
+		try:
+			if hasattr(os, "killpg"):
+				os.killpg(process.pid, sig)
+			else:
+				process.send_signal(sig)
+		except OSError:
+			pass
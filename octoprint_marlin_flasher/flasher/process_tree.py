@@ -0,0 +1,59 @@
+import os
+
+
+class ProcessTree:
+
+	@staticmethod
+	def get_process_descendants(pid):
+		if os.path.exists("/proc/%d/task/%d/children" % (os.getpid(), os.getpid())):
+			get_children = ProcessTree.__read_process_children
+		else:
+			children_by_parent = ProcessTree.__get_children_by_parent()
+
+			def get_children(parent):
+				return list(children_by_parent.get(parent, []))
+		return ProcessTree.__collect_descendants(get_children(pid), get_children)
+
+	@staticmethod
+	def __collect_descendants(pending, get_children):
+		descendants = []
+		while pending:
+			pid = pending.pop()
+			descendants.append(pid)
+			pending.extend(get_children(pid))
+		return descendants
+
+	@staticmethod
+	def __read_process_children(pid):
+		children = []
+		try:
+			for task in os.listdir("/proc/%d/task" % pid):
+				children.extend(ProcessTree.__read_children("/proc/%d/task/%s/children" % (pid, task)))
+		except OSError:
+			pass
+		return children
+
+	@staticmethod
+	def __read_children(path):
+		try:
+			with open(path) as children:
+				return [int(pid) for pid in children.read().split()]
+		except OSError:
+			return []
+
+	@staticmethod
+	def __get_children_by_parent():
+		children_by_parent = dict()
+		try:
+			pids = [int(pid) for pid in os.listdir("/proc") if pid.isdigit()]
+		except OSError:
+			return children_by_parent
+		for pid in pids:
+			try:
+				with open("/proc/%d/stat" % pid) as stat:
+					# The name may contain spaces and parentheses, the fields after it are "state ppid ..."
+					ppid = int(stat.read().rpartition(")")[2].split()[1])
+			except (OSError, ValueError, IndexError):
+				continue
+			children_by_parent.setdefault(ppid, []).append(pid)
+		return children_by_parent
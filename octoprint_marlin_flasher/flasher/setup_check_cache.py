@@ -0,0 +1,36 @@
+import os
+import shutil
+from threading import Lock
+
+
+class SetupCheckCache:
+
+	def __init__(self, logger):
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__key = None
+
+	def get(self, path, check):
+		key = self.__get_key(path)
+		with self.__lock:
+			if key is not None and key == self.__key:
+				self.__logger.debug("%s did not change since it was last checked" % path)
+				return []
+		errors = check()
+		# Only a valid setup is remembered, errors may be transient and the user expects a fixed setup to be picked up
+		with self.__lock:
+			self.__key = key if not errors else None
+		return errors
+
+	@staticmethod
+	def __get_key(path):
+		if not path:
+			return None
+		resolved = path if os.path.dirname(path) else shutil.which(path)
+		if resolved is None:
+			return None
+		try:
+			stat = os.stat(resolved)
+		except OSError:
+			return None
+		return path, os.path.realpath(resolved), stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,328 @@
+import hashlib
+import time
+import serial
+from .flasher_error import FlasherError
+
+
+class Stk500Programmer:
+
+	RESET_DELAY = 0.25
+	SYNC_ATTEMPTS = 10
+	SYNC_TIMEOUT = 0.2
+	TIMEOUT = 1
+	DIFFERENTIAL = True
+
+	# signature : (name, flash size, page size)
+	DEVICES = {
+		b"\x1e\x93\x07": ("ATmega8", 8192, 64),
+		b"\x1e\x94\x06": ("ATmega168", 16384, 128),
+		b"\x1e\x94\x0b": ("ATmega168P", 16384, 128),
+		b"\x1e\x95\x14": ("ATmega328", 32768, 128),
+		b"\x1e\x95\x0f": ("ATmega328P", 32768, 128),
+		b"\x1e\x96\x09": ("ATmega644", 65536, 256),
+		b"\x1e\x96\x0a": ("ATmega644P", 65536, 256),
+		b"\x1e\x97\x03": ("ATmega1280", 131072, 256),
+		b"\x1e\x97\x05": ("ATmega1284P", 131072, 256),
+		b"\x1e\x97\x06": ("ATmega1284", 131072, 256),
+		b"\x1e\x98\x01": ("ATmega2560", 262144, 256)
+	}
+
+	def __init__(self, port, baudrate, logger):
+		self._port = port
+		self._baudrate = baudrate
+		self._logger = logger
+		self._serial = None
+
+	@staticmethod
+	def create(protocol, port, baudrate, logger):
+		if protocol == "arduino":
+			return Stk500v1Programmer(port, baudrate, logger)
+		if protocol in ("wiring", "stk500v2"):
+			return Stk500v2Programmer(port, baudrate, logger)
+		return None
+
+	def program(self, image, progress_observer=None, flashed_pages=None):
+		self._serial = serial.Serial(self._port, self._baudrate, timeout=self.TIMEOUT, write_timeout=self.TIMEOUT)
+		try:
+			self.__reset()
+			self.__sync()
+			signature = self._read_signature()
+			if signature not in self.DEVICES:
+				raise FlasherError("Unsupported device signature %s" % signature.hex())
+			name, flash_size, page_size = self.DEVICES[signature]
+			self._logger.debug("Found %s, %d bytes pages" % (name, page_size))
+			if image.get_end() > flash_size:
+				raise FlasherError("The firmware does not fit in the %s flash memory" % name)
+			pages = dict()
+			for address in self._get_pages(image, page_size):
+				pages[address] = image.get_bytes(address, address + page_size)
+			digests = dict([("%x" % address, hashlib.sha1(data).hexdigest()) for address, data in pages.items()])
+			known_digests = None
+			if self.DIFFERENTIAL and flashed_pages is not None and flashed_pages.get("signature") == signature.hex() and flashed_pages.get("page_size") == page_size:
+				known_digests = flashed_pages.get("pages", dict())
+			changed = [address for address in pages if known_digests is None or known_digests.get("%x" % address) != digests["%x" % address]]
+			progress = Stk500Progress(len(changed) + len(pages), progress_observer)
+			self._enter_programming_mode()
+			self.__write_pages(pages, changed, progress)
+			mismatch = self.__verify_pages(pages, progress)
+			if mismatch is not None and known_digests is not None:
+				# The board was changed since the recorded flash, nothing on it can be trusted
+				self._logger.info("The board content differs from the last recorded flash, writing the whole firmware")
+				progress.extend(2 * len(pages))
+				self.__write_pages(pages, list(pages), progress)
+				mismatch = self.__verify_pages(pages, progress)
+			if mismatch is not None:
+				raise FlasherError("Verification failed at address 0x%05x" % mismatch)
+			self._leave_programming_mode()
+			return dict(
+				signature=signature.hex(),
+				page_size=page_size,
+				pages=digests
+			)
+		except serial.SerialException as e:
+			raise FlasherError("Serial communication error : %s" % e)
+		finally:
+			self._serial.close()
+			self._serial = None
+
+	def __write_pages(self, pages, addresses, progress):
+		start = time.time()
+		for address in sorted(addresses):
+			self._write_page(address, pages[address])
+			progress.advance()
+		self._logger.debug("%d of %d pages written in %.2fs" % (len(addresses), len(pages), time.time() - start))
+
+	def __verify_pages(self, pages, progress):
+		self._start_read()
+		for address in sorted(pages):
+			if self._read_page(address, len(pages[address])) != pages[address]:
+				return address
+			progress.advance()
+		self._logger.debug("%d pages verified" % len(pages))
+		return None
+
+	def __reset(self):
+		# The auto-reset circuit of Arduino boards pulses the reset line when DTR falls
+		try:
+			self._serial.dtr = False
+			self._serial.rts = False
+			time.sleep(self.RESET_DELAY)
+			self._serial.dtr = True
+			self._serial.rts = True
+		except (OSError, serial.SerialException):
+			self._logger.debug("Unable to toggle DTR/RTS on %s, expecting the bootloader to be running" % self._port)
+		time.sleep(0.05)
+		self._serial.reset_input_buffer()
+
+	def __sync(self):
+		timeout = self._serial.timeout
+		self._serial.timeout = self.SYNC_TIMEOUT
+		try:
+			for attempt in range(self.SYNC_ATTEMPTS):
+				if self._sync():
+					self._logger.debug("In sync with the bootloader after %d attempt(s)" % (attempt + 1))
+					self._serial.reset_input_buffer()
+					return
+				self._serial.reset_input_buffer()
+		finally:
+			self._serial.timeout = timeout
+		raise FlasherError("The bootloader does not answer on %s" % self._port)
+
+	@staticmethod
+	def _get_pages(image, page_size):
+		pages = set()
+		for address, data in image.get_segments():
+			pages.update(range(address - address % page_size, address + len(data), page_size))
+		return sorted(pages)
+
+	def _read(self, size):
+		data = self._serial.read(size)
+		if len(data) != size:
+			raise FlasherError("Timeout while waiting for the bootloader")
+		return data
+
+	def _sync(self):
+		raise FlasherError("Undefined function call")
+
+	def _read_signature(self):
+		raise FlasherError("Undefined function call")
+
+	def _enter_programming_mode(self):
+		raise FlasherError("Undefined function call")
+
+	def _write_page(self, address, data):
+		raise FlasherError("Undefined function call")
+
+	def _start_read(self):
+		raise FlasherError("Undefined function call")
+
+	def _read_page(self, address, size):
+		raise FlasherError("Undefined function call")
+
+	def _leave_programming_mode(self):
+		raise FlasherError("Undefined function call")
+
+
+class Stk500Progress:
+
+	def __init__(self, total, observer):
+		self.__done = 0
+		self.__total = total
+		self.__observer = observer
+
+	def extend(self, count):
+		self.__total += count
+
+	def advance(self):
+		self.__done += 1
+		if self.__observer is not None:
+			self.__observer(self.__done, self.__total)
+
+
+class Stk500v1Programmer(Stk500Programmer):
+
+	STK_OK = 0x10
+	STK_INSYNC = 0x14
+	CRC_EOP = 0x20
+	STK_GET_SYNC = 0x30
+	STK_ENTER_PROGMODE = 0x50
+	STK_LEAVE_PROGMODE = 0x51
+	STK_LOAD_ADDRESS = 0x55
+	STK_PROG_PAGE = 0x64
+	STK_READ_PAGE = 0x74
+	STK_READ_SIGN = 0x75
+
+	def _sync(self):
+		self._serial.write(bytes([self.STK_GET_SYNC, self.CRC_EOP]))
+		return self._serial.read(2) == bytes([self.STK_INSYNC, self.STK_OK])
+
+	def _read_signature(self):
+		self._serial.write(bytes([self.STK_READ_SIGN, self.CRC_EOP]))
+		return self.__read_answer(3)
+
+	def _enter_programming_mode(self):
+		self.__command(bytes([self.STK_ENTER_PROGMODE, self.CRC_EOP]))
+
+	def _write_page(self, address, data):
+		# Both commands are sent at once, the bootloader is only busy once the whole page is received
+		self._serial.write(self.__load_address(address) + bytes([self.STK_PROG_PAGE, len(data) >> 8, len(data) & 0xFF, ord("F")]) + data + bytes([self.CRC_EOP]))
+		self.__read_answer(0)
+		self.__read_answer(0)
+
+	def _start_read(self):
+		pass
+
+	def _read_page(self, address, size):
+		self._serial.write(self.__load_address(address) + bytes([self.STK_READ_PAGE, size >> 8, size & 0xFF, ord("F"), self.CRC_EOP]))
+		self.__read_answer(0)
+		return self.__read_answer(size)
+
+	def _leave_programming_mode(self):
+		self.__command(bytes([self.STK_LEAVE_PROGMODE, self.CRC_EOP]))
+
+	def __load_address(self, address):
+		word_address = address >> 1
+		if word_address > 0xFFFF:
+			raise FlasherError("Address 0x%05x is out of reach of the stk500v1 protocol" % address)
+		return bytes([self.STK_LOAD_ADDRESS, word_address & 0xFF, word_address >> 8, self.CRC_EOP])
+
+	def __command(self, command):
+		self._serial.write(command)
+		self.__read_answer(0)
+
+	def __read_answer(self, size):
+		answer = self._read(size + 2)
+		if answer[0] != self.STK_INSYNC or answer[-1] != self.STK_OK:
+			raise FlasherError("The bootloader is out of sync")
+		return answer[1:-1]
+
+
+class Stk500v2Programmer(Stk500Programmer):
+
+	MESSAGE_START = 0x1B
+	TOKEN = 0x0E
+	STATUS_CMD_OK = 0x00
+	CMD_SIGN_ON = 0x01
+	CMD_LOAD_ADDRESS = 0x06
+	CMD_ENTER_PROGMODE_ISP = 0x10
+	CMD_LEAVE_PROGMODE_ISP = 0x11
+	CMD_PROGRAM_FLASH_ISP = 0x13
+	CMD_READ_FLASH_ISP = 0x14
+	CMD_READ_SIGNATURE_ISP = 0x1B
+
+	# The wiring bootloader erases the pages in order on each write, whatever the loaded address
+	DIFFERENTIAL = False
+
+	def __init__(self, port, baudrate, logger):
+		Stk500Programmer.__init__(self, port, baudrate, logger)
+		self.__sequence = 0
+		self.__next_address = None
+
+	def _sync(self):
+		try:
+			answer = self.__command(bytes([self.CMD_SIGN_ON]))
+		except FlasherError:
+			return False
+		self._logger.debug("Bootloader signed on as %s" % answer[1:].decode("ascii", errors="replace"))
+		return True
+
+	def _read_signature(self):
+		signature = b""
+		for index in range(3):
+			signature += self.__command(bytes([self.CMD_READ_SIGNATURE_ISP, 0x00, 0x30, 0x00, index, 0x00]))[0:1]
+		return signature
+
+	def _enter_programming_mode(self):
+		self.__command(bytes([self.CMD_ENTER_PROGMODE_ISP, 0xC8, 0x64, 0x19, 0x20, 0x00, 0x53, 0x03, 0xAC, 0x53, 0x00, 0x00]))
+
+	@staticmethod
+	def _get_pages(image, page_size):
+		# Every page up to the end of the firmware is written, like avrdude does, gaps are filled with 0xFF
+		return list(range(0, image.get_end(), page_size))
+
+	def _write_page(self, address, data):
+		# The bootloader moves to the next page by itself, the address is only sent when there is a gap
+		self.__load_address(address)
+		self.__command(bytes([self.CMD_PROGRAM_FLASH_ISP, len(data) >> 8, len(data) & 0xFF, 0xC1, 0x0A, 0x40, 0x4C, 0x20, 0x00, 0x00]) + data)
+		self.__next_address = address + len(data)
+
+	def _start_read(self):
+		self.__next_address = None
+
+	def _read_page(self, address, size):
+		self.__load_address(address)
+		answer = self.__command(bytes([self.CMD_READ_FLASH_ISP, size >> 8, size & 0xFF, 0x20]))
+		self.__next_address = address + size
+		return answer[:-1]
+
+	def _leave_programming_mode(self):
+		self.__command(bytes([self.CMD_LEAVE_PROGMODE_ISP, 0x01, 0x01]))
+
+	def __load_address(self, address):
+		if address == self.__next_address:
+			return
+		word_address = address >> 1
+		if word_address > 0xFFFF:
+			word_address |= 0x80000000
+		self.__command(bytes([self.CMD_LOAD_ADDRESS]) + word_address.to_bytes(4, "big"))
+
+	def __command(self, body):
+		self.__sequence = (self.__sequence + 1) & 0xFF
+		message = bytes([self.MESSAGE_START, self.__sequence, len(body) >> 8, len(body) & 0xFF, self.TOKEN]) + body
+		self._serial.write(message + bytes([self.__checksum(message)]))
+		header = self._read(5)
+		if header[0] != self.MESSAGE_START or header[1] != self.__sequence or header[4] != self.TOKEN:
+			raise FlasherError("Unexpected answer from the bootloader")
+		answer = self._read(((header[2] << 8) | header[3]) + 1)
+		if self.__checksum(header + answer[:-1]) != answer[-1]:
+			raise FlasherError("Wrong checksum in the bootloader answer")
+		if len(answer) < 3 or answer[0] != body[0] or answer[1] != self.STATUS_CMD_OK:
+			raise FlasherError("The bootloader rejected command 0x%02x" % body[0])
+		return answer[2:-1]
+
+	@staticmethod
+	def __checksum(data):
+		checksum = 0
+		for byte in data:
+			checksum ^= byte
+		return checksum
@@ -0,0 +1,63 @@
+import time
+from threading import Lock, Thread
+
+
+class TtlCache:
+
+	def __init__(self, ttl, fetch, observer, logger):
+		self.__ttl = ttl
+		self.__fetch = fetch
+		self.__observer = observer
+		self.__logger = logger
+		self.__lock = Lock()
+		self.__value = None
+		self.__loaded = False
+		self.__expiry = 0
+		self.__generation = 0
+		self.__refreshing = False
+
+	def get(self):
+		with self.__lock:
+			loaded = self.__loaded
+			value = self.__value
+			expired = time.monotonic() >= self.__expiry
+		if expired:
+			self.refresh()
+		return loaded, value
+
+	def invalidate(self):
+		with self.__lock:
+			self.__generation += 1
+			self.__loaded = False
+			self.__value = None
+			self.__expiry = 0
+		self.refresh()
+
+	def refresh(self):
+		with self.__lock:
+			if self.__refreshing:
+				return
+			self.__refreshing = True
+		Thread(target=self.__refresh, daemon=True).start()
+
+	def __refresh(self):
+		while True:
+			with self.__lock:
+				generation = self.__generation
+			try:
+				value = self.__fetch()
+			except Exception:
+				self.__logger.exception("Could not refresh the cached value")
+				with self.__lock:
+					self.__refreshing = False
+				return
+			with self.__lock:
+				# Invalidated while fetching, the value may predate the change
+				if generation != self.__generation:
+					continue
+				self.__value = value
+				self.__loaded = True
+				self.__expiry = time.monotonic() + self.__ttl
+				self.__refreshing = False
+			break
+		self.__observer(value)
@@ -24,6 +24,15 @@ class SettingsWrapper:
 	def get_arduino_sketch_ino(self):
 		return self.__settings.get(["arduino", "sketch_ino"])
 
+	def get_arduino_build_cache_size(self):
+		return self.__settings.get_int(["arduino", "build_cache_size"])
+
+	def get_arduino_native_upload(self):
+		return self.__settings.get_boolean(["arduino", "native_upload"])
+
+	def get_arduino_differential_upload(self):
+		return self.__settings.get_boolean(["arduino", "differential_upload"])
+
 	def get_platformio_cli_path(self):
 		return self.__settings.get(["platformio", "cli_path"])
 
@@ -39,6 +48,36 @@ class SettingsWrapper:
 	def get_post_flash_delay(self):
 		return self.__settings.get(["post_flash_delay"])
 
+	def get_speculative_build(self):
+		return self.__settings.get_boolean(["speculative_build"])
+
+	def get_object_cache_size(self):
+		return self.__settings.get_int(["object_cache_size"])
+
+	def get_artifact_store_size(self):
+		return self.__settings.get_int(["artifact_store_size"])
+
+	def get_build_scheduler_enabled(self):
+		return self.__settings.get_boolean(["build_scheduler", "enabled"])
+
+	def get_build_profile(self, name):
+		return self.__settings.get(["build_scheduler", name], merged=True)
+
+	def get_port_release_timeout(self):
+		return self.__settings.get_int(["port_release_timeout"])
+
+	def get_flash_budget(self, phase):
+		return self.__settings.get_int(["flash_budgets", phase])
+
+	def get_fleet_max_workers(self):
+		return self.__settings.get_int(["fleet_max_workers"])
+
+	def get_download_connect_timeout(self):
+		return self.__settings.get_int(["download", "connect_timeout"])
+
+	def get_download_read_timeout(self):
+		return self.__settings.get_int(["download", "read_timeout"])
+
 	def get_arduino_last_flash_options(self):
 		return self.__settings.get(["arduino", "last_flash_options"])
 
@@ -47,6 +47,8 @@ $(function() {
 
         self.arduinoUploadProgress = ko.observable(0);
         self.platformioUploadProgress = ko.observable(0);
+        self.arduinoDownloadProgress = ko.observable(0);
+        self.platformioDownloadProgress = ko.observable(0);
 
         self.onAllBound = function() {
             $("#arduino_firmware_file").fileupload(self.getFileUploadParams(self.arduinoUploadProgress));
@@ -71,6 +73,10 @@ $(function() {
                     self.handleArduinoFirmwareInfo(message);
                 } else if (message.type === "platformio_firmware_info") {
                     self.handlePlatformioFirmwareInfo(message);
+                } else if (message.type === "arduino_download_status") {
+                    self.handleDownloadStatus(self.arduinoDownloadProgress, message);
+                } else if (message.type === "platformio_download_status") {
+                    self.handleDownloadStatus(self.platformioDownloadProgress, message);
                 } else if (message.type === "arduino_boards") {
                     self.handleArduinoBoards(message);
                 } else if (message.type === "arduino_flash_status") {
@@ -93,6 +99,12 @@ $(function() {
             }
         };
 
+        self.handleDownloadStatus = function(downloadProgress, message) {
+            if(message.progress !== null) {
+                downloadProgress(message.progress);
+            }
+        };
+
         self.stderr = ko.observable();
 
         self.showCompilationError = function(stderr) {
@@ -125,6 +137,50 @@ $(function() {
                 self.settingsViewModel.settings.plugins.marlin_flasher.post_flash_delay("0");
             }
             self.settingsViewModel.settings.plugins.marlin_flasher.post_flash_delay(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.post_flash_delay()));
+            if(self.settingsViewModel.settings.plugins.marlin_flasher.object_cache_size() === "") {
+                self.settingsViewModel.settings.plugins.marlin_flasher.object_cache_size("0");
+            }
+            self.settingsViewModel.settings.plugins.marlin_flasher.object_cache_size(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.object_cache_size()));
+            if(self.settingsViewModel.settings.plugins.marlin_flasher.artifact_store_size() === "") {
+                self.settingsViewModel.settings.plugins.marlin_flasher.artifact_store_size("0");
+            }
+            self.settingsViewModel.settings.plugins.marlin_flasher.artifact_store_size(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.artifact_store_size()));
+            if(self.settingsViewModel.settings.plugins.marlin_flasher.port_release_timeout() === "") {
+                self.settingsViewModel.settings.plugins.marlin_flasher.port_release_timeout("10");
+            }
+            self.settingsViewModel.settings.plugins.marlin_flasher.port_release_timeout(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.port_release_timeout()));
+            ["busy", "idle"].forEach(function(profile) {
+                ["jobs", "nice"].forEach(function(key) {
+                    var value = self.settingsViewModel.settings.plugins.marlin_flasher.build_scheduler[profile][key];
+                    if(value() === "") {
+                        value("0");
+                    }
+                    value(parseInt(value()));
+                });
+            });
+            ["compile", "upload", "reconnect"].forEach(function(phase) {
+                var budget = self.settingsViewModel.settings.plugins.marlin_flasher.flash_budgets[phase];
+                if(budget() === "") {
+                    budget("0");
+                }
+                budget(parseInt(budget()));
+            });
+            if(self.settingsViewModel.settings.plugins.marlin_flasher.fleet_max_workers() === "") {
+                self.settingsViewModel.settings.plugins.marlin_flasher.fleet_max_workers("1");
+            }
+            self.settingsViewModel.settings.plugins.marlin_flasher.fleet_max_workers(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.fleet_max_workers()));
+            if(self.settingsViewModel.settings.plugins.marlin_flasher.download.connect_timeout() === "") {
+                self.settingsViewModel.settings.plugins.marlin_flasher.download.connect_timeout("10");
+            }
+            self.settingsViewModel.settings.plugins.marlin_flasher.download.connect_timeout(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.download.connect_timeout()));
+            if(self.settingsViewModel.settings.plugins.marlin_flasher.download.read_timeout() === "") {
+                self.settingsViewModel.settings.plugins.marlin_flasher.download.read_timeout("30");
+            }
+            self.settingsViewModel.settings.plugins.marlin_flasher.download.read_timeout(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.download.read_timeout()));
+            if(self.settingsViewModel.settings.plugins.marlin_flasher.arduino.build_cache_size() === "") {
+                self.settingsViewModel.settings.plugins.marlin_flasher.arduino.build_cache_size("0");
+            }
+            self.settingsViewModel.settings.plugins.marlin_flasher.arduino.build_cache_size(parseInt(self.settingsViewModel.settings.plugins.marlin_flasher.arduino.build_cache_size()));
         };
 
         self.currentlyFlashing = ko.observable(false);
@@ -135,11 +191,13 @@ $(function() {
 
         self.arduinoFirmwareVersion = ko.observable();
         self.arduinoFirmwareAuthor = ko.observable();
+        self.arduinoFirmwareConfiguration = ko.observable();
         self.arduinoUploadTime = ko.observable();
 
         self.handleArduinoFirmwareInfo = function(message) {
             self.arduinoFirmwareVersion(message.version);
             self.arduinoFirmwareAuthor(message.author);
+            self.arduinoFirmwareConfiguration(message.configuration);
             self.arduinoUploadTime(message.upload_time);
         };
 
@@ -231,6 +289,7 @@ $(function() {
 
         self.downloadArduinoFirmware = function() {
             self.downloadingArduinoFirmware(true);
+            self.arduinoDownloadProgress(0);
             $.ajax({
                 type: "POST",
                 headers: OctoPrint.getRequestHeaders("POST"),
@@ -384,8 +443,23 @@ $(function() {
         self.arduinoFlashProgress = ko.observable();
         self.arduinoFlashFinished = ko.observable();
         self.arduinoFlashSuccess = ko.observable();
+        self.arduinoFlashJob = ko.observable();
+
+        self.cancelArduinoFlash = function() {
+            $.ajax({
+                type: "POST",
+                headers: OctoPrint.getRequestHeaders("POST"),
+                url: "/plugin/marlin_flasher/arduino/flash/cancel",
+                data: {
+                    job: self.arduinoFlashJob()
+                }
+            }).fail(function(jqXHR) {
+                self.showErrors(gettext("Cancellation failed"), jqXHR.responseJSON);
+            });
+        };
 
         self.handleArduinoFlashStatus = function(message) {
+            this.arduinoFlashJob(message.job);
             this.arduinoFlashStep(message.step_name);
             this.arduinoFlashProgress(message.progress);
             this.arduinoFlashFinished(message.finished);
@@ -417,11 +491,13 @@ $(function() {
 
         self.platformioFirmwareVersion = ko.observable();
         self.platformioFirmwareAuthor = ko.observable();
+        self.platformioFirmwareConfiguration = ko.observable();
         self.platformioUploadTime = ko.observable();
 
         self.handlePlatformioFirmwareInfo = function(message) {
             self.platformioFirmwareVersion(message.version);
             self.platformioFirmwareAuthor(message.author);
+            self.platformioFirmwareConfiguration(message.configuration);
             self.platformioUploadTime(message.upload_time);
         };
 
@@ -462,6 +538,7 @@ $(function() {
 
         self.downloadPlatformioFirmware = function() {
             self.downloadingPlatformioFirmware(true);
+            self.platformioDownloadProgress(0);
             $.ajax({
                 type: "POST",
                 headers: OctoPrint.getRequestHeaders("POST"),
@@ -520,8 +597,23 @@ $(function() {
         self.platformioFlashProgress = ko.observable();
         self.platformioFlashFinished = ko.observable();
         self.platformioFlashSuccess = ko.observable();
+        self.platformioFlashJob = ko.observable();
+
+        self.cancelPlatformioFlash = function() {
+            $.ajax({
+                type: "POST",
+                headers: OctoPrint.getRequestHeaders("POST"),
+                url: "/plugin/marlin_flasher/platformio/flash/cancel",
+                data: {
+                    job: self.platformioFlashJob()
+                }
+            }).fail(function(jqXHR) {
+                self.showErrors(gettext("Cancellation failed"), jqXHR.responseJSON);
+            });
+        };
 
         self.handlePlatformioFlashStatus = function(message) {
+            this.platformioFlashJob(message.job);
             this.platformioFlashStep(message.step_name);
             this.platformioFlashProgress(message.progress);
             this.platformioFlashFinished(message.finished);
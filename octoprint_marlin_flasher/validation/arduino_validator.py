@@ -52,3 +52,9 @@ class ArduinoValidator(BaseValidator):
 		if "fqbn" not in flask.request.values:
 			errors.append(gettext("The fqbn field is missing"))
 		return errors
+
+	def validate_fleet_flash(self):
+		errors = BaseValidator.validate_fleet_flash(self)
+		if "fqbn" not in flask.request.values:
+			errors.append(gettext("The fqbn field is missing"))
+		return errors
@@ -18,3 +18,15 @@ class BaseValidator:
 		if "url" not in flask.request.values:
 			errors.append(gettext("The url field is missing"))
 		return errors
+
+	def validate_fleet_flash(self):
+		errors = []
+		if "ports" not in flask.request.values:
+			errors.append(gettext("The ports field is missing"))
+		return errors
+
+	def validate_artifact_flash(self):
+		errors = []
+		if "artifact" not in flask.request.values:
+			errors.append(gettext("The artifact field is missing"))
+		return errors
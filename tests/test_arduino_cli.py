@@ -0,0 +1,110 @@
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+import pyduinocli
+
+from octoprint_marlin_flasher.flasher.arduino_cli import ArduinoCli
+from octoprint_marlin_flasher.flasher.flash_job import FlashJob, FlashPhase
+from octoprint_marlin_flasher.flasher.process_runner import ProcessRunner
+
+
+FAKE_ARDUINO_CLI = """#!/bin/sh
+case "$3" in
+	version)
+		echo '{"VersionString": "0.35.3"}'
+		;;
+	compile)
+		# Like the toolchain started by arduino-cli, the child outlives its parent if only the parent is killed
+		sleep 60 &
+		echo $! > "%(pid_file)s"
+		wait
+		;;
+	*)
+		echo "Error: unknown command $3" >&2
+		exit 1
+		;;
+esac
+"""
+
+
+class ArduinoCliTest(unittest.TestCase):
+
+	def setUp(self):
+		self.logger = logging.getLogger("test_arduino_cli")
+		self.directory = tempfile.mkdtemp()
+		self.pid_file = os.path.join(self.directory, "compiler.pid")
+		self.cli_path = os.path.join(self.directory, "arduino-cli")
+		with open(self.cli_path, "w") as cli:
+			cli.write(FAKE_ARDUINO_CLI % dict(pid_file=self.pid_file))
+		os.chmod(self.cli_path, os.stat(self.cli_path).st_mode | stat.S_IXUSR)
+		self.runner = ProcessRunner(self.logger)
+		self.job = FlashJob(dict([(phase, 60) for phase in FlashPhase.ALL]), self.logger)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def create(self):
+		def start(command, line_handler, error_handler):
+			handle = self.runner.start(command, line_handler, error_handler=error_handler)
+			self.job.attach(handle)
+			return handle.wait()
+		return ArduinoCli.create(self.cli_path, None, start)
+
+	@staticmethod
+	def is_running(pid):
+		try:
+			with open("/proc/%d/stat" % pid) as f:
+				return f.read().rpartition(")")[2].split()[0] != "Z"
+		except OSError:
+			return False
+
+	def wait_pid(self):
+		deadline = time.time() + 5
+		while time.time() < deadline:
+			if os.path.isfile(self.pid_file):
+				with open(self.pid_file) as f:
+					content = f.read().strip()
+				if content:
+					return int(content)
+			time.sleep(0.05)
+		self.fail("The compiler was not started")
+
+	def test_output_is_parsed(self):
+		self.assertEqual(self.create().version()["result"], dict(VersionString="0.35.3"))
+
+	def test_failure_raises_the_error_output(self):
+		with self.assertRaises(pyduinocli.ArduinoError) as context:
+			self.create().board.listall()
+		self.assertIn("unknown command board", context.exception.result["__stderr"])
+
+	def test_cancel_kills_the_running_compile(self):
+		arduino = self.create()
+		errors = []
+
+		def compile_sketch():
+			try:
+				arduino.compile("sketch", fqbn="arduino:avr:mega")
+			except pyduinocli.ArduinoError as e:
+				errors.append(e)
+		thread = threading.Thread(target=compile_sketch, daemon=True)
+		thread.start()
+		pid = self.wait_pid()
+		self.assertTrue(self.is_running(pid))
+		self.job.cancel()
+		thread.join(10)
+		self.assertFalse(thread.is_alive())
+		self.assertEqual(len(errors), 1)
+		deadline = time.time() + 5
+		while self.is_running(pid) and time.time() < deadline:
+			time.sleep(0.05)
+		self.assertFalse(self.is_running(pid))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,55 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from octoprint_marlin_flasher.flasher.artifact_store import ArtifactStore
+from octoprint_marlin_flasher.flasher.flasher_error import FlasherError
+
+
+class ArtifactStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.store = ArtifactStore(os.path.join(self.directory, "store"), logging.getLogger("test_artifact_store"))
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def add_artifact(self, artifact_id, size):
+		source_dir = os.path.join(self.directory, artifact_id)
+		build_dir = os.path.join(source_dir, "build")
+		os.makedirs(build_dir)
+		with open(os.path.join(source_dir, "firmware.ino"), "wb") as f:
+			f.write(os.urandom(size))
+		with open(os.path.join(build_dir, "firmware.hex"), "wb") as f:
+			f.write(os.urandom(size))
+		files = {"firmware.ino": ArtifactStore.get_file_hash(os.path.join(source_dir, "firmware.ino"))}
+		self.store.add_sources(artifact_id, "arduino", "ino", "firmware.ino", source_dir, files, None, None)
+		self.store.add_build(artifact_id, "arduino:avr:mega", build_dir, ["firmware.hex"])
+
+	def test_eviction_keeps_the_checkout_in_use(self):
+		self.add_artifact("a" * 64, 1000)
+		checkout_dir = self.store.checkout_build("a" * 64, "arduino:avr:mega")
+		self.add_artifact("b" * 64, 1000)
+		self.store.evict(0, keep="b" * 64)
+		self.assertIsNone(self.store.get("a" * 64))
+		self.assertTrue(os.path.isfile(os.path.join(checkout_dir, "firmware.hex")))
+		self.store.release_checkout(checkout_dir)
+		self.store.evict(0, keep="b" * 64)
+		self.assertFalse(os.path.exists(checkout_dir))
+
+	def test_blob_is_not_stored_under_another_digest(self):
+		source_dir = os.path.join(self.directory, "sources")
+		os.makedirs(source_dir)
+		with open(os.path.join(source_dir, "firmware.ino"), "wb") as f:
+			f.write(b"void setup() {}")
+		with self.assertRaises(FlasherError):
+			self.store.add_sources("c" * 64, "arduino", "ino", "firmware.ino", source_dir, {"firmware.ino": "d" * 64}, None, None)
+		self.assertFalse(os.path.exists(os.path.join(self.directory, "store", "blobs", "dd", "d" * 64)))
+		self.assertFalse(os.path.exists(os.path.join(self.directory, "store", "blobs", "dd", "d" * 64 + ".partial")))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from octoprint_marlin_flasher.flasher.firmware_download import FirmwareDownloader
+
+
+class FirmwareServer(ThreadingHTTPServer):
+
+	def __init__(self):
+		super().__init__(("127.0.0.1", 0), FirmwareRequestHandler)
+		self.content = os.urandom(100000)
+		self.etag = "\"v1\""
+		self.ignore_ranges = False
+		self.requests = []
+		self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+	def get_url(self):
+		return "http://127.0.0.1:%d/firmware.hex" % self.server_address[1]
+
+	def start(self):
+		self.__thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+class FirmwareRequestHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		server = self.server
+		server.requests.append(dict(self.headers))
+		if self.headers.get("If-None-Match") == server.etag:
+			self.send_response(304)
+			self.send_header("ETag", server.etag)
+			self.end_headers()
+			return
+		content = server.content
+		requested_range = self.headers.get("Range")
+		if_range = self.headers.get("If-Range")
+		if requested_range and not server.ignore_ranges and (if_range is None or if_range == server.etag):
+			start = int(requested_range[len("bytes="):].rstrip("-"))
+			if start >= len(content):
+				self.send_response(416)
+				self.send_header("Content-Range", "bytes */%d" % len(content))
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+				return
+			self.send_response(206)
+			self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(content) - 1, len(content)))
+			content = content[start:]
+		else:
+			self.send_response(200)
+		self.send_header("ETag", server.etag)
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, *args):
+		pass
+
+
+class FirmwareDownloaderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.server = FirmwareServer().start()
+		self.downloader = FirmwareDownloader(self.directory, logging.getLogger("test_firmware_download"))
+		self.key = hashlib.sha256(self.server.get_url().encode("utf-8")).hexdigest()
+
+	def tearDown(self):
+		self.server.stop()
+		shutil.rmtree(self.directory)
+
+	def download(self):
+		path = self.downloader.download(self.server.get_url(), 5, 5)
+		with open(path, "rb") as f:
+			return f.read()
+
+	def leave_partial(self, content, etag):
+		path = os.path.join(self.directory, self.key)
+		with open(path + ".partial", "wb") as f:
+			f.write(content)
+		with open(path + ".json", "w") as f:
+			json.dump(dict(url=self.server.get_url(), etag=etag, last_modified=None, complete=False), f)
+
+	def test_unchanged_firmware_is_not_downloaded_again(self):
+		self.assertEqual(self.download(), self.server.content)
+		self.assertEqual(self.download(), self.server.content)
+		self.assertEqual(self.server.requests[1].get("If-None-Match"), self.server.etag)
+
+	def test_partial_download_is_resumed(self):
+		self.leave_partial(self.server.content[:30000], self.server.etag)
+		self.assertEqual(self.download(), self.server.content)
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(self.server.requests[0].get("Range"), "bytes=30000-")
+		self.assertEqual(self.server.requests[0].get("If-Range"), self.server.etag)
+
+	def test_changed_firmware_is_downloaded_from_the_start(self):
+		self.leave_partial(os.urandom(30000), "\"v0\"")
+		self.assertEqual(self.download(), self.server.content)
+		self.assertEqual(len(self.server.requests), 1)
+
+	def test_unsatisfiable_range_starts_over(self):
+		self.leave_partial(os.urandom(len(self.server.content) + 10), self.server.etag)
+		self.assertEqual(self.download(), self.server.content)
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertNotIn("Range", self.server.requests[1])
+		self.assertNotIn("If-Range", self.server.requests[1])
+
+	def test_ignored_range_starts_over(self):
+		self.server.ignore_ranges = True
+		self.leave_partial(self.server.content[:30000], self.server.etag)
+		self.assertEqual(self.download(), self.server.content)
+
+
+if __name__ == "__main__":
+	unittest.main()
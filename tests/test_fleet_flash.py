@@ -0,0 +1,207 @@
+import logging
+import os
+import pty
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import serial
+
+from octoprint_marlin_flasher.flasher.base_flasher import BaseFlasher
+from octoprint_marlin_flasher.flasher.flash_job import FlashJob, FlashPhase
+from octoprint_marlin_flasher.flasher.fleet_flash import FleetPortStatus
+from octoprint_marlin_flasher.settings.settings_wrapper import SettingsWrapper
+
+
+class FakeBoard:
+
+	def __init__(self):
+		self.master, slave = pty.openpty()
+		self.port = os.ttyname(slave)
+		# Nothing holds the port until the printer or an uploader opens it
+		os.close(slave)
+		self.received = b""
+		self.__stopped = False
+		self.__thread = threading.Thread(target=self.__serve, daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		self.__stopped = True
+		self.__thread.join(5)
+		os.close(self.master)
+
+	def __serve(self):
+		while not self.__stopped:
+			try:
+				self.received += os.read(self.master, 1024)
+			except OSError:
+				# Reading fails while nobody has the port open
+				time.sleep(0.01)
+
+
+class FakePrinter:
+
+	def __init__(self, port):
+		self.stuck = False
+		self.__fd = None
+		self.__port = None
+		self.connect(port, 115200, "_default")
+
+	def get_current_connection(self):
+		return "Operational", self.__port, 115200, "_default"
+
+	def is_ready(self):
+		return True
+
+	def is_printing(self):
+		return False
+
+	def is_paused(self):
+		return False
+
+	def commands(self, commands):
+		pass
+
+	def connect(self, port, baudrate, profile):
+		self.__port = port
+		self.__fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+
+	def disconnect(self):
+		# A stuck connection keeps the port open, like a serial thread that did not exit
+		if not self.stuck:
+			self.close()
+		self.__port = None
+
+	def close(self):
+		if self.__fd is not None:
+			os.close(self.__fd)
+			self.__fd = None
+
+
+class FakeSettings:
+
+	def __init__(self, values):
+		self.__values = values
+
+	def get(self, path):
+		value = self.__values
+		for key in path:
+			value = value.get(key) if isinstance(value, dict) else None
+		return value
+
+	def get_int(self, path):
+		return self.get(path)
+
+
+class FakePlugin:
+
+	def __init__(self, data_folder):
+		self.__data_folder = data_folder
+
+	def get_plugin_data_folder(self):
+		return self.__data_folder
+
+
+class FakePluginManager:
+
+	def __init__(self):
+		self.messages = []
+
+	def send_plugin_message(self, identifier, data):
+		self.messages.append(data)
+
+
+class FleetFlashTest(unittest.TestCase):
+
+	FIRMWARE = os.urandom(4096)
+
+	def setUp(self):
+		self.logger = logging.getLogger("test_fleet_flash")
+		self.data_folder = tempfile.mkdtemp()
+		self.boards = [FakeBoard() for _ in range(3)]
+		self.ports = [board.port for board in self.boards]
+		self.printer = FakePrinter(self.ports[0])
+		self.plugin_manager = FakePluginManager()
+		settings = SettingsWrapper(FakeSettings(dict(
+			pre_flash_script=None,
+			post_flash_script=None,
+			post_flash_delay=0,
+			port_release_timeout=1,
+			fleet_max_workers=2,
+			flash_budgets=dict(compile=60, upload=60, reconnect=60)
+		)))
+		self.flasher = BaseFlasher(settings, self.printer, FakePlugin(self.data_folder), self.plugin_manager, "marlin_flasher", self.logger, None, None, None)
+		self.flasher._flash_job = FlashJob(dict([(phase, 60) for phase in FlashPhase.ALL]), self.logger)
+		self.uploaded_ports = []
+		self.__lock = threading.Lock()
+		self.__running = 0
+		self.max_running = 0
+
+	def tearDown(self):
+		self.printer.close()
+		for board in self.boards:
+			board.stop()
+		shutil.rmtree(self.data_folder)
+
+	def upload(self, port):
+		# Stands in for avrdude or PlatformIO, it writes the firmware to the board
+		with self.__lock:
+			self.uploaded_ports.append(port)
+			self.__running += 1
+			self.max_running = max(self.max_running, self.__running)
+		try:
+			with serial.Serial(port, 115200, timeout=1) as connection:
+				connection.write(self.FIRMWARE)
+				connection.flush()
+				time.sleep(0.1)
+		finally:
+			with self.__lock:
+				self.__running -= 1
+		return True, "Board successfully flashed.", None
+
+	def wait_received(self, board):
+		deadline = time.time() + 5
+		while len(board.received) < len(self.FIRMWARE) and time.time() < deadline:
+			time.sleep(0.01)
+		return board.received
+
+	def run_fleet_flash(self, upload):
+		self.flasher._run_fleet_flash(self.ports, upload, "flash_status", "fleet_status", "")
+		return self.flasher._flash_status
+
+	def test_every_board_is_flashed(self):
+		status = self.run_fleet_flash(self.upload)
+		self.assertTrue(status["success"])
+		self.assertEqual(status["fleet"]["succeeded"], 3)
+		self.assertEqual(sorted(self.uploaded_ports), sorted(self.ports))
+		self.assertLessEqual(self.max_running, 2)
+		for board in self.boards:
+			self.assertEqual(self.wait_received(board), self.FIRMWARE)
+		self.assertEqual(self.printer.get_current_connection()[1], self.ports[0])
+
+	def test_unreleased_printer_port_fails(self):
+		self.printer.stuck = True
+		status = self.run_fleet_flash(self.upload)
+		self.assertFalse(status["success"])
+		self.assertNotIn(self.ports[0], self.uploaded_ports)
+		self.assertEqual(sorted(self.uploaded_ports), sorted(self.ports[1:]))
+		results = dict([(result["port"], result) for result in status["fleet"]["results"]])
+		self.assertEqual(results[self.ports[0]]["status"], FleetPortStatus.FAILED)
+		self.assertEqual(status["fleet"]["failed"], 1)
+		self.assertEqual(self.boards[0].received, b"")
+
+	def test_failing_upload_does_not_stop_the_others(self):
+		def upload(port):
+			if port == self.ports[1]:
+				raise serial.SerialException("could not open port")
+			return self.upload(port)
+		status = self.run_fleet_flash(upload)
+		self.assertEqual(status["fleet"]["succeeded"], 2)
+		self.assertEqual(status["fleet"]["failed"], 1)
+		self.assertIn("could not open port", status["error_output"])
+
+
+if __name__ == "__main__":
+	unittest.main()
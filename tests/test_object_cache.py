@@ -0,0 +1,74 @@
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from octoprint_marlin_flasher.flasher.object_cache import ObjectCache
+from octoprint_marlin_flasher.flasher.process_runner import ProcessRunner
+
+
+# ccache 4.x knows --print-stats
+FAKE_CCACHE_4 = """#!/bin/sh
+if [ "$1" = "--print-stats" ]; then
+	printf 'direct_cache_hit\\t3\\npreprocessed_cache_hit\\t2\\ncache_miss\\t7\\n'
+	exit 0
+fi
+exit 1
+"""
+
+# Before ccache 3.7, only the human readable summary exists
+FAKE_CCACHE_3 = """#!/bin/sh
+if [ "$1" = "-s" ]; then
+	echo "cache directory                     $CCACHE_DIR"
+	echo "cache hit (direct)                     4"
+	echo "cache hit (preprocessed)               1"
+	echo "cache miss                             9"
+	echo "files in cache                        28"
+	exit 0
+fi
+echo "ccache: invalid option -- '$1'" >&2
+exit 1
+"""
+
+
+class ObjectCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.logger = logging.getLogger("test_object_cache")
+		self.directory = tempfile.mkdtemp()
+		self.bin_dir = os.path.join(self.directory, "bin")
+		os.makedirs(self.bin_dir)
+		cache_dir = os.path.join(self.directory, "object_cache")
+		os.makedirs(os.path.join(cache_dir, "ccache"))
+		self.cache = ObjectCache(cache_dir, self.logger, ProcessRunner(self.logger))
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def get_arduino_stats(self, script):
+		ccache_path = os.path.join(self.bin_dir, "ccache")
+		with open(ccache_path, "w") as ccache:
+			ccache.write(script)
+		os.chmod(ccache_path, os.stat(ccache_path).st_mode | stat.S_IXUSR)
+		with mock.patch.dict(os.environ, dict(PATH=self.bin_dir + os.pathsep + os.environ.get("PATH", ""))):
+			return self.cache.get_stats()["arduino"]
+
+	def test_stats_are_read_with_print_stats(self):
+		stats = self.get_arduino_stats(FAKE_CCACHE_4)
+		self.assertEqual(stats["hits"], 5)
+		self.assertEqual(stats["misses"], 7)
+
+	def test_stats_fall_back_to_the_summary(self):
+		stats = self.get_arduino_stats(FAKE_CCACHE_3)
+		self.assertEqual(stats["hits"], 5)
+		self.assertEqual(stats["misses"], 9)
+
+	def test_no_stats_when_ccache_fails(self):
+		self.assertIsNone(self.get_arduino_stats("#!/bin/sh\nexit 1\n"))
+
+
+if __name__ == "__main__":
+	unittest.main()
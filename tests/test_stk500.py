@@ -0,0 +1,209 @@
+import logging
+import os
+import pty
+import threading
+import tty
+import unittest
+
+from octoprint_marlin_flasher.flasher.intel_hex import IntelHexImage
+from octoprint_marlin_flasher.flasher.stk500 import Stk500Programmer
+
+
+class BootloaderSimulator:
+
+	def __init__(self, signature, flash_size, page_size):
+		self.signature = signature
+		self.page_size = page_size
+		# The board still holds a previous firmware
+		self.flash = bytearray(os.urandom(flash_size))
+		self.written_pages = []
+		self.master, slave = pty.openpty()
+		tty.setraw(self.master)
+		tty.setraw(slave)
+		self.port = os.ttyname(slave)
+		self.__slave = slave
+		self.__thread = threading.Thread(target=self.__serve, daemon=True)
+
+	def start(self):
+		self.__thread.start()
+		return self
+
+	def stop(self):
+		self.__thread.join(5)
+		os.close(self.master)
+		os.close(self.__slave)
+
+	def erase(self, address):
+		self.flash[address:address + self.page_size] = b"\xff" * self.page_size
+
+	def program(self, address, data):
+		# Programming only clears bits, a page that was not erased ends up corrupted
+		self.written_pages.append(address)
+		for offset, byte in enumerate(data):
+			self.flash[address + offset] &= byte
+
+	def read(self, size):
+		data = b""
+		while len(data) < size:
+			data += os.read(self.master, size - len(data))
+		return data
+
+	def write(self, data):
+		os.write(self.master, data)
+
+	def __serve(self):
+		try:
+			self.serve()
+		except OSError:
+			pass
+
+	def serve(self):
+		raise NotImplementedError()
+
+
+class OptibootSimulator(BootloaderSimulator):
+
+	def serve(self):
+		address = 0
+		while True:
+			command = self.read(1)[0]
+			if command == 0x30 or command == 0x50:
+				self.read(1)
+				self.write(b"\x14\x10")
+			elif command == 0x51:
+				self.read(1)
+				self.write(b"\x14\x10")
+				return
+			elif command == 0x75:
+				self.read(1)
+				self.write(b"\x14" + self.signature + b"\x10")
+			elif command == 0x55:
+				data = self.read(3)
+				address = (data[0] | data[1] << 8) * 2
+				self.write(b"\x14\x10")
+			elif command == 0x64:
+				header = self.read(3)
+				size = header[0] << 8 | header[1]
+				data = self.read(size)
+				self.read(1)
+				# Optiboot erases the page it was given before writing it
+				self.erase(address)
+				self.program(address, data)
+				self.write(b"\x14\x10")
+			elif command == 0x74:
+				header = self.read(4)
+				size = header[0] << 8 | header[1]
+				self.write(b"\x14" + bytes(self.flash[address:address + size]) + b"\x10")
+
+
+class WiringSimulator(BootloaderSimulator):
+
+	def serve(self):
+		address = 0
+		erase_address = 0
+		while True:
+			while self.read(1)[0] != 0x1B:
+				pass
+			header = self.read(4)
+			body = self.read(header[1] << 8 | header[2])
+			self.read(1)
+			command = body[0]
+			answer = bytes([command, 0x00])
+			if command == 0x01:
+				answer += b"\x08AVRISP_2"
+			elif command == 0x1B:
+				answer += bytes([self.signature[body[4]], 0x00])
+			elif command == 0x06:
+				address = (int.from_bytes(body[1:5], "big") & 0x7FFFFFFF) * 2
+			elif command == 0x13:
+				size = body[1] << 8 | body[2]
+				# Like the Mega2560 bootloader, the erased page comes from its own counter, not from the loaded address
+				self.erase(erase_address)
+				erase_address += self.page_size
+				self.program(address, body[10:10 + size])
+				address += size
+			elif command == 0x14:
+				size = body[1] << 8 | body[2]
+				answer += bytes(self.flash[address:address + size]) + b"\x00"
+				address += size
+			message = bytes([0x1B, header[0], len(answer) >> 8, len(answer) & 0xFF, 0x0E]) + answer
+			checksum = 0
+			for byte in message:
+				checksum ^= byte
+			self.write(message + bytes([checksum]))
+			if command == 0x11:
+				return
+
+
+class Stk500ProgrammerTest(unittest.TestCase):
+
+	ATMEGA328P = b"\x1e\x95\x0f"
+	ATMEGA2560 = b"\x1e\x98\x01"
+
+	def setUp(self):
+		self.logger = logging.getLogger("test_stk500")
+
+	@staticmethod
+	def gapped_image(size, gap_start, gap_end):
+		data = os.urandom(size)
+		return IntelHexImage([(0, bytearray(data[:gap_start])), (gap_end, bytearray(data[gap_end:]))])
+
+	def program(self, simulator, protocol, image, flashed_pages=None):
+		simulator.start()
+		try:
+			return Stk500Programmer.create(protocol, simulator.port, 115200, self.logger).program(image, flashed_pages=flashed_pages)
+		finally:
+			simulator.stop()
+
+	def test_stk500v1_writes_a_gapped_firmware(self):
+		simulator = OptibootSimulator(self.ATMEGA328P, 32768, 128)
+		image = self.gapped_image(6000, 1000, 3000)
+		self.program(simulator, "arduino", image)
+		for address, data in image.get_segments():
+			self.assertEqual(bytes(simulator.flash[address:address + len(data)]), data)
+
+	def test_stk500v2_pads_the_gaps_of_the_firmware(self):
+		simulator = WiringSimulator(self.ATMEGA2560, 262144, 256)
+		image = self.gapped_image(20000, 1000, 9000)
+		record = self.program(simulator, "wiring", image)
+		self.assertEqual(bytes(simulator.flash[:image.get_end()]), image.get_bytes(0))
+		self.assertEqual(simulator.written_pages, list(range(0, image.get_end(), 256)))
+		self.assertEqual(len(record["pages"]), len(simulator.written_pages))
+
+	def test_stk500v2_writes_from_the_first_page(self):
+		simulator = WiringSimulator(self.ATMEGA2560, 262144, 256)
+		image = IntelHexImage([(1024, bytearray(os.urandom(2000)))])
+		self.program(simulator, "wiring", image)
+		self.assertEqual(bytes(simulator.flash[:image.get_end()]), image.get_bytes(0))
+
+	def test_stk500v1_only_writes_the_changed_pages(self):
+		image = IntelHexImage([(0, bytearray(os.urandom(4096)))])
+		simulator = OptibootSimulator(self.ATMEGA328P, 32768, 128)
+		record = self.program(simulator, "arduino", image)
+		changed = bytearray(image.get_bytes(0))
+		changed[1000] ^= 0xFF
+		changed_image = IntelHexImage([(0, changed)])
+		board = simulator.flash
+		simulator = OptibootSimulator(self.ATMEGA328P, 32768, 128)
+		simulator.flash = board
+		self.program(simulator, "arduino", changed_image, flashed_pages=record)
+		self.assertEqual(simulator.written_pages, [896])
+		self.assertEqual(bytes(simulator.flash[:4096]), bytes(changed))
+
+	def test_stk500v2_ignores_the_flashed_pages(self):
+		image = IntelHexImage([(0, bytearray(os.urandom(4096)))])
+		simulator = WiringSimulator(self.ATMEGA2560, 262144, 256)
+		record = self.program(simulator, "wiring", image)
+		changed = bytearray(image.get_bytes(0))
+		changed[3000] ^= 0xFF
+		changed_image = IntelHexImage([(0, changed)])
+		board = simulator.flash
+		simulator = WiringSimulator(self.ATMEGA2560, 262144, 256)
+		simulator.flash = board
+		self.program(simulator, "wiring", changed_image, flashed_pages=record)
+		self.assertEqual(simulator.written_pages, list(range(0, 4096, 256)))
+		self.assertEqual(bytes(simulator.flash[:4096]), bytes(changed))
+
+
+if __name__ == "__main__":
+	unittest.main()